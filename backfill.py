@@ -0,0 +1,322 @@
+#######################################################################################################################################################
+# Description :
+#     This program will backfill the historical data from the csv files in the AlphaVantage layout (timestamp,open,close,volume,...) :
+#         1. Find the csv files in the given directories, the stock of each file is given by its name (IBM.csv or financial_data_IBM.csv).
+#         2. Parse and check the files in a process pool, the rows of each file are sent in batches to a bounded queue.
+#         3. Insert the batches into database by one writer, because SQLite allows only one writer at the same time.
+#            The cumulative sum, bars, watermark and symbol table of a stock are updated when its file is finished.
+#         4. Record each finished file in the progress file, the recorded files are skipped when the backfill is started again after interruption.
+#         5. Print the progress and throughput while the files are processed.
+#         6. Publish the data version and the snapshot for the API server when all the files are finished.
+#
+# Remark :
+#     Run this program under project path, for example : python3 backfill.py archive/ --workers 4
+#     Only the data after --since is inserted, it is the expired date of house keeping by default. Set FINANCIAL_RETENTION_DAYS to keep the history.
+#     Do not run it with get_raw_data.py at the same time.
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# CSV data process
+import csv
+import itertools
+# Get the expired date
+import datetime
+# SQL function
+from sqlite3 import Error
+# File operation
+import os
+import glob
+import json
+# The files are parsed by a process pool and the batches are sent to the writer by a queue
+import multiprocessing
+import queue
+import signal
+from concurrent.futures import ProcessPoolExecutor
+import time
+# Check the prices are finite
+import math
+# Shared ingest functions
+import get_raw_data
+
+
+# Queue of the batches to the writer, it is given to each worker process when the process is started
+worker_queue = None
+
+
+# This functoin is used to keep the queue in the worker process
+# input : data_queue - queue of the batches to the writer
+def init_worker(data_queue):
+    global worker_queue
+    worker_queue = data_queue
+    # The interruption is handled by the writer, it stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The worker can exit when the writer is interrupted and stops reading the queue, the unsent rows are dropped and the file is processed again
+    worker_queue.cancel_join_thread()
+
+
+# This functoin is used to get the stocks name of a csv file from the file name
+# input : path - csv file name, such as IBM.csv or financial_data_IBM.csv
+# output : name - stocks name stored in table
+def get_file_symbol(path):
+    symbol = os.path.splitext(os.path.basename(path))[0]
+    if symbol.startswith('financial_data_'):
+        symbol = symbol[len('financial_data_'):]
+    return get_raw_data.get_symbol_name(symbol)
+
+
+# This functoin is used to find the csv files in the given directories or files
+# input : paths - list of directory or csv file names
+# output : files - csv file names in order, the duplicated files are removed
+def find_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))))
+        else:
+            files.append(path)
+    return list(dict.fromkeys([os.path.abspath(path) for path in files]))
+
+
+# This functoin is used to get the key of a file in the progress file, the file is processed again if it is changed
+# input : path - csv file name
+# output : key - [file name, size, modified time]
+def get_file_key(path):
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
+
+# This functoin is used to read the finished files from the progress file
+# input : progress_file - progress file name
+# output : finished - set of the keys of the finished files
+def read_progress(progress_file):
+    finished = set()
+    try:
+        with open(progress_file, 'r') as fprogress:
+            for line in fprogress:
+                try:
+                    finished.add(tuple(json.loads(line)['key']))
+                except (ValueError, KeyError, TypeError):
+                    # The last line can be partial if the backfill is killed while it is written
+                    continue
+    except OSError:
+        pass
+    return finished
+
+
+# This functoin is used to parse and check one csv file in a worker process, the rows are sent to the writer in batches
+# input : path  - csv file name
+#         since - only the data after this date is inserted
+# output : the last item of the file is sent to the queue as [path, name, None, stats]
+#              stats - dictionary of rows_parsed, rows_rejected, first_date and error of the file
+def parse_file(path, since):
+    name = get_file_symbol(path)
+    stats = {'rows_parsed': 0, 'rows_rejected': 0, 'first_date': None, 'error': None}
+    try:
+        with open(path, 'r', newline='', encoding='utf-8') as fcsv:
+            header = next(fcsv, '')
+            index = next(csv.reader([header]), [])
+            if not {'timestamp', 'open', 'close', 'volume'}.issubset(index):
+                stats['error'] = 'The file doesn\'t have available index [timestamp, open, close, volume] in it'
+                return
+            for data in get_raw_data.parse_financial_data(name, itertools.chain([header], fcsv), since):
+                # Check the date and values, the wrong rows are rejected
+                rows = []
+                for row in data:
+                    try:
+                        datetime.date.fromisoformat(row[1])
+                    except ValueError:
+                        stats['rows_rejected'] += 1
+                        continue
+                    # nan and inf can not be converted to the integer cumulative sum
+                    if not all([math.isfinite(value) for value in row[2:5]]) or row[2] < 0 or row[3] < 0 or row[4] < 0:
+                        stats['rows_rejected'] += 1
+                        continue
+                    rows.append(row)
+                if rows:
+                    stats['rows_parsed'] += len(rows)
+                    stats['first_date'] = min([stats['first_date'] or rows[0][1]] + [row[1] for row in rows])
+                    worker_queue.put([path, name, rows])
+    except (OSError, UnicodeDecodeError) as e:
+        stats['error'] = '%s' % (e)
+    finally:
+        worker_queue.put([path, name, None, stats])
+
+
+# This functoin is used to print the progress of the backfill
+# input : summary - summary of current run
+#         total   - number of files to be processed
+def print_progress(summary, total):
+    elapsed = time.perf_counter() - summary['started']
+    rate = summary['rows_inserted'] / elapsed if elapsed > 0 else 0
+    done = summary['files_finished']
+    eta = elapsed / done * (total - done) if done > 0 else 0
+    print('Backfill [%d/%d] files, %d rows parsed, %d rows inserted, %.0f rows/sec, elapsed %.1fs, ETA %.1fs' % (done, total, summary['rows_parsed'], summary['rows_inserted'], rate, elapsed, eta))
+
+
+# This functoin is used to insert the batches from the queue into table until all the files are finished, only this process writes the database
+# input : con             - db connect point
+#         cur             - db cursor point
+#         data_queue      - queue of [path, name, data] to be inserted into table, data is None when the file is finished
+#         futures         - futures of the worker processes, the backfill stops if the process pool is broken
+#         keys            - dict of file name : key of the file in the progress file
+#         progress_file   - progress file name, each finished file is appended to it
+#         summary         - summary of current run, it is updated by this function
+#         report_interval - seconds between two progress reports, None to disable the reports
+def write_batches(con, cur, data_queue, futures, keys, progress_file, summary, report_interval):
+    remaining = len(keys)
+    last_report = time.perf_counter()
+    with open(progress_file, 'a') as fprogress:
+        while remaining > 0:
+            if report_interval is not None and time.perf_counter() - last_report >= report_interval:
+                print_progress(summary, len(keys))
+                last_report = time.perf_counter()
+            try:
+                item = data_queue.get(timeout=1)
+            except queue.Empty:
+                # A worker process is killed, the files of it will never be finished
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception()
+                continue
+            path, name, data = item[:3]
+            if data is not None:
+                # The first date of the unfinished file, it is recorded before the insert so that the committed rows are rolled up if the backfill is interrupted
+                summary['unfinished'][path] = [name, min([summary['unfinished'].get(path, [name, data[0][1]])[1]] + [row[1] for row in data])]
+                summary['rows_parsed'] += len(data)
+                summary['rows_inserted'] += get_raw_data.insert_table(con, cur, data)
+                continue
+            stats = item[3]
+            # Update the cumulative sum and the bars from the first date of the file, the rows inserted before an interruption are also included
+            if stats['first_date'] is not None:
+                summary['unfinished'][path] = [name, stats['first_date']]
+                get_raw_data.update_cumsum(con, cur, name, stats['first_date'])
+                get_raw_data.update_bars(con, cur, name, stats['first_date'])
+                get_raw_data.update_watermark(con, cur, name)
+                get_raw_data.register_symbol(con, cur, name)
+                summary['symbols'].add(name)
+            if stats['error']:
+                print('Error : Fail to backfill the file [%s]\n%s' % (path, stats['error']))
+                summary['files_failed'] += 1
+            summary['rows_rejected'] += stats['rows_rejected']
+            summary['files_finished'] += 1
+            # The file is recorded after its data is committed
+            fprogress.write(json.dumps({'key': keys[path], 'symbol': name, 'rows_parsed': stats['rows_parsed'], 'rows_rejected': stats['rows_rejected'], 'error': stats['error']}) + '\n')
+            fprogress.flush()
+            summary['unfinished'].pop(path, None)
+            remaining -= 1
+
+
+# This functoin is used to update the cumulative sum, bars and symbol table of the files which are not finished when the backfill is interrupted
+# Their rows are committed, so the data served after the interruption is consistent. The watermark is not moved because the files are not fully inserted
+# input : con     - db connect point
+#         cur     - db cursor point
+#         summary - summary of current run, the stocks of the unfinished files are added to its symbols
+def roll_up_unfinished(con, cur, summary):
+    first_dates = {}
+    for name, first_date in summary['unfinished'].values():
+        first_dates[name] = min(first_dates.get(name, first_date), first_date)
+    for name in first_dates:
+        try:
+            get_raw_data.update_cumsum(con, cur, name, first_dates[name])
+            get_raw_data.update_bars(con, cur, name, first_dates[name])
+            get_raw_data.register_symbol(con, cur, name)
+            summary['symbols'].add(name)
+        except Error as e:
+            print('Error : Fail to update the cumulative sum, bars and symbol table of stock [%s]\n%s' % (name, e))
+
+
+# This functoin is used to notify the API server that the data is changed by publishing the data version and snapshot
+# input : db_file - database file name
+#         symbols - stocks changed by the backfill
+def publish_backfill(db_file, symbols):
+    version = get_raw_data.publish_data_version(db_file, sorted(symbols))
+    snapshot_file = get_raw_data.SNAPSHOT_FILE if db_file == get_raw_data.DATABASE else db_file + '.snapshot'
+    try:
+        get_raw_data.publish_snapshot(db_file, version, snapshot_file)
+    except (OSError, Error) as e:
+        print('Error : Fail to publish the snapshot of [%s]\n%s' % (db_file, e))
+
+
+# This functoin is used to backfill the csv files into database
+# input : db_file         - database file name
+#         paths           - list of directory or csv file names
+#         workers         - number of worker processes to parse the files
+#         since           - only the data after this date is inserted
+#         progress_file   - progress file name, the recorded files are skipped
+#         restart         - True to process all the files again and ignore the progress file
+#         report_interval - seconds between two progress reports, None to disable the reports
+# output : summary - dictionary of the number of files and rows, elapsed seconds and rows/sec of this run
+def run_backfill(db_file, paths, workers, since, progress_file, restart=False, report_interval=5.0):
+    if restart and os.path.exists(progress_file):
+        os.remove(progress_file)
+    finished = read_progress(progress_file)
+    files = find_files(paths)
+    keys = dict([(path, get_file_key(path)) for path in files])
+    keys = dict([(path, keys[path]) for path in files if tuple(keys[path]) not in finished])
+    summary = {'started': time.perf_counter(), 'files': len(files), 'files_skipped': len(files) - len(keys), 'files_finished': 0, 'files_failed': 0, 'rows_parsed': 0, 'rows_rejected': 0, 'rows_inserted': 0, 'symbols': set(), 'unfinished': {}}
+    print('Backfill %d files into [%s] with %d workers, %d files are finished before, the data after [%s] is inserted' % (len(files), db_file, workers, summary['files_skipped'], since))
+    if keys:
+        connection = get_raw_data.db_connection(db_file)
+        cursor = connection.cursor()
+        get_raw_data.prepare_table(connection, cursor)
+        # The backfill can be done again from the progress file, so the commit does not wait for the disk
+        cursor.execute(''' PRAGMA journal_mode = WAL ''')
+        cursor.execute(''' PRAGMA synchronous = NORMAL ''')
+        # The workers wait when the queue is full so that the memory is bounded by the writer
+        data_queue = multiprocessing.Queue(maxsize=get_raw_data.INSERT_QUEUE_SIZE * max(1, workers))
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(data_queue, ))
+        futures = []
+        completed = False
+        try:
+            futures = [executor.submit(parse_file, path, str(since)) for path in keys]
+            write_batches(connection, cursor, data_queue, futures, keys, progress_file, summary, report_interval)
+            completed = True
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            # The workers blocked by the full queue finish the current file, the rows are dropped and the file is processed again in the next run
+            while not all([future.done() for future in futures]):
+                try:
+                    data_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            if not completed:
+                roll_up_unfinished(connection, cursor, summary)
+            cursor.close()
+            connection.close()
+            # The inserted rows are committed, so the data is also published after an interruption, otherwise the API server keeps serving the old snapshot
+            if completed or summary['rows_inserted'] > 0:
+                publish_backfill(db_file, summary['symbols'])
+    summary['elapsed'] = time.perf_counter() - summary['started']
+    summary['rows_per_sec'] = summary['rows_inserted'] / summary['elapsed'] if summary['elapsed'] > 0 else 0
+    summary['symbols'] = len(summary['symbols'])
+    del summary['started']
+    del summary['unfinished']
+    return summary
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the historical data from the csv files in the AlphaVantage layout')
+    parser.add_argument('paths', nargs='+', help='directories of the csv files or csv file names')
+    parser.add_argument('--database', default=get_raw_data.DATABASE, help='database file name')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help='number of worker processes to parse the files, one CPU is left for the writer')
+    parser.add_argument('--since', type=datetime.date.fromisoformat, default=datetime.date.today() - datetime.timedelta(days=get_raw_data.RETENTION_DAYS), help='only the data after this date is inserted, default is the expired date of house keeping')
+    parser.add_argument('--progress-file', help='file of the finished files, default is the database file name + .backfill')
+    parser.add_argument('--restart', action='store_true', help='process all the files again and ignore the progress file')
+    parser.add_argument('--report-interval', type=float, default=5.0, help='seconds between two progress reports')
+    args = parser.parse_args()
+    try:
+        summary = run_backfill(args.database, args.paths, args.workers, args.since, args.progress_file or args.database + '.backfill', args.restart, args.report_interval)
+    except KeyboardInterrupt:
+        print('Backfill is interrupted, the inserted data is published, run the same command again to continue')
+        return
+    print('Backfill %d files (%d skipped, %d failed) of %d stocks : %d rows parsed, %d rows rejected, %d rows inserted in %.1fs, %.0f rows/sec' % (summary['files_finished'], summary['files_skipped'], summary['files_failed'], summary['symbols'], summary['rows_parsed'], summary['rows_rejected'], summary['rows_inserted'], summary['elapsed'], summary['rows_per_sec']))
+
+
+if __name__ == '__main__':
+    main()
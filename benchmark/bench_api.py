@@ -0,0 +1,302 @@
+#######################################################################################################################################################
+# Description :
+#     This program will benchmark the API of financial/run.py :
+#         1. Generate a synthetic database with the given number of symbols and years, or use an existing database.
+#         2. Send the requests of each endpoint with the given concurrency, by the Flask test client and/or by a real local server (gunicorn or flask).
+#         3. Check every response with the response of the same request sent one by one, the error info of concurrent requests must not be mixed.
+#         4. Print and save the p50/p95/p99 latency, requests/sec, peak RSS, CPU time and bytes on the wire of each request of each endpoint.
+#
+# Remark :
+#     Run this program under project path, for example : python3 benchmark/bench_api.py --symbols 20 --years 5 --mode both --output api.json
+#     The response cache is disabled by default to measure the query path, use --cache-size to enable it.
+#     Compare the serializers and compression by the same options, for example the old path is --serializer flask --accept-encoding identity.
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# Random request parameters
+import random
+# Compare the responses, the compressed responses are decompressed before comparison
+import json
+import gzip
+# File operation and server process
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+# Concurrent requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+# Measure the elapsed time
+import time
+# HTTP client for the real server
+import requests as rq
+import urllib.parse
+
+# Import the shared benchmark functions and financial/run.py from the project path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'financial'))
+import bench_util
+import run
+
+
+# This functoin is used to build the request urls of each endpoint from the symbols and dates of database
+# input : info     - dictionary of symbol list and date list of database
+#         requests - number of requests of each endpoint
+# output : endpoints - dictionary of endpoint name : url list
+def build_endpoints(info, requests):
+    generator = random.Random(requests)
+    symbols = info['symbols']
+    # Symbol names include space or dot in the real data, quote them as a client does
+    quote = urllib.parse.quote
+
+    # Get a random period in the database
+    def period(days):
+        start = generator.randint(0, max(0, len(info['dates']) - days - 1))
+        return info['dates'][start], info['dates'][min(len(info['dates']) - 1, start + days)]
+
+    endpoints = {'financial_data_page': [], 'financial_data_large': [], 'statistics': [], 'statistics_metrics': [], 'statistics_batch': [], 'export_ndjson': [], 'bars_long_range': [], 'invalid_parameters': []}
+    for i in range(min(requests, 50)):
+        symbol = quote(generator.choice(symbols))
+        start_date, end_date = period(250)
+        endpoints['financial_data_page'].append('/api/financial_data?symbol=%s&start_date=%s&end_date=%s&limit=100&page=%d' % (symbol, start_date, end_date, generator.randint(1, 2)))
+        endpoints['financial_data_large'].append('/api/financial_data?limit=5000&page=%d' % (generator.randint(1, max(1, len(symbols) * len(info['dates']) // 5000))))
+        endpoints['statistics'].append('/api/statistics?symbol=%s&start_date=%s&end_date=%s' % (symbol, start_date, end_date))
+        endpoints['statistics_metrics'].append('/api/statistics?symbol=%s&start_date=%s&end_date=%s&metrics=vwap,average_daily_return,volatility&window=20' % (symbol, start_date, end_date))
+        batch_symbols = '&'.join(['symbol=%s' % (quote(item)) for item in generator.sample(symbols, min(10, len(symbols)))])
+        endpoints['statistics_batch'].append('/api/statistics/batch?%s&%s' % (batch_symbols, '&'.join(['period=%s,%s' % period(60) for j in range(4)])))
+        endpoints['export_ndjson'].append('/api/financial_data/export?symbol=%s&start_date=%s&end_date=%s' % (symbol, start_date, end_date))
+        # A chart of the whole history, it is a few hundred bars
+        endpoints['bars_long_range'].append('/api/financial_data/bars?symbol=%s&interval=%s&start_date=%s&end_date=%s' % (symbol, generator.choice(['week', 'month', '5d']), info['dates'][0], info['dates'][-1]))
+        endpoints['invalid_parameters'].append('/api/statistics?symbol=BAD%d&start_date=2023-13-%02d&end_date=%s' % (i, i % 28 + 1, end_date))
+    return endpoints
+
+
+# This functoin is used to parse the response body for comparison
+# input : body - response body
+# output : parsed JSON, or the body itself if it is not JSON (for example NDJSON)
+def parse_body(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+
+# This functoin is used to decompress the response body by the Content-Encoding header
+# input : body     - response body
+#         encoding - Content-Encoding header of the response, None if the body is not compressed
+# output : body - decompressed response body
+def decode_body(body, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'zstd':
+        import zstandard
+        # The streaming response does not have the content size in the frame header
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body
+
+
+# This functoin is used to send the requests of one endpoint with the given concurrency and check each response
+# input : send        - function to send a request, the input is url and the output is (status, body, bytes on the wire, CPU seconds of the request or None)
+#         urls        - url list of the endpoint, the urls are sent in turn
+#         requests    - number of requests
+#         concurrency - number of concurrent clients
+#         pid         - process id to sample the peak RSS, and the CPU time if send() does not measure it
+# output : result - summary of the latencies, peak RSS, CPU time, bytes on the wire and failures
+def run_endpoint(send, urls, requests, concurrency, pid):
+    # The expected response of each url is the response of the same request sent alone
+    expected = dict([(url, parse_body(send(url)[1])) for url in urls])
+    latencies = []
+    sizes = []
+    cpu = [0.0, 0]
+    failures = [0]
+    lock = threading.Lock()
+
+    # Send one request and check the response
+    def request(i):
+        url = urls[i % len(urls)]
+        start = time.perf_counter()
+        status, body, size, request_cpu = send(url)
+        latency = time.perf_counter() - start
+        with lock:
+            latencies.append(latency)
+            sizes.append(size)
+            if request_cpu is not None:
+                cpu[0] += request_cpu
+                cpu[1] += 1
+            if status != 200 or parse_body(body) != expected[url]:
+                failures[0] += 1
+
+    with bench_util.RSSSampler(pid) as sampler:
+        cpu_start = bench_util.get_process_cpu(pid)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(request, range(requests)))
+        elapsed = time.perf_counter() - start
+        cpu_end = bench_util.get_process_cpu(pid)
+    # The CPU time of a real server is the CPU time of its processes, it is only measured when the requests are not measured by send()
+    if cpu[1] == 0 and cpu_start is not None and cpu_end is not None:
+        cpu[0] = cpu_end - cpu_start
+    elif cpu[1] == 0:
+        cpu[0] = None
+    return bench_util.summarize(latencies, elapsed, sampler.peak, failures[0], cpu[0], sizes)
+
+
+# This functoin is used to run all the endpoints and print the results
+# input : name        - name of the target, such as client or gunicorn
+#         send        - function to send a request
+#         endpoints   - dictionary of endpoint name : url list
+#         requests    - number of requests of each endpoint
+#         concurrency - number of concurrent clients
+#         pid         - process id to sample the peak RSS
+# output : results - dictionary of endpoint name : result
+def run_endpoints(name, send, endpoints, requests, concurrency, pid):
+    results = {}
+    print('[%s] concurrency=%d requests=%d' % (name, concurrency, requests))
+    print('    %-22s %10s %10s %10s %10s %10s %10s %10s %9s' % ('endpoint', 'req/sec', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'RSS(MB)', 'CPU(ms)', 'KB/req', 'failures'))
+    for endpoint in endpoints:
+        result = run_endpoint(send, endpoints[endpoint], requests, concurrency, pid)
+        results[endpoint] = result
+        print('    %-22s %10.1f %10.2f %10.2f %10.2f %10.1f %10.2f %10.1f %9d' % (endpoint, result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['peak_rss_mb'], result.get('cpu_ms_per_request', float('nan')), result['bytes_per_request'] / 1024, result['failures']))
+    return results
+
+
+# This functoin is used to get a free local port
+# output : port - free port number
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# This functoin is used to start a real local server of financial/run.py and wait until it is ready
+# input : server     - gunicorn or flask
+#         database   - database file name
+#         cache_size - response cache size
+#         workers    - number of gunicorn worker processes, None to use the gunicorn.conf.py default
+#         serializer - JSON serializer of the API, fast or flask
+# output : process  - server process
+#          base_url - base url of the server
+def start_server(server, database, cache_size, workers, serializer):
+    port = get_free_port()
+    project_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    env = dict(os.environ, FINANCIAL_DATABASE=os.path.abspath(database), FINANCIAL_CACHE_SIZE=str(cache_size), FINANCIAL_JSON_SERIALIZER=serializer, GUNICORN_BIND='127.0.0.1:%d' % (port), GUNICORN_ACCESSLOG=os.devnull)
+    if workers:
+        env['GUNICORN_WORKERS'] = str(workers)
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:create_app()']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'run:create_app()', 'run', '--host', '127.0.0.1', '--port', str(port), '--with-threads']
+    process = subprocess.Popen(command, cwd=os.path.join(project_dir, 'financial'), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = 'http://127.0.0.1:%d' % (port)
+    # Wait until the home page is served
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The %s server is stopped with exit code %d' % (server, process.returncode))
+        try:
+            rq.get(base_url + '/', timeout=1)
+            return process, base_url
+        except rq.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('The %s server is not ready in 30 seconds' % (server))
+
+
+# This functoin is used to benchmark the API by the Flask test client in current process
+# input : args      - command line arguments
+#         database  - database file name
+#         endpoints - dictionary of endpoint name : url list
+# output : results - dictionary of endpoint name : result
+def bench_client(args, database, endpoints):
+    app = run.create_app({'DATABASE': database, 'CACHE_SIZE': args.cache_size, 'JSON_SERIALIZER': args.serializer})
+    clients = threading.local()
+
+    # Each thread has its own test client, the request is handled in the same thread so its CPU time is the thread CPU time
+    def send(url):
+        if not hasattr(clients, 'client'):
+            clients.client = app.test_client()
+        start = time.thread_time()
+        response = clients.client.get(url, headers={'Accept-Encoding': args.accept_encoding})
+        body = response.get_data()
+        cpu = time.thread_time() - start
+        return response.status_code, decode_body(body, response.headers.get('Content-Encoding')), len(body), cpu
+
+    return run_endpoints('client', send, endpoints, args.requests, args.concurrency, os.getpid())
+
+
+# This functoin is used to benchmark the API by a real local server
+# input : args      - command line arguments
+#         database  - database file name
+#         endpoints - dictionary of endpoint name : url list
+# output : results - dictionary of endpoint name : result
+def bench_server(args, database, endpoints):
+    process, base_url = start_server(args.server, database, args.cache_size, args.workers, args.serializer)
+    sessions = threading.local()
+
+    # Each thread has its own keep-alive connection, the body is read as it is sent so that the compressed size of a chunked response is known
+    def send(url):
+        if not hasattr(sessions, 'session'):
+            sessions.session = rq.Session()
+            sessions.session.headers['Accept-Encoding'] = args.accept_encoding
+        response = sessions.session.get(base_url + url, timeout=60, stream=True)
+        body = b''.join(response.raw.stream(65536, decode_content=False))
+        # Return the connection to the pool for the next request
+        response.raw.release_conn()
+        return response.status_code, decode_body(body, response.headers.get('Content-Encoding')), len(body), None
+
+    try:
+        return run_endpoints(args.server, send, endpoints, args.requests, args.concurrency, process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API of financial/run.py')
+    parser.add_argument('--symbols', type=int, default=20, help='number of symbols in the generated database')
+    parser.add_argument('--years', type=int, default=5, help='number of years in the generated database')
+    parser.add_argument('--database', help='use an existing database instead of generating one')
+    parser.add_argument('--mode', choices=['client', 'server', 'both'], default='client', help='send the requests by the Flask test client, a real local server or both')
+    parser.add_argument('--server', choices=['gunicorn', 'flask'], default='gunicorn', help='real local server used by the server mode')
+    parser.add_argument('--workers', type=int, help='number of gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='number of requests of each endpoint')
+    parser.add_argument('--cache-size', type=int, default=0, help='response cache size of the API, 0 to disable the cache')
+    parser.add_argument('--serializer', choices=['fast', 'flask'], default='fast', help='JSON serializer of the API')
+    parser.add_argument('--accept-encoding', default='gzip, deflate', help='Accept-Encoding header of the requests, identity to receive the responses uncompressed')
+    parser.add_argument('--endpoints', nargs='*', help='endpoint names to run, all endpoints by default')
+    parser.add_argument('--output', help='JSON file to save the results')
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.database:
+            database = args.database
+            info = bench_util.read_database_info(database)
+        else:
+            database = os.path.join(work_dir, 'financial_data.db')
+            start = time.perf_counter()
+            info = bench_util.generate_database(database, args.symbols, args.years)
+            print('Generate %d rows of %d symbols in %.1f sec' % (info['rows'], len(info['symbols']), time.perf_counter() - start))
+        endpoints = build_endpoints(info, args.requests)
+        if args.endpoints:
+            endpoints = dict([(name, endpoints[name]) for name in args.endpoints])
+        results = {}
+        if args.mode in ['client', 'both']:
+            results['client'] = bench_client(args, database, endpoints)
+        if args.mode in ['server', 'both']:
+            results[args.server] = bench_server(args, database, endpoints)
+    finally:
+        shutil.rmtree(work_dir)
+    bench_util.save_results(args.output, 'api', vars(args), results)
+    # Exit with error if any response is incorrect
+    if any([result['failures'] > 0 for target in results.values() for result in target.values()]):
+        print('Error : Some responses are different from the responses of the same requests sent one by one')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
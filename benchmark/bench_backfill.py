@@ -0,0 +1,93 @@
+#######################################################################################################################################################
+# Description :
+#     This program will benchmark the backfill of historical csv files by backfill.py :
+#         1. Generate the csv files of the given number of stocks and days in the AlphaVantage layout.
+#         2. Backfill the files into an empty database with each given number of worker processes.
+#         3. Check the number of rows in the database and print the rows/sec of each run.
+#         4. Save the results as a JSON file if --output is given.
+#
+# Remark :
+#     Run this program under project path, for example : python3 benchmark/bench_backfill.py --symbols 40 --days 5000 --workers 1 2 4 --output backfill.json
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# Suppress the progress output of backfill
+import contextlib
+import io
+# File operation
+import os
+import shutil
+import sys
+import tempfile
+
+# Import the shared benchmark functions and backfill.py from the project path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bench_util
+import stub_alphavantage
+import backfill
+import get_raw_data
+
+
+# This functoin is used to generate the csv files of the stocks
+# input : archive_dir - directory of the csv files
+#         symbols     - number of stocks, the symbol names are SYM0000, SYM0001, ...
+#         days        - number of days of each stock
+# output : rows - number of rows in the csv files
+def generate_archive(archive_dir, symbols, days):
+    for i in range(symbols):
+        with open(os.path.join(archive_dir, 'SYM%04d.csv' % (i)), 'wb') as fcsv:
+            fcsv.write(stub_alphavantage.generate_csv_body('SYM%04d' % (i), days))
+    return symbols * days
+
+
+# This functoin is used to backfill the csv files into an empty database
+# input : archive_dir - directory of the csv files
+#         database    - database file name, the file is replaced if it exists
+#         workers     - number of worker processes, all the rows are inserted
+# output : summary - summary of the backfill
+def run_backfill(archive_dir, database, workers):
+    for file_name in [database, database + '-wal', database + '-shm', database + '.version', database + '.snapshot', database + '.backfill']:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = backfill.run_backfill(database, [archive_dir], workers, '0001-01-01', database + '.backfill', report_interval=None)
+    connection = get_raw_data.db_connection(database)
+    summary['rows'] = connection.execute(''' SELECT COUNT(*) FROM financial_data ''').fetchone()[0]
+    connection.close()
+    return summary
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the backfill of historical csv files by backfill.py')
+    parser.add_argument('--symbols', type=int, default=40, help='number of stocks in the generated csv files')
+    parser.add_argument('--days', type=int, default=5000, help='number of days of each stock')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='numbers of worker processes to compare')
+    parser.add_argument('--output', help='JSON file to save the results')
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    failures = 0
+    try:
+        archive_dir = os.path.join(work_dir, 'archive')
+        os.mkdir(archive_dir)
+        rows = generate_archive(archive_dir, args.symbols, args.days)
+        print('%-10s %12s %12s %12s' % ('workers', 'rows', 'elapsed(s)', 'rows/sec'))
+        for workers in args.workers:
+            summary = run_backfill(archive_dir, os.path.join(work_dir, 'financial_data.db'), workers)
+            # Every row of the csv files must be inserted
+            failures += summary['rows'] != rows
+            results['workers_%d' % (workers)] = {'rows': summary['rows'], 'elapsed': round(summary['elapsed'], 3), 'rows_per_sec': round(summary['rows_per_sec'], 1)}
+            print('%-10d %12d %12.3f %12.1f' % (workers, summary['rows'], summary['elapsed'], summary['rows_per_sec']))
+    finally:
+        shutil.rmtree(work_dir)
+    bench_util.save_results(args.output, 'backfill', vars(args), {'backfill': results})
+    if failures > 0:
+        print('Error : Some rows of the csv files are not inserted')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#######################################################################################################################################################
+# Description : 
+#     This program will benchmark the ingest of get_raw_data.py :
+#         1. Generate a csv file in the AlphaVantage TIME_SERIES_DAILY_ADJUSTED layout with the given number of daily rows.
+#         2. Insert the csv file into an empty database by the old row by row path (SELECT COUNT(*) + INSERT + commit for each row).
+#         3. Insert the same csv file into an empty database by the streaming batch path of get_raw_data.py (parse_financial_data() + insert_table()).
+#         4. Print the rows/sec of both paths.
+#         5. Ingest the given number of stocks from a local AlphaVantage stub by ingest_financial_data() of get_raw_data.py,
+#            the first run fetches the full output into an empty database and the second run fetches the compact output as the daily update.
+#         6. Save the results as a JSON file if --output is given.
+#
+# Remark : 
+#     Run this program under project path, for example : python3 benchmark/bench_ingest.py --rows 5000 --symbols 20 --output ingest.json
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# Get the date of generated data
+import datetime
+# Random price and volume
+import random
+# File operation
+import os
+import shutil
+import sys
+import tempfile
+# Measure the elapsed time
+import time
+# Suppress the progress output of ingest functions
+import contextlib
+import io
+# CSV data process
+import pandas as pd
+
+# Import get_raw_data.py from the project path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import get_raw_data
+import bench_util
+import stub_alphavantage
+
+
+# This functoin is used to generate a csv file in the AlphaVantage layout, the newest date is in the first line
+# input : file_name - csv file name
+#         rows      - number of daily rows
+def generate_csv(file_name, rows):
+    random.seed(rows)
+    today = datetime.date.today()
+    with open(file_name, 'w') as fcsv:
+        fcsv.write('timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient\n')
+        for i in range(rows):
+            date = today - datetime.timedelta(days=i)
+            open_price = round(random.uniform(100, 200), 2)
+            close_price = round(random.uniform(100, 200), 2)
+            fcsv.write('%s,%s,%s,%s,%s,%s,%d,0.0000,1.0\n' % (date, open_price, open_price + 1, close_price - 1, close_price, close_price, random.randint(10 ** 6, 10 ** 8)))
+
+
+# This functoin is used to insert the csv file by the old row by row path, it is kept here only for comparison
+# input : con    - db connect point
+#         cur    - db cursor point
+#         symbol - stocks name
+#         date   - expired date
+# output : ins_data - number of inserted rows
+def fill_financial_data_row_by_row(con, cur, symbol, date):
+    financial_data = pd.read_csv('financial_data_%s.csv' % (symbol))
+    os.remove('financial_data_%s.csv' % (symbol))
+    ins_data = 0
+    # financial_data is the view of the monthly partitions, each row is inserted into the partition of its month
+    get_raw_data.create_partitions(con, cur, list(set([get_raw_data.partition_month(item) for item in financial_data['timestamp'] if item > str(date)])))
+    for i in range(financial_data.shape[0]):
+        ser = financial_data.loc[i, ["timestamp","open","close","volume"]]
+        cur.execute(''' SELECT COUNT(*) FROM financial_data WHERE symbol=? AND date=? ''', [symbol, ser.values[0]])
+        if ser.values[0] > str(date) and cur.fetchone()[0] == 0:
+            cur.execute(''' INSERT INTO financial_data_%s(symbol, date, open_price, close_price, volume) VALUES(?,?,?,?,?) ''' % (get_raw_data.partition_month(ser.values[0])), [symbol, ser.values[0], ser.values[1], ser.values[2], int(ser.values[3])])
+            con.commit()
+            ins_data += 1
+    return ins_data
+
+
+# This functoin is used to insert the csv file by the streaming batch path of get_raw_data.py
+# input : con    - db connect point
+#         cur    - db cursor point
+#         symbol - stocks name
+#         date   - expired date
+# output : ins_data - number of inserted rows
+def fill_financial_data_streaming(con, cur, symbol, date):
+    ins_data = 0
+    with open('financial_data_%s.csv' % (symbol), 'r') as fcsv:
+        for data in get_raw_data.parse_financial_data(symbol, fcsv, date):
+            ins_data += get_raw_data.insert_table(con, cur, data)
+    os.remove('financial_data_%s.csv' % (symbol))
+    return ins_data
+
+
+# This functoin is used to run one ingest path on an empty database and measure the elapsed time
+# input : work_dir - working directory which includes schema.sql and partition.sql
+#         rows     - number of daily rows
+#         fill     - ingest function to be measured
+# output : rows/sec of the ingest function
+def run_ingest(work_dir, rows, fill):
+    database = os.path.join(work_dir, 'bench.db')
+    if os.path.exists(database):
+        os.remove(database)
+    generate_csv('financial_data_BENCH.csv', rows)
+    connection = get_raw_data.db_connection(database)
+    cursor = connection.cursor()
+    get_raw_data.create_table(connection, cursor)
+    expired_date = datetime.date.today() - datetime.timedelta(days=rows + 1)
+    start = time.perf_counter()
+    fill(connection, cursor, 'BENCH', expired_date)
+    elapsed = time.perf_counter() - start
+    cursor.close()
+    connection.close()
+    return rows / elapsed
+
+
+# This functoin is used to run ingest_financial_data() of get_raw_data.py against the local AlphaVantage stub
+# input : database - database file name
+#         symbols  - stock list
+#         date     - expired date
+# output : result - dictionary of elapsed seconds, inserted rows, rows/sec and peak RSS
+def run_stub_ingest(database, symbols, date):
+    connection = get_raw_data.db_connection(database)
+    cursor = connection.cursor()
+    if get_raw_data.check_table(cursor) == 0:
+        get_raw_data.create_table(connection, cursor)
+    cursor.execute(''' SELECT COUNT(*) FROM financial_data ''')
+    before = cursor.fetchone()[0]
+    with bench_util.RSSSampler() as sampler, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        get_raw_data.ingest_financial_data(connection, cursor, symbols, 'BENCH', date)
+        elapsed = time.perf_counter() - start
+    cursor.execute(''' SELECT COUNT(*) FROM financial_data ''')
+    rows = cursor.fetchone()[0] - before
+    cursor.close()
+    connection.close()
+    return {'elapsed_sec': round(elapsed, 3), 'rows': rows, 'rows_per_sec': round(rows / elapsed, 1), 'peak_rss_mb': round(sampler.peak / 1024 / 1024, 1)}
+
+
+# This functoin is used to benchmark the full and daily ingest of many stocks against the local AlphaVantage stub
+# input : work_dir - working directory which includes schema.sql and partition.sql
+#         args     - command line arguments
+# output : results - dictionary of full and daily ingest results
+def bench_stub_ingest(work_dir, args):
+    server = stub_alphavantage.start_stub_server(0, args.full_days, args.delay)
+    # Send the requests to the stub without the rate limit of the free API key
+    get_raw_data.BASE_URL = 'http://127.0.0.1:%d/query' % (server.server_port)
+    get_raw_data.REQUESTS_PER_MINUTE = 600000
+    get_raw_data.REQUESTS_BURST = args.symbols
+    get_raw_data.FETCH_WORKERS = args.workers
+    database = os.path.join(work_dir, 'stub.db')
+    symbols = ['SYM%04d' % (i) for i in range(args.symbols)]
+    expired_date = datetime.date.today() - datetime.timedelta(days=args.full_days)
+    try:
+        results = {'full': run_stub_ingest(database, symbols, expired_date)}
+        # The second run only has the data after the watermark, the compact output is requested
+        results['daily'] = run_stub_ingest(database, symbols, expired_date)
+    finally:
+        server.shutdown()
+    return results
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingest of get_raw_data.py')
+    parser.add_argument('--rows', type=int, default=5000, help='number of daily rows in the generated csv file')
+    parser.add_argument('--symbols', type=int, default=20, help='number of stocks ingested from the local AlphaVantage stub, 0 to skip')
+    parser.add_argument('--full-days', type=int, default=5000, help='number of days of the full output of the stub')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds the stub waits before each response')
+    parser.add_argument('--workers', type=int, default=get_raw_data.FETCH_WORKERS, help='number of concurrent fetch workers')
+    parser.add_argument('--output', help='JSON file to save the results')
+    args = parser.parse_args()
+    project_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        shutil.copy(os.path.join(project_dir, 'schema.sql'), work_dir)
+        shutil.copy(os.path.join(project_dir, 'partition.sql'), work_dir)
+        os.chdir(work_dir)
+        old_rate = run_ingest(work_dir, args.rows, fill_financial_data_row_by_row)
+        new_rate = run_ingest(work_dir, args.rows, fill_financial_data_streaming)
+        results['csv'] = {'row_by_row_rows_per_sec': round(old_rate, 1), 'streaming_rows_per_sec': round(new_rate, 1)}
+        if args.symbols > 0:
+            results['stub'] = bench_stub_ingest(work_dir, args)
+    finally:
+        os.chdir(project_dir)
+        shutil.rmtree(work_dir)
+    print('Row by row ingest : %.0f rows/sec' % (old_rate))
+    print('Streaming ingest  : %.0f rows/sec' % (new_rate))
+    print('Speed up          : %.1fx' % (new_rate / old_rate))
+    if 'stub' in results:
+        for name in ['full', 'daily']:
+            result = results['stub'][name]
+            print('Stub %-5s ingest of %d stocks : %d rows in %.2f sec, %.0f rows/sec, peak RSS %.1f MB' % (name, args.symbols, result['rows'], result['elapsed_sec'], result['rows_per_sec'], result['peak_rss_mb']))
+    bench_util.save_results(args.output, 'ingest', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
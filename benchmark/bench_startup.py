@@ -0,0 +1,194 @@
+#######################################################################################################################################################
+# Description :
+#     This program will benchmark the startup of the API server and the ingest job :
+#         1. Measure the time of a fresh interpreter to import financial/run.py and get_raw_data.py, and to answer the first request by the Flask test client.
+#         2. Measure the time from starting a real local server (gunicorn or flask) to the first successful response.
+#         3. Ingest the given number of stocks from a local AlphaVantage stub into an empty database, and start the server :
+#                blocking   - the server is started after the ingest is finished, as the old docker command does
+#                background - the server is started while the ingest is running, as the docker command does by default
+#            and measure the time from the start until the server is ready.
+#         4. Print the median of each measurement and save the results as a JSON file if --output is given.
+#
+# Remark :
+#     Run this program under project path, for example : python3 benchmark/bench_startup.py --repeat 5 --output startup.json
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# Get the expired date of the ingest
+import datetime
+# Suppress the progress output of ingest functions
+import contextlib
+import io
+# File operation and child processes
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+# The ingest runs in a separate process as the docker command does
+import multiprocessing
+# Measure the elapsed time
+import time
+# Median of the repeated measurements
+import statistics
+# HTTP client for the real server
+import requests as rq
+
+# Import the shared benchmark functions and get_raw_data.py from the project path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import bench_util
+import bench_api
+import stub_alphavantage
+import get_raw_data
+
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+# This functoin is used to measure the wall time of a fresh interpreter running the given code
+# input : code     - python code to run
+#         cwd      - working directory of the interpreter
+#         env      - environment variables, the current environment by default
+# output : elapsed - milliseconds from starting the interpreter to its exit
+def time_interpreter(code, cwd, env=None):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+# This functoin is used to measure the time from starting a real local server to the first successful response of the url
+# input : server   - gunicorn or flask
+#         database - database file name
+#         workers  - number of gunicorn worker processes
+#         url      - url of the first request
+#         deadline - seconds to wait for the server
+# output : elapsed - milliseconds from starting the server to the first successful response
+def time_server_ready(server, database, workers, url, deadline=60):
+    port = bench_api.get_free_port()
+    env = dict(os.environ, FINANCIAL_DATABASE=os.path.abspath(database), GUNICORN_BIND='127.0.0.1:%d' % (port), GUNICORN_ACCESSLOG=os.devnull, GUNICORN_WORKERS=str(workers))
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:create_app()']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'run:create_app()', 'run', '--host', '127.0.0.1', '--port', str(port), '--with-threads']
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=os.path.join(PROJECT_DIR, 'financial'), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('The %s server is stopped with exit code %d' % (server, process.returncode))
+            try:
+                if rq.get('http://127.0.0.1:%d%s' % (port, url), timeout=1).status_code == 200:
+                    return (time.perf_counter() - start) * 1000
+            except rq.RequestException:
+                pass
+            time.sleep(0.005)
+        raise RuntimeError('The %s server is not ready in %d seconds' % (server, deadline))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# This functoin is used to ingest the stocks from the local AlphaVantage stub into the database and publish the data version and snapshot as get_raw_data.py does
+# input : database - database file name
+#         symbols  - stock list
+#         days     - number of days to keep
+def run_ingest(database, symbols, days):
+    connection = get_raw_data.db_connection(database)
+    cursor = connection.cursor()
+    if get_raw_data.check_table(cursor) == 0:
+        get_raw_data.create_table(connection, cursor)
+    with contextlib.redirect_stdout(io.StringIO()):
+        get_raw_data.ingest_financial_data(connection, cursor, symbols, 'BENCH', datetime.date.today() - datetime.timedelta(days=days))
+    cursor.close()
+    connection.close()
+    version = get_raw_data.publish_data_version(database)
+    get_raw_data.publish_snapshot(database, version, database + '.snapshot')
+
+
+# This functoin is used to measure the time until the server is ready when it is started after the ingest or while the ingest is running
+# input : args     - command line arguments
+#         work_dir - working directory for the databases
+#         mode     - blocking or background
+#         i        - index of the run, each run uses a new empty database
+# output : ready  - milliseconds from the start until the server answers the home page
+#          ingest - milliseconds from the start until the ingest is finished
+def time_ingest_startup(args, work_dir, mode, i):
+    database = os.path.join(work_dir, '%s-%d.db' % (mode, i))
+    symbols = ['SYM%04d' % (j) for j in range(args.ingest_symbols)]
+    # The child process is forked, it uses the stub settings of get_raw_data.py in this process
+    process = multiprocessing.get_context('fork').Process(target=run_ingest, args=(database, symbols, args.full_days))
+    start = time.perf_counter()
+    process.start()
+    if mode == 'blocking':
+        process.join()
+        ingest = (time.perf_counter() - start) * 1000
+        ready = ingest + time_server_ready(args.server, database, args.workers, '/')
+    else:
+        ready = time_server_ready(args.server, database, args.workers, '/')
+        process.join()
+        ingest = (time.perf_counter() - start) * 1000
+    if process.exitcode != 0:
+        raise RuntimeError('The ingest is stopped with exit code %d' % (process.exitcode))
+    return ready, ingest
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the API server and the ingest job')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each measurement, the median is reported')
+    parser.add_argument('--server', choices=['gunicorn', 'flask'], default='gunicorn', help='real local server to start')
+    parser.add_argument('--workers', type=int, default=2, help='number of gunicorn worker processes')
+    parser.add_argument('--symbols', type=int, default=20, help='number of symbols in the generated database')
+    parser.add_argument('--years', type=int, default=5, help='number of years in the generated database')
+    parser.add_argument('--ingest-symbols', type=int, default=20, help='number of stocks ingested from the local AlphaVantage stub, 0 to skip')
+    parser.add_argument('--full-days', type=int, default=1000, help='number of days of the full output of the stub')
+    parser.add_argument('--delay', type=float, default=0.25, help='seconds the stub waits before each response, it simulates the latency of AlphaVantage')
+    parser.add_argument('--output', help='JSON file to save the results')
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        database = os.path.join(work_dir, 'financial_data.db')
+        info = bench_util.generate_database(database, args.symbols, args.years)
+        url = '/api/statistics?symbol=%s&start_date=%s&end_date=%s' % (info['symbols'][0], info['dates'][0], info['dates'][-1])
+        env = dict(os.environ, FINANCIAL_DATABASE=database)
+        # Each measurement is run by a fresh interpreter, so the modules are not cached in memory
+        codes = {'python_ms': [PROJECT_DIR, 'pass'],
+                 'import_run_ms': [os.path.join(PROJECT_DIR, 'financial'), 'import run'],
+                 'import_get_raw_data_ms': [PROJECT_DIR, 'import get_raw_data'],
+                 'first_response_ms': [os.path.join(PROJECT_DIR, 'financial'), 'import run; assert run.create_app().test_client().get(%r).status_code == 200' % (url)]}
+        samples = dict([(name, []) for name in codes])
+        samples['%s_ready_ms' % (args.server)] = []
+        for i in range(args.repeat):
+            for name in codes:
+                samples[name].append(time_interpreter(codes[name][1], codes[name][0], env))
+            samples['%s_ready_ms' % (args.server)].append(time_server_ready(args.server, database, args.workers, url))
+        if args.ingest_symbols > 0:
+            server = stub_alphavantage.start_stub_server(0, args.full_days, args.delay)
+            # Send the requests to the stub without the rate limit of the free API key
+            get_raw_data.BASE_URL = 'http://127.0.0.1:%d/query' % (server.server_port)
+            get_raw_data.REQUESTS_PER_MINUTE = 600000
+            get_raw_data.REQUESTS_BURST = args.ingest_symbols
+            for name in ['blocking_ready_ms', 'background_ready_ms', 'ingest_ms']:
+                samples[name] = []
+            try:
+                for i in range(args.repeat):
+                    for mode in ['blocking', 'background']:
+                        ready, ingest = time_ingest_startup(args, work_dir, mode, i)
+                        samples['%s_ready_ms' % (mode)].append(ready)
+                        samples['ingest_ms'].append(ingest)
+            finally:
+                server.shutdown()
+        for name in samples:
+            results[name] = round(statistics.median(samples[name]), 1)
+    finally:
+        shutil.rmtree(work_dir)
+    for name in results:
+        print('%-26s %10.1f' % (name, results[name]))
+    bench_util.save_results(args.output, 'startup', vars(args), {'startup': results})
+
+
+if __name__ == '__main__':
+    main()
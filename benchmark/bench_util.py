@@ -0,0 +1,206 @@
+#######################################################################################################################################################
+# Description :
+#     This program provides the shared functions of the benchmark programs :
+#         1. Generate a synthetic database with the given number of symbols and years by the ingest functions of get_raw_data.py, or read an existing one.
+#         2. Sample the peak RSS of processes while a benchmark is running.
+#         3. Summarize the latencies as p50/p95/p99, requests/sec, CPU time and bytes of each request.
+#         4. Save the benchmark results as a JSON file so that the runs can be compared by compare.py.
+#
+# Remark :
+#     Run the benchmark programs under project path, schema.sql and partition.sql are read from the current directory.
+#######################################################################################################################################################
+
+
+# Get the date of generated data
+import datetime
+# Random price and volume
+import random
+# Suppress the progress output of ingest functions
+import contextlib
+import io
+# Result file
+import json
+# File operation and environment information
+import os
+import platform
+import sys
+# RSS sampling thread
+import threading
+# Peak RSS of current process when /proc is not available
+import resource
+# Latency percentiles
+import numpy as np
+
+# Import get_raw_data.py from the project path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import get_raw_data
+
+
+# This functoin is used to generate a synthetic database, each symbol has one row for each weekday of the given years
+# input : database - database file name, the file is replaced if it exists
+#         symbols  - number of symbols, the symbol names are SYM0000, SYM0001, ...
+#         years    - number of years before today
+# output : info - dictionary of symbol list, date list and number of rows
+def generate_database(database, symbols, years):
+    for file_name in [database, database + '-wal', database + '-shm', database + '.version', database + '.snapshot']:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    random.seed(symbols * 1000 + years)
+    last_date = datetime.date.today()
+    first_date = last_date - datetime.timedelta(days=365 * years)
+    dates = [str(first_date + datetime.timedelta(days=i)) for i in range((last_date - first_date).days + 1) if (first_date + datetime.timedelta(days=i)).weekday() < 5]
+    symbol_list = ['SYM%04d' % (i) for i in range(symbols)]
+    connection = get_raw_data.db_connection(database)
+    cursor = connection.cursor()
+    get_raw_data.create_table(connection, cursor)
+    rows = 0
+    # Use the same insert, cumulative sum, bars, watermark and symbol table functions as the ingest job
+    with contextlib.redirect_stdout(io.StringIO()):
+        for symbol in symbol_list:
+            price = random.uniform(50, 300)
+            data = []
+            for date in dates:
+                open_price = round(price, 2)
+                price = max(1.0, price * (1 + random.gauss(0, 0.02)))
+                data.append([symbol, date, open_price, round(price, 2), random.randint(10 ** 5, 10 ** 8)])
+            rows += get_raw_data.insert_table(connection, cursor, data)
+            get_raw_data.update_cumsum(connection, cursor, symbol, dates[0])
+            get_raw_data.update_bars(connection, cursor, symbol, dates[0])
+            get_raw_data.update_watermark(connection, cursor, symbol)
+            get_raw_data.register_symbol(connection, cursor, symbol)
+    cursor.execute(''' PRAGMA journal_mode=WAL ''')
+    cursor.close()
+    connection.close()
+    # Publish the snapshot served by the API in the same way as the ingest job
+    version = get_raw_data.publish_data_version(database)
+    get_raw_data.publish_snapshot(database, version, database + '.snapshot')
+    return {'symbols': symbol_list, 'dates': dates, 'rows': rows}
+
+
+# This functoin is used to read the symbols and dates of an existing database
+# input : database - database file name
+# output : info - dictionary of symbol list, date list and number of rows
+def read_database_info(database):
+    connection = get_raw_data.db_connection(database)
+    cursor = connection.cursor()
+    cursor.execute(''' SELECT DISTINCT symbol FROM financial_data ORDER BY symbol ''')
+    symbol_list = [row[0] for row in cursor.fetchall()]
+    cursor.execute(''' SELECT DISTINCT date FROM financial_data ORDER BY date ''')
+    dates = [row[0] for row in cursor.fetchall()]
+    cursor.execute(''' SELECT COUNT(*) FROM financial_data ''')
+    rows = cursor.fetchone()[0]
+    cursor.close()
+    connection.close()
+    return {'symbols': symbol_list, 'dates': dates, 'rows': rows}
+
+
+# This functoin is used to get the RSS of a process and its child processes from /proc
+# input : pid - process id
+# output : rss - RSS in bytes, None if /proc is not available
+def get_process_rss(pid):
+    rss = 0
+    pids = [pid]
+    try:
+        while pids:
+            current = pids.pop()
+            with open('/proc/%d/status' % (current), 'r') as fstatus:
+                for line in fstatus:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1]) * 1024
+                        break
+            # The worker processes of a pre-forked server are counted together
+            try:
+                with open('/proc/%d/task/%d/children' % (current, current), 'r') as fchildren:
+                    pids.extend([int(child) for child in fchildren.read().split()])
+            except OSError:
+                pass
+    except OSError:
+        return None
+    return rss
+
+
+# This functoin is used to get the CPU time of a process and its child processes from /proc
+# input : pid - process id
+# output : cpu - user and system CPU time in seconds, None if /proc is not available
+def get_process_cpu(pid):
+    cpu = 0
+    pids = [pid]
+    try:
+        while pids:
+            current = pids.pop()
+            with open('/proc/%d/stat' % (current), 'r') as fstat:
+                # The fields after the command name in parentheses, utime and stime are the 12th and 13th of them
+                fields = fstat.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            # The worker processes of a pre-forked server are counted together
+            try:
+                with open('/proc/%d/task/%d/children' % (current, current), 'r') as fchildren:
+                    pids.extend([int(child) for child in fchildren.read().split()])
+            except OSError:
+                pass
+    except OSError:
+        return None
+    return cpu
+
+
+# This class is used to sample the peak RSS of a process and its child processes while a benchmark is running
+class RSSSampler:
+    # input : pid      - process id, the current process by default
+    #         interval - seconds between two samples
+    def __init__(self, pid=None, interval=0.01):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = get_process_rss(self.pid)
+            if rss is None:
+                # Use the lifetime peak of current process if /proc is not available
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            self.peak = max(self.peak, rss)
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+
+# This functoin is used to summarize the latencies of a benchmark
+# input : latencies - latency of each request in seconds
+#         elapsed   - wall time of the benchmark in seconds
+#         peak_rss  - peak RSS in bytes
+#         failures  - number of failed or incorrect responses
+#         cpu       - CPU time of the server in seconds for all the requests, None if it is not measured
+#         sizes     - bytes of each response body on the wire, None if it is not measured
+# output : result - dictionary of requests, requests/sec, p50/p95/p99/max latency in milliseconds, peak RSS in MB, failures,
+#                   and CPU milliseconds and bytes per request if they are measured
+def summarize(latencies, elapsed, peak_rss, failures, cpu=None, sizes=None):
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) > 0 else (0, 0, 0)
+    result = {'requests': len(latencies), 'rps': round(len(latencies) / elapsed, 1) if elapsed > 0 else 0, 'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3), 'max_ms': round(float(latencies.max()), 3) if len(latencies) > 0 else 0, 'peak_rss_mb': round(peak_rss / 1024 / 1024, 1), 'failures': failures}
+    if cpu is not None and len(latencies) > 0:
+        result['cpu_ms_per_request'] = round(cpu * 1000 / len(latencies), 3)
+    if sizes:
+        result['bytes_per_request'] = round(sum(sizes) / len(sizes), 1)
+    return result
+
+
+# This functoin is used to save the benchmark results as a JSON file
+# input : file_name - result file name, nothing is saved if it is None
+#         name      - benchmark name
+#         options   - command line options of the benchmark
+#         results   - dictionary of benchmark results
+def save_results(file_name, name, options, results):
+    if file_name is None:
+        return
+    output = {'benchmark': name, 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'options': options, 'results': results}
+    with open(file_name, 'w') as fjson:
+        json.dump(output, fjson, indent=2)
+    print('Results are saved to %s' % (file_name))
@@ -0,0 +1,80 @@
+#######################################################################################################################################################
+# Description :
+#     This program will compare two result files of bench_api.py, bench_ingest.py, bench_startup.py or bench_backfill.py :
+#         1. Print the base value, new value and change of each measurement.
+#         2. Mark the measurement as regression if it is worse than the threshold, the throughput should be higher and the others should be lower.
+#         3. Exit with error if any regression is found, so it can be used in a CI job.
+#
+# Remark :
+#     Run this program under project path, for example : python3 benchmark/compare.py base.json new.json --threshold 10
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# Result file
+import json
+import sys
+
+
+# The measurements which should be higher, the others should be lower
+HIGHER_IS_BETTER = ['rps', 'rows_per_sec', 'row_by_row_rows_per_sec', 'streaming_rows_per_sec']
+# The measurements which are not compared
+IGNORED = ['requests', 'rows']
+
+
+# This functoin is used to flatten the nested results as name : value
+# input : results - nested dictionary of results
+#         prefix  - name prefix of current level
+# output : values - dictionary of flattened name : numeric value
+def flatten_results(results, prefix=''):
+    values = {}
+    for key in results:
+        name = prefix + '.' + key if prefix else key
+        if isinstance(results[key], dict):
+            values.update(flatten_results(results[key], name))
+        elif isinstance(results[key], (int, float)) and key not in IGNORED:
+            values[name] = results[key]
+    return values
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('base', help='result file of the base run')
+    parser.add_argument('new', help='result file of the new run')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percentage of change regarded as regression')
+    args = parser.parse_args()
+    with open(args.base, 'r') as fjson:
+        base = json.load(fjson)
+    with open(args.new, 'r') as fjson:
+        new = json.load(fjson)
+    if base['benchmark'] != new['benchmark']:
+        print('Error : Can not compare the results of [%s] and [%s] benchmark' % (base['benchmark'], new['benchmark']))
+        sys.exit(2)
+    base_values = flatten_results(base['results'])
+    new_values = flatten_results(new['results'])
+    regressions = 0
+    print('%-50s %14s %14s %9s' % ('measurement', 'base', 'new', 'change'))
+    for name in base_values:
+        if name not in new_values:
+            continue
+        base_value = base_values[name]
+        new_value = new_values[name]
+        change = (new_value - base_value) / base_value * 100 if base_value else 0.0
+        if name.split('.')[-1] == 'failures':
+            # Any incorrect response is a regression
+            regression = new_value > base_value
+        elif name.split('.')[-1] in HIGHER_IS_BETTER:
+            regression = change < -args.threshold
+        else:
+            regression = change > args.threshold
+        regressions += regression
+        print('%-50s %14.3f %14.3f %8.1f%% %s' % (name, base_value, new_value, change, 'REGRESSION' if regression else ''))
+    print('%d regression(s) found with threshold %.1f%%' % (regressions, args.threshold))
+    if regressions > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#######################################################################################################################################################
+# Description :
+#     This program is a local stub of the AlphaVantage TIME_SERIES_DAILY_ADJUSTED csv endpoint for the ingest benchmark :
+#         1. The compact output has the latest 100 days and the full output has the given number of days, the newest date is in the first line.
+#         2. The prices of each symbol are generated from the symbol name, so the same data is returned for the same request.
+#         3. The response can be delayed to simulate the network latency.
+#
+# Remark :
+#     Start the stub alone with : python3 benchmark/stub_alphavantage.py --port 8000
+#     Then run get_raw_data.py with : ALPHAVANTAGE_BASE_URL=http://127.0.0.1:8000/query FETCH_REQUESTS_PER_MINUTE=6000 python3 get_raw_data.py
+#######################################################################################################################################################
+
+
+# Command line arguments
+import argparse
+# Get the date of generated data
+import datetime
+# Random price and volume
+import random
+# HTTP server
+import http.server
+import threading
+import time
+import urllib.parse
+
+
+# This functoin is used to generate the csv body of one symbol in the AlphaVantage layout
+# input : symbol - stocks name
+#         days   - number of days
+# output : body - csv body encoded as bytes
+def generate_csv_body(symbol, days):
+    generator = random.Random(symbol)
+    today = datetime.date.today()
+    lines = ['timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient']
+    for i in range(days):
+        date = today - datetime.timedelta(days=i)
+        open_price = generator.uniform(100, 200)
+        close_price = generator.uniform(100, 200)
+        lines.append('%s,%.4f,%.4f,%.4f,%.4f,%.4f,%d,0.0000,1.0' % (date, open_price, max(open_price, close_price), min(open_price, close_price), close_price, close_price, generator.randint(10 ** 6, 10 ** 8)))
+    return ('\r\n'.join(lines) + '\r\n').encode()
+
+
+# This functoin is used to create the stub server, the server is started in a daemon thread
+# input : port      - port to listen, 0 to use a free port
+#         full_days - number of days of the full output
+#         delay     - seconds to wait before each response
+# output : server - HTTP server, the base url is http://127.0.0.1:<server.server_port>/query
+def start_stub_server(port=0, full_days=5000, delay=0.0):
+    # The generated body is reused for the same symbol and output size
+    bodies = {}
+    lock = threading.Lock()
+
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            symbol = params.get('symbol', ['IBM'])[0]
+            days = full_days if params.get('outputsize', ['compact'])[0] == 'full' else 100
+            with lock:
+                if (symbol, days) not in bodies:
+                    bodies[(symbol, days)] = generate_csv_body(symbol, days)
+                body = bodies[(symbol, days)]
+            if delay > 0:
+                time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-download')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# This function is the main function
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the AlphaVantage csv endpoint')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen')
+    parser.add_argument('--full-days', type=int, default=5000, help='number of days of the full output')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.full_days, args.delay)
+    print('AlphaVantage stub is listening on http://127.0.0.1:%d/query' % (server.server_port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#######################################################################################################################################################
+# Description : 
+#     This is the gunicorn configuration to serve run.py with pre-forked worker processes in production.
+#     Start the server with : gunicorn -c gunicorn.conf.py "run:create_app()"
+#
+# Remark : 
+#     All the settings can be overridden by environment variables, the default value is calculated from the CPU count of container (CPU affinity and cgroup CPU quota).
+#######################################################################################################################################################
+
+
+# Environment variables and CPU count
+import os
+# Round up the CPU quota
+import math
+# Directory of the metrics files of the workers
+import shutil
+import tempfile
+
+
+# This functoin is used to get the CPU quota of the cgroup, docker --cpus and the limits.cpu of kubernetes are set as the quota
+# output : quota - CPU quota rounded up, None if there is no quota or the cgroup files are not available
+def cgroup_cpu_quota():
+    try:
+        # cgroup v2 : "<quota> <period>", the quota is "max" if there is no limit
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota == 'max':
+            return None
+        quota, period = int(quota), int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1 : the quota is -1 if there is no limit
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            return None
+    if quota <= 0 or period <= 0:
+        return None
+    return max(1, math.ceil(quota / period))
+
+
+# This functoin is used to get the CPU count available to this process, the CPU affinity and the cgroup CPU quota of container are respected
+# output : count - available CPU count
+def cpu_count():
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    return min(count, quota) if quota else count
+
+
+# Address to listen
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# Worker processes, the default is the (2 x CPU + 1) recommended by gunicorn
+workers = int(os.environ.get('GUNICORN_WORKERS', '%d' % (cpu_count() * 2 + 1)))
+# Threads per worker process, gthread worker is used when more than one thread is given
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+# Seconds to wait for the next request on a keep-alive connection
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+# Max number of pending connections
+backlog = int(os.environ.get('GUNICORN_BACKLOG', '2048'))
+# Seconds to wait for a worker before restarting it
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+# Import the app before forking the workers so that the code is shared by the worker processes
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# Write the access log to stdout
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+# Directory where each worker writes its metrics so that /metrics answers the sum of all the workers, the default directory is unique to this server
+metrics_dir = os.environ.setdefault('FINANCIAL_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'financial_metrics_%d' % (os.getpid())))
+
+
+# This functoin is used to remove the metrics files of the last run before the workers are started, it is called by gunicorn
+# input : server - gunicorn arbiter
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
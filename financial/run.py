@@ -6,44 +6,482 @@
 #             2.1. Calculate the average daily open price for the period.
 #             2.2. Calculate the average daily closing price for the period.
 #             2.3. Calculate the average daily volume for the period. 
+#             2.4. Calculate the selected extra metrics and rolling window series for the period.
+#         3. An Get statistics API to perform the calculations of many symbols and periods in one request.
+#         4. An Get export API to stream all the matching records of financial_data table as NDJSON or CSV.
+#         5. An Get bars API to aggregate the daily records of a symbol into weekly, monthly or N-day bars for charts.
 #
 # Remark : 
-#     None 
+#     The data is read from the memory-mapped snapshot published by get_raw_data.py if it exists, otherwise from the database.
 #######################################################################################################################################################
 
 
 # Flask application
 import flask
-from flask import jsonify, request
+from flask import jsonify, request, g, current_app
 # Date time format
 import datetime
 # SQL function
 import sqlite3 as sql
 from sqlite3 import Error
+# Connection pool and response cache shared by the worker threads
+import queue
+import threading
+import collections
+import time
+import json
+# Row serializer of the JSON responses, the strings are escaped by the C function of the json module
+from json.encoder import encode_basestring_ascii
+# Compression of the large responses, zstandard is optional and imported when the first zstd response is built
+import gzip
+import zlib
+# Strong ETag of the conditional requests
+import hashlib
+# Histogram buckets of the request metrics
+import bisect
+# Profiling of slow or sampled requests, cProfile and pstats are imported when the cprofile mode is used
+import random
+import sys
+# Streaming export
+import csv
+import io
+# File operation and environment variables
+import os
+from urllib.request import pathname2url
+# Read-only snapshot published by get_raw_data.py
+import mmap
+# Vectorized calculation of the extended statistics and columnar responses, it is used by most requests so it is imported before the workers are forked
+import numpy as np
+# Arrow columnar format is optional, only the NumPy columnar format is supported if pyarrow is not installed
+# pyarrow is slow to import, it is only looked up here and imported when the first arrow response is built
+import importlib.util
 
 
-# Create flask app and set configuration
-app = flask.Flask(__name__)
-app.config["DEBUG"] = True
-app.config['JSON_SORT_KEYS'] = False
-# Create error message list as a global variable
-error_list = []
+# Create the blueprint of API, it is registered to the flask app by create_app()
+api = flask.Blueprint('api', __name__)
+# Idle database connections, each item is [connection, database file signature]
+db_pool = queue.LifoQueue()
+# LRU cache of query results and responses, each item is key : [expired time, value]
+# The key includes the data version published by get_raw_data.py so that the cache is dropped after each ingest
+# The content of the version file is kept as version_info, the ETag and Last-Modified of a request are built from the versions of each stock in it
+response_cache = {'lock': threading.Lock(), 'data': collections.OrderedDict(), 'version': None, 'version_signature': None, 'version_info': None, 'hits': 0, 'misses': 0, 'evictions': 0}
+# Columnar binary formats of the financial data, the format is selected by the Accept header of request
+COLUMNAR_FORMATS = {'npz': 'application/x-npz'}
+if importlib.util.find_spec('pyarrow') is not None:
+    COLUMNAR_FORMATS['arrow'] = 'application/vnd.apache.arrow.stream'
+# Record fields used to transpose the query result of financial_data to columns, the symbol field is added by the width of the longest symbol of the rows
+COLUMNAR_FIELDS = [('date', 'datetime64[D]'), ('open_price', np.float64), ('close_price', np.float64), ('volume', np.int64)]
+# Output formats of /api/financial_data/export and the mimetype of each format
+EXPORT_FORMATS = dict({'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}, **COLUMNAR_FORMATS)
+# Row templates of the JSON serializer, the symbol and date are given as JSON strings and the numbers are given as they are
+#     json   - object of /api/financial_data, the keys are sorted as jsonify does
+#     ndjson - line of /api/financial_data/export, the keys and separators are the same as json.dumps
+ROW_TEMPLATES = {'json': '{{"close_price":"{3}","date":{1},"open_price":"{2}","symbol":{0},"volume":"{4}"}}', 'ndjson': '{{"symbol": {0}, "date": {1}, "open_price": "{2}", "close_price": "{3}", "volume": "{4}"}}\n'}
+# Content encodings of the compressed responses in the order of preference, zstd is only offered when zstandard is installed
+COMPRESS_ENCODINGS = ['gzip']
+if importlib.util.find_spec('zstandard') is not None:
+    COMPRESS_ENCODINGS.insert(0, 'zstd')
+# Extra metrics which can be selected by the metrics parameter of /api/statistics
+STATISTICS_METRICS = ['vwap', 'average_daily_return', 'volatility']
+# Bucket of the weekly and monthly bars, it is the first date of the week (Monday) or the month of the date column
+# The bars of these intervals are read from the financial_bar table updated by get_raw_data.py, the N-day bars are aggregated from the daily data
+BAR_INTERVALS = {'week': ''' date(date, 'weekday 0', '-6 days') ''', 'month': ''' substr(date, 1, 8) || '01' '''}
+# Bucket of the N-day bars, the buckets are the periods of N days counted from 1970-01-01
+BAR_DAYS_BUCKET = ''' date(2440587.5 + (CAST(julianday(date) - 2440587.5 AS INTEGER) / %d) * %d) '''
+# Max number of days of the N-day bars
+BAR_MAX_DAYS = 3660
+# Max number of months read by one query of the batch statistics, SQLite allows 500 selects in a compound query
+BATCH_MONTHS_PER_QUERY = 200
+# Request metrics of current worker process, each histogram item is key : [bucket counts, sum, count]
+#     stages   - (route, stage) : seconds spent in the stage of one request
+#     rows     - route : rows read from database by one request
+#     requests - (route, status) : number of requests
+#     changed  - True if the metrics are changed after they are written to the metrics file of current worker process
+#     writer   - [process id, thread] of the writer thread of the metrics file, it is started again in a forked worker process
+request_metrics = {'lock': threading.Lock(), 'stages': {}, 'rows': {}, 'requests': {}, 'changed': False, 'writer': None}
+# Upper bounds of the histogram buckets, the +Inf bucket is added after the last one
+METRICS_SECONDS_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+METRICS_ROWS_BUCKETS = [0, 1, 10, 100, 1000, 10000, 100000, 1000000]
+# Snapshot file layout written by get_raw_data.py : magic (8 bytes), header length (8 bytes little endian), JSON header, then the arrays
+SNAPSHOT_MAGIC = b'FINSNAP1'
+# Snapshot mapped by current worker process, it is mapped again when the file is replaced
+snapshot_state = {'lock': threading.Lock(), 'signature': None, 'snapshot': None}
+# Monthly partitions of financial_data created by get_raw_data.py, they are read again when the database schema is changed
+#     key        - (database file signature, schema version) of the cached partitions
+#     partitions - month list in ascending order, None if the database is not partitioned
+partition_state = {'lock': threading.Lock(), 'key': None, 'partitions': None}
+# Profiling state of current worker process
+#     stacks  - thread id of a profiled request : {collapsed stack : number of samples}, filled by the sampler thread
+#     sampler - [process id, thread] of the sampler thread, it is started again in a forked worker process
+#     cprofile_lock - only one request is profiled by cProfile at the same time
+#     count   - number of written profiles, it makes the profile file name unique
+profile_state = {'lock': threading.Lock(), 'stacks': {}, 'sampler': None, 'cprofile_lock': threading.Lock(), 'count': 0}
+
+
+# This functoin is used to get the error message list of current request, each request has its own list so that concurrent requests do not mix the messages
+# output : error_list - error message list stored in the request context
+def get_error_list():
+    if 'error_list' not in g:
+        g.error_list = []
+    return g.error_list
+
+
+# This functoin is used to start the timing of current request, it is called before each request
+def start_timing():
+    if current_app.config['METRICS_ENABLED']:
+        g.timings = {}
+        g.rows = 0
+        # Total time of the recorded stages, it is used to exclude the nested stages from the outer stage
+        g.stage_total = 0.0
+        g.request_start = time.perf_counter()
+
+
+# This functoin is used to start a stage of current request
+# output : start - current time and total time of the recorded stages
+def start_stage():
+    return (time.perf_counter(), g.get('stage_total', 0.0))
+
+
+# This functoin is used to add the time spent in a stage to the timing of current request, the time of the nested stages is excluded
+# input : stage - stage name, such as validate, db_connect, execute, fetch, build and serialize
+#         start - output of start_stage() when the stage is started
+def record_stage(stage, start):
+    timings = g.get('timings')
+    if timings is not None:
+        elapsed = time.perf_counter() - start[0] - (g.stage_total - start[1])
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+        g.stage_total += elapsed
+
+
+# This functoin is used to add the number of rows read from database to the timing of current request
+# input : count - number of rows
+def record_rows(count):
+    if g.get('timings') is not None:
+        g.rows += count
+
+
+# This functoin is used to add a value to a histogram, the caller should hold the lock of request_metrics
+# input : histograms - dictionary of key : [bucket counts, sum, count]
+#         key        - key of the histogram
+#         buckets    - upper bounds of the buckets
+#         value      - observed value
+def observe_histogram(histograms, key, buckets, value):
+    item = histograms.get(key)
+    if item is None:
+        item = histograms[key] = [[0] * (len(buckets) + 1), 0, 0]
+    item[0][bisect.bisect_left(buckets, value)] += 1
+    item[1] += value
+    item[2] += 1
+
+
+# This functoin is used to add the timing of current request to the request metrics, it is called after each request
+# input : response - response of current request
+# output : response - response with the Server-Timing header if it is enabled
+def finish_timing(response):
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    total = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'not_found'
+    with request_metrics['lock']:
+        for stage in timings:
+            observe_histogram(request_metrics['stages'], (route, stage), METRICS_SECONDS_BUCKETS, timings[stage])
+        observe_histogram(request_metrics['stages'], (route, 'total'), METRICS_SECONDS_BUCKETS, total)
+        observe_histogram(request_metrics['rows'], route, METRICS_ROWS_BUCKETS, g.rows)
+        key = (route, response.status_code)
+        request_metrics['requests'][key] = request_metrics['requests'].get(key, 0) + 1
+        # Share the metrics with the other worker processes by the writer thread, /metrics merges the files of all the workers
+        if current_app.config['METRICS_DIR']:
+            request_metrics['changed'] = True
+            # Start the writer thread once in each worker process
+            if request_metrics['writer'] is None or request_metrics['writer'][0] != os.getpid():
+                writer = threading.Thread(target=write_metrics_periodically, args=(current_app.config['METRICS_DIR'], current_app.config['METRICS_WRITE_INTERVAL']), daemon=True)
+                writer.start()
+                request_metrics['writer'] = [os.getpid(), writer]
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = ', '.join(['%s;dur=%.3f' % (stage, timings[stage] * 1000) for stage in timings] + ['total;dur=%.3f' % (total * 1000)])
+    return response
+
+
+# This functoin is used to get the collapsed stack of a frame, the format is root;...;leaf as used by the flame graph tools
+# input : frame - current frame of a thread
+# output : stack - collapsed stack string
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+# This functoin is used to run as the sampler thread, it samples the stack of each profiled request in turn
+# input : interval - seconds between two samples
+def sample_stacks(interval):
+    while True:
+        time.sleep(interval)
+        with profile_state['lock']:
+            if not profile_state['stacks']:
+                continue
+            frames = sys._current_frames()
+            for ident in profile_state['stacks']:
+                if ident in frames:
+                    stacks = profile_state['stacks'][ident]
+                    stack = collapse_stack(frames[ident])
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+
+# This functoin is used to start the profiling of current request, it is called before each request
+def start_profile():
+    if not current_app.config['PROFILE_ENABLED']:
+        return
+    g.profile_start = time.perf_counter()
+    g.profile_sampled = random.random() < current_app.config['PROFILE_SAMPLE_RATE']
+    if current_app.config['PROFILE_MODE'] == 'cprofile':
+        # cProfile can not profile two threads at the same time, the request is not profiled if another request is being profiled
+        if profile_state['cprofile_lock'].acquire(blocking=False):
+            import cProfile
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+    else:
+        with profile_state['lock']:
+            # Start the sampler thread once in each worker process
+            if profile_state['sampler'] is None or profile_state['sampler'][0] != os.getpid():
+                sampler = threading.Thread(target=sample_stacks, args=(current_app.config['PROFILE_INTERVAL'],), daemon=True)
+                sampler.start()
+                profile_state['sampler'] = [os.getpid(), sampler]
+            profile_state['stacks'][threading.get_ident()] = {}
+
+
+# This functoin is used to keep the status code of current request for the profile
+# input : response - response of current request
+# output : response - the same response
+def record_profile_status(response):
+    if 'profile_start' in g:
+        g.profile_status = response.status_code
+        # The teardown of a streaming response runs once when the view returns and again when the stream ends
+        g.profile_streamed = response.is_streamed
+    return response
+
+
+# This functoin is used to finish the profiling of current request, the profile is written if the request is slow or sampled
+# input : exception - exception raised during the request, None if no exception
+def finish_profile(exception):
+    if 'profile_start' not in g:
+        return
+    # Wait for the end of the stream
+    if g.pop('profile_streamed', False):
+        return
+    duration = time.perf_counter() - g.profile_start
+    profile = None
+    if 'profiler' in g:
+        g.profiler.disable()
+        profile_state['cprofile_lock'].release()
+        profiler = g.pop('profiler')
+    else:
+        profiler = None
+        with profile_state['lock']:
+            stacks = profile_state['stacks'].pop(threading.get_ident(), {})
+    if duration >= current_app.config['PROFILE_SLOW_SECONDS'] or g.profile_sampled:
+        profile = {'reason': 'slow' if duration >= current_app.config['PROFILE_SLOW_SECONDS'] else 'sampled', 'started': (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=duration)).isoformat(), 'duration': duration, 'method': request.method, 'path': request.path, 'args': request.args.to_dict(flat=False), 'accept': request.headers.get('Accept'), 'status': g.get('profile_status', 500), 'exception': repr(exception) if exception else None, 'pid': os.getpid()}
+        if profiler is not None:
+            # The functions sorted by the cumulative time, only the top functions are kept
+            import pstats
+            stats = pstats.Stats(profiler).stats
+            functions = sorted(stats, key=lambda function: stats[function][3], reverse=True)[:current_app.config['PROFILE_TOP_FUNCTIONS']]
+            profile['mode'] = 'cprofile'
+            profile['functions'] = [{'function': '%s (%s:%d)' % (function[2], function[0], function[1]), 'calls': stats[function][1], 'primitive_calls': stats[function][0], 'total_time': stats[function][2], 'cumulative_time': stats[function][3]} for function in functions]
+        else:
+            profile['mode'] = 'sample'
+            profile['interval'] = current_app.config['PROFILE_INTERVAL']
+            profile['samples'] = sum(stacks.values())
+            profile['stacks'] = stacks
+        write_profile(profile)
+
+
+# This functoin is used to write a profile into the profile directory, the oldest profiles are deleted so that at most PROFILE_MAX_FILES profiles are kept
+# input : profile - profile dictionary
+def write_profile(profile):
+    directory = current_app.config['PROFILE_DIR']
+    with profile_state['lock']:
+        profile_state['count'] += 1
+        count = profile_state['count']
+    file_name = os.path.join(directory, 'profile-%s-%d-%d.json' % (datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'), os.getpid(), count))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename it, so the reader never sees a partial file
+        with open(file_name + '.tmp', 'w') as fjson:
+            json.dump(profile, fjson)
+        os.replace(file_name + '.tmp', file_name)
+        # The profiles of all worker processes share the directory, delete the oldest ones
+        profiles = sorted([item for item in os.listdir(directory) if item.startswith('profile-') and item.endswith('.json')])
+        for item in profiles[:-current_app.config['PROFILE_MAX_FILES']]:
+            try:
+                os.remove(os.path.join(directory, item))
+            except OSError:
+                pass
+    except OSError as e:
+        current_app.logger.warning('Fail to write the profile [%s] : %s' % (file_name, e))
+
+
+# This functoin is used to run a query and record the execute time
+# input : cursor  - db cursor point
+#         sql_cmd - query command
+#         params  - query parameters
+def execute_query(cursor, sql_cmd, params=()):
+    start = start_stage()
+    cursor.execute(sql_cmd, params)
+    record_stage('execute', start)
+
+
+# This functoin is used to read all the rows of a query and record the fetch time and row count
+# input : cursor - db cursor point
+# output : rows - query result
+def fetch_rows(cursor):
+    start = start_stage()
+    rows = cursor.fetchall()
+    record_stage('fetch', start)
+    record_rows(len(rows))
+    return rows
 
 
 # This functoin is used to connect to a database
 # input : db_file - database file name
 # output : con - db connect point
 def db_connection(db_file):
-    # Use global error message list
-    global error_list
+    # Use error message list of current request
+    error_list = get_error_list()
     con = None
     try:
-        con = sql.connect(db_file)
+        # Open the existing file only, an empty database should not be created when the file is missing
+        # The connection is handed between worker threads by the pool, but only one thread uses it at the same time
+        con = sql.connect('file:%s?mode=rw' % (pathname2url(db_file)), uri=True, check_same_thread=False)
+        # WAL mode let the ingest job write without blocking the readers
+        con.execute(''' PRAGMA journal_mode = WAL ''')
+        con.execute(''' PRAGMA mmap_size = %d ''' % (current_app.config['DB_MMAP_SIZE']))
+        con.execute(''' PRAGMA cache_size = %d ''' % (current_app.config['DB_CACHE_SIZE']))
+        # The API only reads the database
+        con.execute(''' PRAGMA query_only = 1 ''')
     except Error as e:
-        error_list.append(e)
+        error_list.append('%s' % e)
+        # The result of this request should not be cached
+        g.db_error = True
+        if con:
+            con.close()
+            con = None
     return con
 
+
+# This functoin is used to get the signature of database file, the signature is changed when the file is replaced or vacuumed
+# input : db_file - database file name
+# output : signature - (device, inode, size) of the file
+#          None      - the file does not exist
+def db_signature(db_file):
+    try:
+        st = os.stat(db_file)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size)
+
+
+# This functoin is used to get the database connection of current request from the connection pool
+# output : con  - db connect point, it is returned to the pool when the request is finished
+#          None - fail to connect to database
+def get_db():
+    if 'db' not in g:
+        start = start_stage()
+        database = current_app.config['DATABASE']
+        signature = db_signature(database)
+        g.db = None
+        # Reuse an idle connection, the connection opened on an old file is recycled
+        while g.db is None:
+            try:
+                con, con_signature = db_pool.get_nowait()
+            except queue.Empty:
+                break
+            if con_signature == signature:
+                g.db = [con, con_signature]
+            else:
+                con.close()
+        # Open a new connection if there is no idle connection
+        if g.db is None:
+            con = db_connection(database)
+            if con is None:
+                return None
+            g.db = [con, db_signature(database)]
+        record_stage('db_connect', start)
+    return g.db[0] if g.db else None
+
+
+# This functoin is used to return the database connection to the connection pool when the app context is finished
+# input : exception - exception raised during the request, None if no exception
+def release_db(exception):
+    entry = g.pop('db', None)
+    if entry is None:
+        return
+    # End the read transaction started by get_partitions(), so that the connection reads the new data in the next request
+    if entry[0].in_transaction:
+        entry[0].rollback()
+    # Keep at most DB_POOL_SIZE idle connections, close the others
+    if db_pool.qsize() < current_app.config['DB_POOL_SIZE']:
+        db_pool.put(entry)
+    else:
+        entry[0].close()
+
     
+# This functoin is used to get the monthly partitions of the database, the data is read in the same read transaction as the partition list
+# A partition dropped by the house keeping of get_raw_data.py is still readable by this connection until the request is finished
+# input : connection - db connect point of current request
+# output : partitions - month list in ascending order, the format is YYYYMM
+#          None       - the database is created by an old schema without partitions
+def get_partitions(connection):
+    if 'partitions' not in g:
+        start = start_stage()
+        if not connection.in_transaction:
+            connection.execute(''' BEGIN ''')
+        # The schema version is changed when a partition is created or dropped
+        key = (g.db[1], connection.execute(''' PRAGMA schema_version ''').fetchone()[0])
+        with partition_state['lock']:
+            if partition_state['key'] == key:
+                g.partitions = partition_state['partitions']
+        if 'partitions' not in g:
+            try:
+                g.partitions = [row[0] for row in connection.execute(''' SELECT month FROM financial_partition ORDER BY month ''').fetchall()]
+            except sql.OperationalError:
+                g.partitions = None
+            with partition_state['lock']:
+                partition_state['key'] = key
+                partition_state['partitions'] = g.partitions
+        record_stage('execute', start)
+    return g.partitions
+
+
+# This functoin is used to get the tables which may have the data in given period, the partitions out of the period are not read
+# input : connection - db connect point of current request
+#         table      - financial_data or financial_data_cumsum
+#         start_date - first date of the period, None if not given
+#         end_date   - last date of the period, None if not given
+# output : tables - table list in ascending order of date, the table itself if the database is not partitioned
+def partition_tables(connection, table, start_date, end_date):
+    partitions = get_partitions(connection)
+    if partitions is None:
+        return [table]
+    first_month = start_date[:4] + start_date[5:7] if start_date else None
+    last_month = end_date[:4] + end_date[5:7] if end_date else None
+    return ['%s_%s' % (table, month) for month in partitions if (first_month is None or month >= first_month) and (last_month is None or month <= last_month)]
+
+
+# This functoin is used to build the query of the tables as one compound select, each table is read by its (symbol, date) index and the results are merged by the order
+# input : tables    - table list
+#         columns   - column list to select
+#         condition - condition filter to be used for each table, None if no filter
+#         order     - order by clause of the compound select
+# output : sql_cmd - query command
+def partition_query(tables, columns, condition, order):
+    where = ''' WHERE %s''' % (condition) if condition else ''
+    return ' UNION ALL '.join([''' SELECT %s FROM %s%s ''' % (columns, table, where) for table in tables]) + order
+
+
 # This functoin is used to check the date format
 # input : date - date value to be checked the format
 # output : True  - date format is right, it is a date string
@@ -58,12 +496,12 @@ def validate_date(date):
 
 # This functoin is used to check the date string
 # input : date    - date value to be checked the format
-#         message - error message to be stored to the global error list 
+#         message - error message to be stored to the error list of current request 
 # output : date - date value, it is a date string
 #          None - force to None, it is not a date string        
 def check_date(date, message):
-    # Use global error message list
-    global error_list
+    # Use error message list of current request
+    error_list = get_error_list()
     if validate_date(date):
         return date
     else:
@@ -76,24 +514,26 @@ def check_date(date, message):
 # output : symbol - symbol value, it is a symbol string
 #          None   - force to None, it is not a symbol string
 def check_symbol(symbol):
-    # Use global error message list
-    global error_list
-    if symbol == 'IBM' or symbol == 'Apple Inc.':
+    # Use error message list of current request
+    error_list = get_error_list()
+    # The symbol list is loaded from database and cached until the data version is changed
+    symbols = cache_query(('symbols', get_data_version()), select_symbols)
+    if symbol in symbols:
         return symbol
     else:
-        error_list.append('Parameter [symbol] input the wrong format or value [%s], avaiable symbol is \'IBM\' or \'Apple Inc.\'' % (symbol))
+        error_list.append('Parameter [symbol] input the wrong format or value [%s], avaiable symbol is %s' % (symbol, ' or '.join(['\'%s\'' % (item) for item in symbols])))
         return None
 
 
 # This functoin is used to check the integer string
 # input : value      - value to be checked the format
-#         message    - error message to be stored to the global error list
+#         message    - error message to be stored to the error list of current request
 #         init_value - initial value to output if the input value is not a integer
 # output : value      - value as integer, it is a integer string
 #          init_value - given initial value, it is not a integer string
 def check_integer(value, message, init_value):
-    # Use global error message list
-    global error_list
+    # Use error message list of current request
+    error_list = get_error_list()
     if value.isdigit() and int(value) > 0:
         # Transfer the type from string to integer
         return int(value)
@@ -102,35 +542,896 @@ def check_integer(value, message, init_value):
         return init_value
 
 
+# This functoin is used to check the interval of bars
+# input : value - interval value to be checked, week, month or the number of days such as 5d
+# output : interval - week, month or the number of days as integer
+#          None     - force to None, it is not an available interval
+def check_interval(value):
+    # Use error message list of current request
+    error_list = get_error_list()
+    if value in BAR_INTERVALS:
+        return value
+    if value[-1:] == 'd' and value[:-1].isdigit() and 0 < int(value[:-1]) <= BAR_MAX_DAYS:
+        return int(value[:-1])
+    error_list.append('Parameter [interval] input the wrong format or value [%s], avaiable interval is \'week\' or \'month\' or the number of days from 1d to %dd' % (value, BAR_MAX_DAYS))
+    return None
+
+
+# This functoin is used to get the first and last date of the bar which includes the date
+# input : date     - date string
+#         interval - week, month or the number of days
+# output : first_date, last_date - date strings of the bar, the bucket of the bar is the first date
+def bar_range(date, interval):
+    date = datetime.date.fromisoformat(date)
+    try:
+        if interval == 'week':
+            first_date = date - datetime.timedelta(days=date.weekday())
+            last_date = first_date + datetime.timedelta(days=6)
+        elif interval == 'month':
+            first_date = date.replace(day=1)
+            last_date = (first_date + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+        else:
+            first_date = datetime.date(1970, 1, 1) + datetime.timedelta(days=(date - datetime.date(1970, 1, 1)).days // interval * interval)
+            last_date = first_date + datetime.timedelta(days=interval - 1)
+    except OverflowError:
+        # The bar is out of the supported dates, only the dates of the request are used
+        first_date, last_date = date, date
+    return str(first_date), str(last_date)
+
+
+# This functoin is used to get the data version published by get_raw_data.py, the cache is dropped when the version is changed
+# output : version - data version in the version file, or the signature of database file if the version file does not exist
+def get_data_version():
+    database = current_app.config['DATABASE']
+    # Only the file status is checked for each request, the version file is read when it is replaced
+    signature = db_signature(database + '.version')
+    with response_cache['lock']:
+        if signature is None:
+            version = db_signature(database)
+            response_cache['version_info'] = None
+        elif signature == response_cache['version_signature']:
+            version = response_cache['version']
+        else:
+            try:
+                with open(database + '.version', 'r') as fver:
+                    version_info = json.load(fver)
+                version = version_info['version']
+            except (OSError, ValueError, KeyError, TypeError):
+                version_info = None
+                version = db_signature(database)
+            response_cache['version_info'] = version_info
+        response_cache['version_signature'] = signature
+        # Drop the cache of old version
+        if version != response_cache['version']:
+            response_cache['version'] = version
+            response_cache['data'].clear()
+    return version
+
+
+# This functoin is used to get the first date covered by the date parameters of a request, the parameters are not checked here
+# input : start_date - start_date parameter, None if not given
+#         end_date   - end_date parameter, None if not given
+# output : date - first date covered by the request, None if the request covers the data from the beginning
+def covered_start_date(start_date, end_date):
+    start_date = start_date if start_date and validate_date(start_date) else None
+    end_date = end_date if end_date and validate_date(end_date) else None
+    if start_date and end_date:
+        return min(start_date, end_date)
+    return start_date
+
+
+# This functoin is used to answer the conditional request by the versions of the data covered by the request, it is called before the database is opened
+# The ETag is built from the path, parameters, response format and the latest version of the covered stocks, so it is only changed when an ingest changes the covered data
+# input : symbols    - symbol parameters of the request, all the stocks are covered if it is empty or any symbol is unknown
+#         start_date - first date covered by the request, None if it covers the data from the beginning
+# output : response - 304 response, the client has the current response
+#          None     - the response should be built, the ETag and Last-Modified are added to it by add_validators()
+def check_not_modified(symbols, start_date):
+    if not current_app.config['CONDITIONAL_GET_ENABLED']:
+        return None
+    get_data_version()
+    with response_cache['lock']:
+        version_info = response_cache['version_info']
+    # The version file is written by an old get_raw_data.py or does not exist
+    if not version_info or not version_info.get('symbols'):
+        return None
+    symbol_versions = version_info['symbols']
+    # The response of an unknown symbol lists all the symbols
+    if not symbols or any([symbol not in symbol_versions for symbol in symbols]):
+        symbols = list(symbol_versions)
+    versions = [symbol_versions[symbol] for symbol in symbols]
+    # The data before the expired date is changed by house keeping
+    expired = version_info.get('expired')
+    if expired and (start_date is None or start_date < expired['date']):
+        versions.append([expired['version'], expired['last_modified']])
+    version = max([item[0] for item in versions])
+    # Last-Modified has the precision of seconds
+    last_modified = max([datetime.datetime.fromisoformat(item[1]) for item in versions]).replace(microsecond=0)
+    # The strong ETag is different for each content encoding of the same data
+    etag = hashlib.sha256(json.dumps([request.path, sorted(request.args.items(multi=True)), get_columnar_format(), get_content_encoding(), version]).encode()).hexdigest()[:32]
+    g.validators = (etag, last_modified)
+    # If-Modified-Since is ignored when If-None-Match is given
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    if not not_modified:
+        return None
+    response = current_app.response_class(status=304)
+    response.vary.add('Accept')
+    return response
+
+
+# This functoin is used to add the ETag and Last-Modified built by check_not_modified() to the response, it is called after each request
+# input : response - response of the request
+# output : response - response with the validators
+def add_validators(response):
+    validators = g.get('validators')
+    if validators and response.status_code in [200, 304]:
+        response.set_etag(validators[0])
+        response.last_modified = validators[1]
+        # The response can be stored by the client and CDN, but it should be validated before each reuse
+        response.cache_control.no_cache = True
+    return response
+
+
+# This functoin is used to select the content encoding by the Accept-Encoding header of request
+# output : encoding - item of COMPRESS_ENCODINGS, None if the response is not compressed
+def get_content_encoding():
+    if not current_app.config['COMPRESS_ENABLED']:
+        return None
+    return request.accept_encodings.best_match(COMPRESS_ENCODINGS)
+
+
+# This functoin is used to compress the chunks of a streaming response, each chunk is flushed so that the client receives the rows without delay
+# input : chunks   - chunks of the response, the iterator is closed when the compressed chunks are closed
+#         encoding - item of COMPRESS_ENCODINGS
+#         level    - compression level of the encoding, the chunks are compressed after the app context of request is popped
+# output : compressed chunks
+def compress_chunks(chunks, encoding, level):
+    if encoding == 'zstd':
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+        # wbits 31 writes the gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        flush_mode = zlib.Z_SYNC_FLUSH
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush(flush_mode)
+        yield compressor.flush()
+    finally:
+        # Release the request context kept by the streaming response even if the client is disconnected
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+# This functoin is used to compress the response by the content encoding accepted by the client, it is called after each request
+# The small responses are not compressed, the time to compress them is more than the time to send them
+# input : response - response of the request
+# output : response - compressed response, or the same response if it is not compressed
+def compress_response(response):
+    if not current_app.config['COMPRESS_ENABLED'] or response.status_code not in [200, 304] or response.direct_passthrough:
+        return response
+    # The response of the same URL is different for each Accept-Encoding
+    response.vary.add('Accept-Encoding')
+    encoding = get_content_encoding()
+    if encoding is None or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    start = start_stage()
+    level = current_app.config['ZSTD_LEVEL'] if encoding == 'zstd' else current_app.config['GZIP_LEVEL']
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        if encoding == 'zstd':
+            import zstandard
+            response.set_data(zstandard.ZstdCompressor(level=level).compress(body))
+        else:
+            # mtime is fixed so that the same body is always compressed to the same bytes
+            response.set_data(gzip.compress(body, level, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    record_stage('compress', start)
+    return response
+
+
+# This functoin is used to get the value from cache
+# input : key - cache key
+# output : value - cached value
+#          None  - the key is not cached or expired
+def cache_get(key):
+    with response_cache['lock']:
+        item = response_cache['data'].get(key)
+        if item is not None and item[0] > time.monotonic():
+            # Mark as the most recently used
+            response_cache['data'].move_to_end(key)
+            response_cache['hits'] += 1
+            return item[1]
+        if item is not None:
+            del response_cache['data'][key]
+        response_cache['misses'] += 1
+        return None
+
+
+# This functoin is used to put the value into cache, the least recently used value is evicted when the cache is full
+# input : key   - cache key
+#         value - value to be cached
+def cache_put(key, value):
+    # Do not cache if there is a database error in current request or the cache is disabled
+    if g.get('db_error') or current_app.config['CACHE_SIZE'] < 1:
+        return
+    with response_cache['lock']:
+        response_cache['data'][key] = [time.monotonic() + current_app.config['CACHE_TTL'], value]
+        response_cache['data'].move_to_end(key)
+        while len(response_cache['data']) > current_app.config['CACHE_SIZE']:
+            response_cache['data'].popitem(last=False)
+            response_cache['evictions'] += 1
+
+
+# This functoin is used to get the query result from cache, the query is executed only when the result is not cached
+# input : key      - cache key
+#         function - query function
+#         args     - arguments of query function
+# output : value - query result
+def cache_query(key, function, *args):
+    value = cache_get(key)
+    if value is None:
+        value = function(*args)
+        cache_put(key, value)
+    return value
+
+
+# This functoin is used to map the snapshot file published by get_raw_data.py, the arrays are read from the page cache shared by all worker processes
+# input : snapshot_file - snapshot file name
+# output : snapshot - dictionary of the data version, symbol names, symbol list and the arrays, see publish_snapshot() of get_raw_data.py
+def load_snapshot(snapshot_file):
+    with open(snapshot_file, 'rb') as fsnap:
+        # The mapping is kept by the arrays, it is still valid after the file is replaced or the file is closed
+        mapped = mmap.mmap(fsnap.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:8] != SNAPSHOT_MAGIC:
+        raise ValueError('The file is not a snapshot file')
+    header_length = int.from_bytes(mapped[8:16], 'little')
+    header = json.loads(mapped[16:16 + header_length])
+    arrays = {}
+    for name in header['arrays']:
+        dtype, offset, length = header['arrays'][name]
+        arrays[name] = np.frombuffer(mapped, dtype=dtype, count=length, offset=16 + header_length + offset)
+    return {'version': header['version'], 'names': np.array(header['names'], dtype=np.str_), 'index': dict([(name, i) for i, name in enumerate(header['names'])]), 'symbol_list': tuple(header['symbol_list']), 'arrays': arrays}
+
+
+# This functoin is used to get the snapshot of current data version, the same snapshot is used in the whole request
+# output : snapshot - snapshot dictionary
+#          None     - the snapshot is disabled, not published, or not published for the current data version yet, read the database instead
+def get_snapshot():
+    if not current_app.config['SNAPSHOT_ENABLED']:
+        return None
+    if 'snapshot' not in g:
+        snapshot_file = current_app.config['SNAPSHOT_FILE'] or current_app.config['DATABASE'] + '.snapshot'
+        # Only the file status is checked for each request, the file is mapped again when it is replaced
+        signature = db_signature(snapshot_file)
+        with snapshot_state['lock']:
+            if signature != snapshot_state['signature']:
+                snapshot = None
+                if signature is not None:
+                    try:
+                        snapshot = load_snapshot(snapshot_file)
+                    except (OSError, ValueError, KeyError) as e:
+                        current_app.logger.warning('Fail to load the snapshot [%s] : %s' % (snapshot_file, e))
+                snapshot_state['signature'] = signature
+                snapshot_state['snapshot'] = snapshot
+            snapshot = snapshot_state['snapshot']
+        # The snapshot is published after the data version, the database is read until the snapshot of the new version is published
+        if snapshot is not None and snapshot['version'] != get_data_version():
+            snapshot = None
+        g.snapshot = snapshot
+    return g.snapshot
+
+
+# This functoin is used to find the rows of the given symbols and period in the snapshot by binary search
+# input : snapshot   - snapshot dictionary
+#         symbols    - symbol list, all symbols if None
+#         start_date - first date condition, None if not given
+#         end_date   - last date condition, None if not given
+# output : first - numpy array of the first row of each symbol
+#          last  - numpy array of the row after the last row of each symbol
+def snapshot_ranges(snapshot, symbols, start_date, end_date):
+    if symbols is None:
+        index = np.arange(len(snapshot['names']), dtype=np.int64)
+    else:
+        index = np.array([snapshot['index'][symbol] for symbol in symbols if symbol in snapshot['index']], dtype=np.int64)
+    # The key is symbol index * 2^32 + date + 2^31, the date range of a symbol is a key range
+    first_date = (np.datetime64(start_date, 'D') - np.datetime64(0, 'D')).astype(np.int64) if start_date else -2 ** 31
+    last_date = (np.datetime64(end_date, 'D') - np.datetime64(0, 'D')).astype(np.int64) if end_date else 2 ** 31 - 1
+    key = snapshot['arrays']['key']
+    first = np.searchsorted(key, index * 2 ** 32 + first_date + 2 ** 31, 'left')
+    last = np.searchsorted(key, index * 2 ** 32 + last_date + 2 ** 31, 'right')
+    return first, np.maximum(first, last)
+
+
+# This functoin is used to read the rows of financial_data in the snapshot in the same order as the database
+# input : snapshot - snapshot dictionary
+#         ranges   - (first, last) found by snapshot_ranges()
+#         offset   - number of matching rows to skip
+#         limit    - max number of rows to return
+# output : rows - list of (symbol, date, open_price, close_price, volume)
+def snapshot_rows(snapshot, ranges, offset, limit):
+    first, last = ranges
+    counts = last - first
+    ends = np.cumsum(counts)
+    total = int(ends[-1]) if len(ends) > 0 else 0
+    # Map the position in the matching rows to the row in the snapshot
+    positions = np.arange(offset, min(offset + limit, total), dtype=np.int64)
+    segment = np.searchsorted(ends, positions, 'right')
+    rows_index = first[segment] + positions - (ends[segment] - counts[segment])
+    arrays = snapshot['arrays']
+    symbol = snapshot['names'][arrays['symbol'][rows_index]].tolist()
+    date = arrays['date'][rows_index].astype('datetime64[D]').astype(np.str_).tolist()
+    return list(zip(symbol, date, arrays['open_price'][rows_index].tolist(), arrays['close_price'][rows_index].tolist(), arrays['volume'][rows_index].tolist()))
+
+
+# This functoin is used to calculate the statistics of one symbol and period in the snapshot by the cumulative sums
+# input : snapshot   - snapshot dictionary
+#         symbol     - symbol value
+#         start_date - first date of the period
+#         end_date   - last date of the period
+# output : result - [count, sum of open_price, sum of close_price, sum of volume] in the same way as select_statistics()
+def snapshot_statistics(snapshot, symbol, start_date, end_date):
+    first, last = snapshot_ranges(snapshot, [symbol], start_date, end_date)
+    if len(first) < 1 or last[0] <= first[0]:
+        return [0, None, None, None]
+    first, last = int(first[0]), int(last[0])
+    arrays = snapshot['arrays']
+    return [last - first, int(arrays['cum_open_price'][last] - arrays['cum_open_price'][first]) / 10000, int(arrays['cum_close_price'][last] - arrays['cum_close_price'][first]) / 10000, int(arrays['cum_volume'][last] - arrays['cum_volume'][first])]
+
+
+# This functoin is used to aggregate the rows of one symbol and period in the snapshot into bars
+# input : snapshot   - snapshot dictionary
+#         symbol     - symbol value
+#         interval   - week, month or the number of days
+#         start_date - first date of the period, None if not given
+#         end_date   - last date of the period, None if not given
+# output : rows - list of (bucket, first_date, last_date, open_price, close_price, volume, bar_count) in the same way as select_bars()
+def snapshot_bars(snapshot, symbol, interval, start_date, end_date):
+    first, last = snapshot_ranges(snapshot, [symbol], start_date, end_date)
+    if len(first) < 1 or last[0] <= first[0]:
+        return []
+    first, last = int(first[0]), int(last[0])
+    arrays = snapshot['arrays']
+    dates = arrays['date'][first:last].astype(np.int64)
+    # The bucket of each row as days since 1970-01-01, which is a Thursday
+    if interval == 'week':
+        buckets = (dates + 3) // 7 * 7 - 3
+    elif interval == 'month':
+        buckets = dates.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    else:
+        buckets = dates // interval * interval
+    # The rows are ordered by date, a new bar starts where the bucket is changed
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.concatenate((starts[1:], [len(buckets)]))
+    to_date = lambda values: values.astype('datetime64[D]').astype(np.str_).tolist()
+    return list(zip(to_date(buckets[starts]), to_date(dates[starts]), to_date(dates[ends - 1]), arrays['open_price'][first + starts].tolist(), arrays['close_price'][first + ends - 1].tolist(), (arrays['cum_volume'][first + ends] - arrays['cum_volume'][first + starts]).tolist(), (ends - starts).tolist()))
+
+
+# This functoin is used to build the response from the cached response body
+# input : body     - response body
+#         mimetype - mimetype of the response body
+# output : response - response with the cached body
+def cached_response(body, mimetype='application/json'):
+    return current_app.response_class(body, mimetype=mimetype)
+
+
+# This functoin is used to select the columnar format by the Accept header of request
+# output : columnar_format - key of COLUMNAR_FORMATS, None if JSON is accepted
+def get_columnar_format():
+    offers = ['application/json'] + list(COLUMNAR_FORMATS.values())
+    mimetype = request.accept_mimetypes.best_match(offers, default='application/json')
+    for columnar_format in COLUMNAR_FORMATS:
+        if COLUMNAR_FORMATS[columnar_format] == mimetype:
+            return columnar_format
+    return None
+
+
 # This functoin is used to query the data from database
-# input : condition - condition filter to be used for query command
+# input : condition   - condition filter to be used for query command
+#         limit       - max number of rows to return, None means no limit
+#         offset      - number of rows to skip before returning, only used with limit
+#         data_filter - (start_date, end_date, symbol) of the condition to read the snapshot, None to read the database
 # output : results - database query result
-def select_table(condition):
-    # Use global error message list
-    global error_list
+def select_table(condition, limit=None, offset=0, data_filter=None):
     results = []
-    database = "financial_data.db"
-    # Create a database connection
-    connection = db_connection(database)
-    with connection:
+    snapshot = get_snapshot() if data_filter else None
+    if snapshot is not None:
+        start = start_stage()
+        ranges = snapshot_ranges(snapshot, [data_filter[2]] if data_filter[2] else None, *sorted_dates(data_filter[0], data_filter[1]))
+        results = snapshot_rows(snapshot, ranges, offset if limit else 0, limit or snapshot['arrays']['key'].size)
+        record_stage('snapshot', start)
+        record_rows(len(results))
+        return results
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        tables = partition_tables(connection, 'financial_data', *sorted_dates(*(data_filter or (None, None))[:2]))
+        if not tables:
+            return results
         # Create a database cursor
         cursor = connection.cursor()
-        if condition:
-            # Query with condition
-            sql_cmd = ''' SELECT * FROM financial_data WHERE %s ORDER BY symbol ASC, date ASC ''' % (condition)
-        else:
-            # Query without condition
-            sql_cmd = ''' SELECT * FROM financial_data ORDER BY symbol ASC, date ASC '''
-        cursor.execute(sql_cmd)
+        # Query with condition if it is given
+        sql_cmd = partition_query(tables, 'symbol, date, open_price, close_price, volume', condition, ''' ORDER BY symbol ASC, date ASC ''')
+        if limit:
+            # Only read one page of data, let database skip the rows before the page
+            sql_cmd = sql_cmd + ''' LIMIT %d OFFSET %d ''' % (limit, offset)
+        execute_query(cursor, sql_cmd)
         # Get the query data
-        results = cursor.fetchall()
+        results = fetch_rows(cursor)
+        # Close database cursor
+        cursor.close()
+    return results
+
+
+# This functoin is used to read the data in database batch by batch, only one batch is kept in memory
+# input : condition   - condition filter to be used for query command
+#         batch_size  - number of rows read by each fetchmany
+#         data_filter - (start_date, end_date, symbol) of the condition to read the snapshot, None to read the database
+# output : batch of rows, each row is (symbol, date, open_price, close_price, volume)
+def iterate_table(condition, batch_size, data_filter=None):
+    snapshot = get_snapshot() if data_filter else None
+    if snapshot is not None:
+        # The snapshot is kept by this generator, a new snapshot does not change the rows of this export
+        ranges = snapshot_ranges(snapshot, [data_filter[2]] if data_filter[2] else None, *sorted_dates(data_filter[0], data_filter[1]))
+        total = int((ranges[1] - ranges[0]).sum())
+        for offset in range(0, total, batch_size):
+            yield snapshot_rows(snapshot, ranges, offset, batch_size)
+        return
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        tables = partition_tables(connection, 'financial_data', *sorted_dates(*(data_filter or (None, None))[:2]))
+        if not tables:
+            return
+        # Create a database cursor, the rows are read from database while the cursor is iterated
+        cursor = connection.cursor()
+        # Query with condition if it is given
+        sql_cmd = partition_query(tables, 'symbol, date, open_price, close_price, volume', condition, ''' ORDER BY symbol ASC, date ASC ''')
+        try:
+            execute_query(cursor, sql_cmd)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            # Close database cursor, it is also closed when the client stops reading the response
+            cursor.close()
+
+
+# This functoin is used to count the data in database
+# input : condition   - condition filter to be used for query command
+#         data_filter - (start_date, end_date, symbol) of the condition to read the snapshot, None to read the database
+# output : result - count of all records matching the condition
+def count_table(condition, data_filter=None):
+    result = 0
+    snapshot = get_snapshot() if data_filter else None
+    if snapshot is not None:
+        start = start_stage()
+        first, last = snapshot_ranges(snapshot, [data_filter[2]] if data_filter[2] else None, *sorted_dates(data_filter[0], data_filter[1]))
+        record_stage('snapshot', start)
+        return int((last - first).sum())
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        tables = partition_tables(connection, 'financial_data', *sorted_dates(*(data_filter or (None, None))[:2]))
+        if not tables:
+            return result
+        # Create a database cursor
+        cursor = connection.cursor()
+        # Count with condition if it is given, the counts of the tables are summed
+        sql_cmd = ''' SELECT SUM(count) FROM (%s) ''' % (partition_query(tables, 'COUNT(*) AS count', condition, ''))
+        execute_query(cursor, sql_cmd)
+        # Get the count value
+        result = cursor.fetchone()[0]
+        # Close database cursor
+        cursor.close()
+    return result
+
+
+# This functoin is used to get the symbol list from database
+# output : results - symbol list
+def select_symbols():
+    results = ()
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot['symbol_list']
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        # Create a database cursor
+        cursor = connection.cursor()
+        try:
+            sql_cmd = ''' SELECT symbol FROM financial_symbol ORDER BY symbol ASC '''
+            execute_query(cursor, sql_cmd)
+        except sql.OperationalError:
+            # The symbol table is not created by get_raw_data.py yet, get the symbols from data
+            sql_cmd = ''' SELECT DISTINCT symbol FROM financial_data ORDER BY symbol ASC '''
+            execute_query(cursor, sql_cmd)
+        results = tuple([row[0] for row in fetch_rows(cursor)])
+        # Close database cursor
+        cursor.close()
+    return results
+
+
+# This functoin is used to calculate the statistics of data in database
+# input : symbol     - symbol condition
+#         start_date - first date condition
+#         end_date   - last date condition
+# output : result - [count, sum of open_price, sum of close_price, sum of volume] of the records between start_date and end_date
+def select_statistics(symbol, start_date, end_date):
+    result = [0, None, None, None]
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        start = start_stage()
+        result = snapshot_statistics(snapshot, symbol, start_date, end_date)
+        record_stage('snapshot', start)
+        return result
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        # Create a database cursor
+        cursor = connection.cursor()
+        try:
+            result = select_cumsum_statistics(cursor, partition_tables(connection, 'financial_data_cumsum', start_date, end_date), symbol, start_date, end_date)
+        except sql.OperationalError:
+            # The cumulative sum table is not created by get_raw_data.py yet, aggregate in database, the (symbol, date) index covers all the columns
+            sql_cmd = ''' SELECT COUNT(*), SUM(open_price), SUM(close_price), SUM(volume) FROM financial_data WHERE symbol = ? AND date >= ? AND date <= ? '''
+            execute_query(cursor, sql_cmd, [symbol, start_date, end_date])
+            result = cursor.fetchone()
+        # Close database cursor
+        cursor.close()
+    return result
+
+
+# This functoin is used to calculate the statistics of one symbol and period by the difference of two cumulative sums
+# The cumulative sums of a stock continue from one partition to the next, so the two records can be in different partitions
+# input : cursor     - db cursor point
+#         tables     - cumulative sum tables of the period in ascending order of date
+#         symbol     - symbol condition
+#         start_date - first date condition
+#         end_date   - last date condition
+# output : result - [count, sum of open_price, sum of close_price, sum of volume] of the records between start_date and end_date
+def select_cumsum_statistics(cursor, tables, symbol, start_date, end_date):
+    result = [0, None, None, None]
+    # The cumulative sum of the last record before end_date, it is in the newest table which has the records of the stock
+    last_sum = None
+    for table in reversed(tables):
+        sql_cmd = ''' SELECT row_count, cum_open_price, cum_close_price, cum_volume FROM %s WHERE symbol = ? AND date <= ? ORDER BY date DESC LIMIT 1 ''' % (table)
+        execute_query(cursor, sql_cmd, [symbol, end_date])
+        last_sum = cursor.fetchone()
+        if last_sum:
+            break
+    # The cumulative sum before the first record after start_date, it is in the oldest table which has the records of the stock
+    first_sum = None
+    for table in tables if last_sum else []:
+        sql_cmd = ''' SELECT row_count - 1, cum_open_price - CAST(ROUND(open_price * 10000) AS INTEGER), cum_close_price - CAST(ROUND(close_price * 10000) AS INTEGER), cum_volume - volume FROM %s WHERE symbol = ? AND date >= ? ORDER BY date ASC LIMIT 1 ''' % (table)
+        execute_query(cursor, sql_cmd, [symbol, start_date])
+        first_sum = cursor.fetchone()
+        if first_sum:
+            break
+    # The statistics of the period is the difference of the two cumulative sums, the prices are summed in unit of 0.0001
+    if last_sum and first_sum and last_sum[0] > first_sum[0]:
+        result = [last_sum[0] - first_sum[0], (last_sum[1] - first_sum[1]) / 10000, (last_sum[2] - first_sum[2]) / 10000, last_sum[3] - first_sum[3]]
+    return result
+
+
+# This functoin is used to select the daily price series of one symbol in given period, the (symbol, date) index covers all the columns so that it is one index range scan
+# input : symbol     - symbol value
+#         start_date - first date of the period
+#         end_date   - last date of the period
+# output : dates  - date list in ascending order
+#          values - numpy array of [open_price, close_price, volume] for each date
+def select_price_series(symbol, start_date, end_date):
+    rows = []
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        # The arrays of the snapshot are sliced without building the rows
+        start = start_stage()
+        first, last = snapshot_ranges(snapshot, [symbol], start_date, end_date)
+        first, last = (int(first[0]), int(last[0])) if len(first) > 0 else (0, 0)
+        arrays = snapshot['arrays']
+        dates = arrays['date'][first:last].astype('datetime64[D]').astype(np.str_).tolist()
+        values = np.column_stack((arrays['open_price'][first:last], arrays['close_price'][first:last], arrays['volume'][first:last].astype(np.float64)))
+        record_stage('snapshot', start)
+        record_rows(len(dates))
+        return dates, values
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        tables = partition_tables(connection, 'financial_data', start_date, end_date)
+        # Create a database cursor
+        cursor = connection.cursor()
+        if tables:
+            sql_cmd = partition_query(tables, 'date, open_price, close_price, volume', 'symbol = ? AND date >= ? AND date <= ?', ''' ORDER BY date ''')
+            execute_query(cursor, sql_cmd, [symbol, start_date, end_date] * len(tables))
+            rows = fetch_rows(cursor)
+        # Close database cursor
+        cursor.close()
+    dates = [row[0] for row in rows]
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), 3)
+    return dates, values
+
+
+# This functoin is used to select the bars of one symbol, the bars of the buckets overlapping the period are whole bars
+# The weekly and monthly bars are read from the financial_bar table by its primary key, the other bars are aggregated from the daily data of the period
+# input : symbol     - symbol value
+#         interval   - week, month or the number of days
+#         start_date - first date of the period, None if not given
+#         end_date   - last date of the period, None if not given
+# output : rows - list of (bucket, first_date, last_date, open_price, close_price, volume, bar_count) in ascending order of bucket
+def select_bars(symbol, interval, start_date, end_date):
+    rows = []
+    # The period is extended to the first and last bar
+    first_date = bar_range(start_date, interval)[0] if start_date else '0000-00-00'
+    last_date = bar_range(end_date, interval)[1] if end_date else '9999-99-99'
+    # Get a database connection from the connection pool
+    connection = get_db() if interval in BAR_INTERVALS else None
+    if connection:
+        # Create a database cursor
+        cursor = connection.cursor()
+        try:
+            sql_cmd = ''' SELECT bucket, first_date, last_date, open_price, close_price, volume, bar_count FROM financial_bar WHERE interval = ? AND symbol = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket ASC '''
+            execute_query(cursor, sql_cmd, [interval, symbol, first_date, last_date])
+            return fetch_rows(cursor)
+        except sql.OperationalError:
+            # The bar table is not created by get_raw_data.py yet, aggregate the daily data
+            pass
+        finally:
+            # Close database cursor
+            cursor.close()
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        start = start_stage()
+        rows = snapshot_bars(snapshot, symbol, interval, start_date and first_date, end_date and last_date)
+        record_stage('snapshot', start)
+        record_rows(len(rows))
+        return rows
+    connection = get_db()
+    if connection:
+        tables = partition_tables(connection, 'financial_data', start_date and first_date, end_date and last_date)
+        # Create a database cursor
+        cursor = connection.cursor()
+        if tables:
+            bucket = BAR_INTERVALS[interval] if interval in BAR_INTERVALS else BAR_DAYS_BUCKET % (interval, interval)
+            # The running aggregates of the last day of a bucket are the aggregates of the whole bucket, each partition is read by the (symbol, date) index
+            sql_cmd = ''' SELECT bucket, first_date, date, open_price, close_price, volume, bar_count FROM (
+                    SELECT bucket, date, FIRST_VALUE(date) OVER w AS first_date, FIRST_VALUE(open_price) OVER w AS open_price, close_price, SUM(volume) OVER w AS volume, COUNT(*) OVER w AS bar_count, ROW_NUMBER() OVER (PARTITION BY bucket ORDER BY date DESC) AS rn
+                    FROM (SELECT %s AS bucket, date, open_price, close_price, volume FROM (%s))
+                    WINDOW w AS (PARTITION BY bucket ORDER BY date ROWS UNBOUNDED PRECEDING))
+                WHERE rn = 1 ORDER BY bucket ASC ''' % (bucket, partition_query(tables, 'date, open_price, close_price, volume', 'symbol = ? AND date >= ? AND date <= ?', ''))
+            execute_query(cursor, sql_cmd, [symbol, first_date, last_date] * len(tables))
+            rows = fetch_rows(cursor)
+        # Close database cursor
+        cursor.close()
+    return rows
+
+
+# This functoin is used to calculate the statistics of the daily price series in the same way as select_statistics(), the prices are summed in unit of 0.0001
+# input : values - numpy array of [open_price, close_price, volume] for each date
+# output : result - [count, sum of open_price, sum of close_price, sum of volume]
+def sum_price_series(values):
+    price_sum = np.rint(values[:, :2] * 10000).astype(np.int64).sum(axis=0)
+    return [len(values), int(price_sum[0]) / 10000, int(price_sum[1]) / 10000, int(values[:, 2].sum())]
+
+
+# This functoin is used to calculate the sum of a rolling window for each position of an array by the cumulative sum
+# The sums of an integer array are exact, so the prices should be given in unit of 0.0001 as the cumulative sum tables
+# input : array  - numpy array
+#         window - number of items in the window
+# output : numpy array of the sum of each window, the length is len(array) - window + 1, it has the same type as the array
+def rolling_sum(array, window):
+    cumsum = np.concatenate((np.zeros(1, dtype=array.dtype), np.cumsum(array)))
+    return cumsum[window:] - cumsum[:-window]
+
+
+# This functoin is used to build the extended statistics of one symbol and period from the daily price series
+# input : data_dict - statistics data built by build_statistics(), the extended statistics are added to it
+#         dates     - date list in ascending order
+#         values    - numpy array of [open_price, close_price, volume] for each date
+#         metrics   - selected metrics in STATISTICS_METRICS
+#         window    - number of days of the rolling window at least 2, None if the rolling series is not requested
+# output : data_dict - statistics data with the selected metrics and rolling series
+def build_extended_statistics(data_dict, dates, values, metrics, window):
+    # Use error message list of current request
+    error_list = get_error_list()
+    open_price, close_price, volume = values[:, 0], values[:, 1], values[:, 2]
+    # Daily return is the change rate of close price from the previous trading day in the period
+    returns = close_price[1:] / close_price[:-1] - 1
+    if 'vwap' in metrics:
+        # Volume weighted average of the close price
+        total_volume = volume.sum()
+        data_dict['vwap'] = ('%.2f' % (np.dot(close_price, volume) / total_volume if total_volume > 0 else 0))
+    if 'average_daily_return' in metrics:
+        data_dict['average_daily_return'] = ('%.6f' % (returns.mean() if len(returns) > 0 else 0))
+    if 'volatility' in metrics:
+        # Sample standard deviation of the daily returns
+        data_dict['volatility'] = ('%.6f' % (returns.std(ddof=1) if len(returns) > 1 else 0))
+    if window:
+        rolling_list = []
+        if len(dates) < window + 1:
+            error_list.append('Data not enough for parameter [window] [%d], found %d days between [%s] ~ [%s]' % (window, len(dates), data_dict['start_date'], data_dict['end_date']))
+        else:
+            # Each rolling item ends at the date, the volatility uses the returns of the last window days
+            # The prices and volume are summed as integers in unit of 0.0001 and divided at the end, so the averages are the same as /api/statistics of the same days
+            scaled = np.rint(values[:, :2] * 10000).astype(np.int64)
+            average_open_price = rolling_sum(scaled[:, 0], window)[1:] / 10000 / window
+            average_close_price = rolling_sum(scaled[:, 1], window)[1:] / 10000 / window
+            average_volume = rolling_sum(np.rint(volume).astype(np.int64), window)[1:] / window
+            # The variance does not change by a shift, the returns are centered to reduce the cancellation of the two sums
+            centered = returns - returns.mean()
+            sum_returns = rolling_sum(centered, window)
+            sum_squares = rolling_sum(centered * centered, window)
+            volatility = np.sqrt(np.maximum(sum_squares - sum_returns * sum_returns / window, 0) / (window - 1))
+            for i in range(len(sum_returns)):
+                rolling_list.append({'date': dates[i + window], 'moving_average_open_price': ('%.2f' % average_open_price[i]), 'moving_average_close_price': ('%.2f' % average_close_price[i]), 'moving_average_volume': int(average_volume[i]), 'volatility': ('%.6f' % volatility[i])})
+        data_dict['rolling'] = rolling_list
+    return data_dict
+
+
+# This functoin is used to calculate the statistics of many symbols and periods in the partitioned database by two grouped queries
+# The first query finds the months of the first and last record of each (symbol, period) from the monthly bars in the financial_bar table,
+# the second query reads the two cumulative sums of each (symbol, period) from the partitions of these months only
+# input : cursor        - db cursor point
+#         symbol_values - VALUES list of the symbols
+#         period_values - VALUES list of the (index, start_date, end_date) of the periods
+#         params        - symbols and the dates of the periods
+# output : results - dict of (symbol, period index) : [count, sum of open_price, sum of close_price, sum of volume], the item without data is not included
+def select_partition_batch_statistics(cursor, symbol_values, period_values, params):
+    results = {}
+    # The month of the first record on or after start_date, and the month of the last record on or before end_date, the bars are found by the primary key
+    sql_cmd = ''' WITH s(symbol) AS (VALUES %s), p(idx, start_date, end_date) AS (VALUES %s)
+        SELECT s.symbol, p.idx, p.start_date, p.end_date,
+            (SELECT MIN(bucket) FROM financial_bar WHERE interval = 'month' AND symbol = s.symbol AND bucket >= substr(p.start_date, 1, 8) || '01' AND bucket <= p.end_date AND last_date >= p.start_date),
+            (SELECT MAX(bucket) FROM financial_bar WHERE interval = 'month' AND symbol = s.symbol AND bucket >= substr(p.start_date, 1, 8) || '01' AND bucket <= p.end_date AND first_date <= p.end_date)
+        FROM s CROSS JOIN p ''' % (symbol_values, period_values)
+    execute_query(cursor, sql_cmd, params)
+    # Month : lookups of the month, each lookup is [symbol, period index, 0 for the first record or 1 for the last record, date]
+    lookups = {}
+    for row in fetch_rows(cursor):
+        # No record of the symbol in the period
+        if row[4] is None or row[5] is None:
+            continue
+        lookups.setdefault(row[4][:4] + row[4][5:7], []).append([row[0], row[1], 0, row[2]])
+        lookups.setdefault(row[5][:4] + row[5][5:7], []).append([row[0], row[1], 1, row[3]])
+    months = sorted(lookups)
+    sums = {}
+    # Each month is one select of the compound query, the months are split into chunks under the compound select limit of SQLite
+    for chunk in range(0, len(months), BATCH_MONTHS_PER_QUERY):
+        selects = []
+        chunk_params = []
+        for month in months[chunk:chunk + BATCH_MONTHS_PER_QUERY]:
+            table = 'financial_data_cumsum_%s' % (month)
+            selects.append(''' SELECT q.column1, q.column2, q.column3, c.row_count, c.cum_open_price, c.cum_close_price, c.cum_volume, CAST(ROUND(c.open_price * 10000) AS INTEGER), CAST(ROUND(c.close_price * 10000) AS INTEGER), c.volume
+                FROM (VALUES %s) q JOIN %s c ON c.symbol = q.column1 AND c.date = CASE q.column3
+                    WHEN 0 THEN (SELECT MIN(date) FROM %s WHERE symbol = q.column1 AND date >= q.column4)
+                    ELSE (SELECT MAX(date) FROM %s WHERE symbol = q.column1 AND date <= q.column4) END ''' % (', '.join(['(?, ?, ?, ?)'] * len(lookups[month])), table, table, table))
+            chunk_params.extend([value for lookup in lookups[month] for value in lookup])
+        execute_query(cursor, ' UNION ALL '.join(selects), chunk_params)
+        for row in fetch_rows(cursor):
+            if row[2] == 0:
+                # The cumulative sum before the first record
+                sums[(row[0], row[1], 0)] = [row[3] - 1, row[4] - row[7], row[5] - row[8], row[6] - row[9]]
+            else:
+                sums[(row[0], row[1], 1)] = list(row[3:7])
+    # The statistics of the period is the difference of the two cumulative sums, the prices are summed in unit of 0.0001
+    for key in sums:
+        if key[2] == 1 and (key[0], key[1], 0) in sums:
+            last_sum, first_sum = sums[key], sums[(key[0], key[1], 0)]
+            if last_sum[0] > first_sum[0]:
+                results[(key[0], key[1])] = [last_sum[0] - first_sum[0], (last_sum[1] - first_sum[1]) / 10000, (last_sum[2] - first_sum[2]) / 10000, last_sum[3] - first_sum[3]]
+    return results
+
+
+# This functoin is used to calculate the statistics of many symbols and periods in database by one query, or two queries if the database is partitioned
+# input : symbols - symbol list
+#         periods - period list, the format of each item is [start_date, end_date]
+# output : results - dict of (symbol, period index) : [count, sum of open_price, sum of close_price, sum of volume], the item without data is not included
+def select_batch_statistics(symbols, periods):
+    results = {}
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        start = start_stage()
+        for symbol in symbols:
+            for i in range(len(periods)):
+                result = snapshot_statistics(snapshot, symbol, periods[i][0], periods[i][1])
+                if result[0] > 0:
+                    results[(symbol, i)] = result
+        record_stage('snapshot', start)
+        return results
+    # Get a database connection from the connection pool
+    connection = get_db()
+    if connection:
+        # Create a database cursor
+        cursor = connection.cursor()
+        symbol_values = ', '.join(['(?)'] * len(symbols))
+        period_values = ', '.join(['(%d, ?, ?)' % (i) for i in range(len(periods))])
+        params = list(symbols) + [date for period in periods for date in period]
+        if get_partitions(connection) is not None:
+            try:
+                results = select_partition_batch_statistics(cursor, symbol_values, period_values, params)
+            except sql.OperationalError:
+                # The financial_bar table is not created by get_raw_data.py yet, each (symbol, period) only reads the partitions of the period
+                for symbol in symbols:
+                    for i in range(len(periods)):
+                        result = select_cumsum_statistics(cursor, partition_tables(connection, 'financial_data_cumsum', periods[i][0], periods[i][1]), symbol, periods[i][0], periods[i][1])
+                        if result[0] > 0:
+                            results[(symbol, i)] = result
+            # Close database cursor
+            cursor.close()
+            return results
+        try:
+            # Each (symbol, period) is the difference of two cumulative sums, the dates are found by the (symbol, date) primary key
+            sql_cmd = ''' WITH s(symbol) AS (VALUES %s), p(idx, start_date, end_date) AS (VALUES %s)
+                SELECT s.symbol, p.idx, last_sum.row_count - first_sum.row_count + 1,
+                    last_sum.cum_open_price - first_sum.cum_open_price + CAST(ROUND(first_sum.open_price * 10000) AS INTEGER),
+                    last_sum.cum_close_price - first_sum.cum_close_price + CAST(ROUND(first_sum.close_price * 10000) AS INTEGER),
+                    last_sum.cum_volume - first_sum.cum_volume + first_sum.volume
+                FROM s CROSS JOIN p
+                JOIN financial_data_cumsum last_sum ON last_sum.symbol = s.symbol AND last_sum.date = (SELECT MAX(date) FROM financial_data_cumsum WHERE symbol = s.symbol AND date <= p.end_date)
+                JOIN financial_data_cumsum first_sum ON first_sum.symbol = s.symbol AND first_sum.date = (SELECT MIN(date) FROM financial_data_cumsum WHERE symbol = s.symbol AND date >= p.start_date) ''' % (symbol_values, period_values)
+            execute_query(cursor, sql_cmd, params)
+            for row in fetch_rows(cursor):
+                if row[2] > 0:
+                    # The prices are summed in unit of 0.0001
+                    results[(row[0], row[1])] = [row[2], row[3] / 10000, row[4] / 10000, row[5]]
+        except sql.OperationalError:
+            # The cumulative sum table is not created by get_raw_data.py yet, aggregate the data of all periods by one grouped query
+            sql_cmd = ''' WITH s(symbol) AS (VALUES %s), p(idx, start_date, end_date) AS (VALUES %s)
+                SELECT f.symbol, p.idx, COUNT(*), SUM(f.open_price), SUM(f.close_price), SUM(f.volume)
+                FROM s CROSS JOIN p JOIN financial_data f ON f.symbol = s.symbol AND f.date >= p.start_date AND f.date <= p.end_date
+                GROUP BY f.symbol, p.idx ''' % (symbol_values, period_values)
+            execute_query(cursor, sql_cmd, params)
+            for row in fetch_rows(cursor):
+                results[(row[0], row[1])] = list(row[2:])
         # Close database cursor
         cursor.close()
-    # Close database connection
-    connection.close()
     return results
 
 
+# This functoin is used to build the statistics data of one symbol and period
+# input : symbol     - symbol value
+#         start_date - first date of the period
+#         end_date   - last date of the period
+#         result     - [count, sum of open_price, sum of close_price, sum of volume] of the period
+#         batch      - True if the error message should include the symbol for the batch statistics
+# output : data_dict - statistics data with the average daily open price, close price and volume
+def build_statistics(symbol, start_date, end_date, result, batch=False):
+    # Use error message list of current request
+    error_list = get_error_list()
+    num_of_days, average_daily_open_price, average_daily_close_price, average_daily_volume = result
+    # Check if the query result has data output
+    if num_of_days < 1:
+        # Force to 0 if no data is return from query database
+        average_daily_open_price = ('%.2f' % 0)
+        average_daily_close_price = ('%.2f' % 0)
+        average_daily_volume = 0
+        if batch:
+            error_list.append('Data not found for symbol [%s] between [%s] ~ [%s]' % (symbol, start_date, end_date))
+        else:
+            error_list.append('Data not found between [%s] ~ [%s]' % (start_date, end_date))
+    else:
+        # Calculate the average value
+        average_daily_open_price = ('%.2f' % (average_daily_open_price / num_of_days))
+        average_daily_close_price = ('%.2f' % (average_daily_close_price / num_of_days))
+        average_daily_volume = int((average_daily_volume / num_of_days))
+    # Build the data dictionary
+    data_dict = {'start_date': start_date, 'end_date': end_date, 'symbol': symbol, 'average_daily_open_price': average_daily_open_price, 'average_daily_close_price': average_daily_close_price, 'average_daily_volume': average_daily_volume}
+    return data_dict
+
+
 # This functoin is used to build the condition string for query
 # input : old_condition    - current condition string
 #         append_condition - new condition string to be appended 
@@ -142,13 +1443,137 @@ def build_sqlite_condition(old_condition, append_condition):
         return old_condition + 'and ' + append_condition
     else:  
         return append_condition
-        
+
+
+# This functoin is used to format the query result of financial_data as JSON text, no dict is built for each row
+# The numbers are formatted as '%s' does, they are read from the REAL and INTEGER columns so only the symbol and date are escaped
+# input : rows     - query result ordered by symbol, each row is (symbol, date, open_price, close_price, volume)
+#         template - key of ROW_TEMPLATES
+# output : texts - JSON text of each row
+def encode_rows(rows, template):
+    template = ROW_TEMPLATES[template]
+    texts = []
+    # The rows of one symbol are continuous, the escaped symbol is reused by them
+    symbol = symbol_text = None
+    for row in rows:
+        if symbol_text is None or row[0] != symbol:
+            symbol = row[0]
+            symbol_text = encode_basestring_ascii('%s' % symbol)
+        texts.append(template.format(symbol_text, encode_basestring_ascii('%s' % row[1]), row[2], row[3], row[4]))
+    return texts
+
+
+# This functoin is used to check if the rows can be formatted by encode_rows(), it gives the same text as jsonify only when the JSON provider of app writes compact JSON with sorted keys
+# output : True if the fast JSON serializer is configured and the JSON provider is compact and sorts the keys, otherwise jsonify is used
+def use_fast_json():
+    if current_app.config['JSON_SERIALIZER'] == 'flask':
+        return False
+    # The compact is None by default, then jsonify writes indented JSON in debug mode, a custom provider without the attributes uses jsonify
+    compact = getattr(current_app.json, 'compact', False)
+    return bool(compact or (compact is None and not current_app.debug)) and bool(getattr(current_app.json, 'sort_keys', False))
+
+
+# This functoin is used to transpose the query result of financial_data to columns, no dict is built for each row
+# input : rows - query result ordered by symbol, each row is (symbol, date, open_price, close_price, volume)
+# output : dictionary - unique symbols of the rows
+#          columns    - numpy arrays of symbol (index of dictionary), date, open_price, close_price and volume
+def build_columns(rows):
+    # The symbols are not truncated, the symbol list of the database is open-ended
+    records = np.array(rows, dtype=np.dtype([('symbol', np.str_, max([len(row[0]) for row in rows], default=1))] + COLUMNAR_FIELDS))
+    symbol = records['symbol']
+    # The rows are ordered by symbol, a new dictionary item starts where the symbol is changed
+    changed = np.ones(len(symbol), dtype=bool)
+    changed[1:] = symbol[1:] != symbol[:-1]
+    dictionary = symbol[changed]
+    columns = {'symbol': (np.cumsum(changed) - 1).astype(np.int32), 'date': records['date'], 'open_price': records['open_price'], 'close_price': records['close_price'], 'volume': records['volume']}
+    return dictionary, columns
+
+
+# This functoin is used to take the data written to a buffer and clear the buffer
+# input : buffer - io.BytesIO buffer
+# output : data - bytes written to the buffer
+def drain_buffer(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+# This functoin is used to encode the query result of financial_data in a columnar format
+# input : batches         - iterable of query result batches
+#         columnar_format - key of COLUMNAR_FORMATS
+#         info            - dictionary stored as JSON in the metadata, such as pagination and error info
+# output : chunks of the encoded data, the arrow format is written batch by batch, the npz format is written at the end
+def encode_columns(batches, columnar_format, info):
+    metadata = json.dumps(info)
+    buffer = io.BytesIO()
+    if columnar_format == 'arrow':
+        import pyarrow as pa
+        # The symbol is a dictionary array, each record batch has its own dictionary
+        schema = pa.schema([('symbol', pa.dictionary(pa.int32(), pa.string())), ('date', pa.date32()), ('open_price', pa.float64()), ('close_price', pa.float64()), ('volume', pa.int64())], metadata={'info': metadata})
+        with pa.ipc.new_stream(buffer, schema) as writer:
+            for rows in batches:
+                dictionary, columns = build_columns(rows)
+                arrays = [pa.DictionaryArray.from_arrays(columns['symbol'], pa.array(dictionary, type=pa.string()))] + [pa.array(columns[name]) for name in ['date', 'open_price', 'close_price', 'volume']]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                yield drain_buffer(buffer)
+        yield drain_buffer(buffer)
+    else:
+        # Merge the dictionary of each batch, the symbol index is mapped to the merged dictionary
+        symbol_list = {}
+        dictionary, columns = build_columns([])
+        parts = dict([(name, [columns[name]]) for name in columns])
+        for rows in batches:
+            dictionary, columns = build_columns(rows)
+            mapping = np.array([symbol_list.setdefault(item, len(symbol_list)) for item in dictionary], dtype=np.int32)
+            columns['symbol'] = mapping[columns['symbol']]
+            for name in columns:
+                parts[name].append(columns[name])
+        arrays = dict([(name, np.concatenate(parts[name])) for name in parts])
+        np.savez(buffer, symbol_dictionary=np.array(list(symbol_list), dtype=np.str_), info=np.array(metadata), **arrays)
+        yield drain_buffer(buffer)
+
+
+# This functoin is used to sort the dates of the financial_data filters in the same way as build_financial_data_condition()
+# input : start_date - first date condition, None if not given
+#         end_date   - last date condition, None if not given
+# output : start_date, end_date - swapped if both are given and start_date is later than end_date
+def sorted_dates(start_date, end_date):
+    if start_date and end_date and start_date > end_date:
+        return end_date, start_date
+    return start_date, end_date
+
+
+# This functoin is used to build the condition string of the financial_data filters
+# input : start_date - first date condition, None if not given
+#         end_date   - last date condition, None if not given
+#         symbol     - symbol condition, None if not given
+# output : sql_condition - condition string for query, None if no filter is given
+def build_financial_data_condition(start_date, end_date, symbol):
+    sql_condition = None
+    if start_date and end_date:
+        # Both start_date and end_date is given, check if the input value is opposite
+        if start_date > end_date:
+            sql_condition = build_sqlite_condition(sql_condition, 'date >= "%s" and date <= "%s" ' % (end_date, start_date))
+        else:
+            sql_condition = build_sqlite_condition(sql_condition, 'date >= "%s" and date <= "%s" ' % (start_date, end_date))
+    else:
+        # Check if one of the start_date or end_date is given
+        if start_date:
+            sql_condition = build_sqlite_condition(sql_condition, 'date >= "%s" ' % (start_date))
+        if end_date:
+            sql_condition = build_sqlite_condition(sql_condition, 'date <= "%s" ' % (end_date))
+    # Check if symbol is given, add into query condition
+    if symbol:
+        sql_condition = build_sqlite_condition(sql_condition, 'symbol = "%s" ' % (symbol))
+    return sql_condition
+
 
 # This functoin is used to run as home page
 # output : usage of this program
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def home():
-    usage_string = '                              This API support two functions for using :\n'
+    usage_string = '                              This API support five functions for using :\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '                    1. /api/financial_data : an Get financial_data API to retrieve records from financial_data table\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                API Parameters :\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Optional : start_date\n'
@@ -163,6 +1588,8 @@ def home():
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The current data page to display. The value should large than 1.\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                Example :\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            http://localhost:5000/api/financial_data?start_date=2023-01-01&end_date=2023-01-14&symbol=IBM&limit=3&page=2\n'    
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                Columnar format :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Request with header "Accept: application/x-npz" or "Accept: application/vnd.apache.arrow.stream" to get the data as columns instead of JSON.\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '                    2. /api/statistics : an Get statistics API to perform the calculations on the data in given period of time\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                API Parameters :\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Required : start_date\n'
@@ -171,8 +1598,39 @@ def home():
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The last date condition for query database. Format should be YYYY-MM-DD. For example: 2023-04-20.\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Required : symbol\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The symbol condition for query database. The following values are supported: "IBM", "Apple Inc.".\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Optional : metrics\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The extra metrics to calculate, separated by comma. The following values are supported: "vwap", "average_daily_return", "volatility".\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Optional : window\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The number of days of the rolling window, the moving averages and volatility of each date are calculated. The value should large than 2.\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                Example :\n'
     usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            http://localhost:5000/api/statistics?start_date=2023-01-01&end_date=2023-01-31&symbol=IBM\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            http://localhost:5000/api/statistics?start_date=2023-01-01&end_date=2023-03-31&symbol=IBM&metrics=vwap,volatility&window=20\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '                    3. /api/statistics/batch : an Get statistics API to perform the calculations of many symbols and periods in one request\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                API Parameters :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Required : symbol\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The symbol condition for query database, it can be given many times.\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Required : period\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The first date and last date condition for query database, it can be given many times. Format should be YYYY-MM-DD,YYYY-MM-DD. For example: 2023-04-01,2023-04-30.\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                Example :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            http://localhost:5000/api/statistics/batch?symbol=IBM&symbol=Apple%20Inc.&period=2023-01-01,2023-01-31&period=2023-02-01,2023-02-28\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '                    4. /api/financial_data/export : an Get financial_data API to export all the matching records as a streaming response\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                API Parameters :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Optional : start_date, end_date, symbol\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The same conditions as /api/financial_data.\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Optional : format\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The output format. The following values are supported: "ndjson", "csv", "npz", "arrow". Default is "ndjson" or the columnar format in Accept header.\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                Example :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            http://localhost:5000/api/financial_data/export?start_date=2023-01-01&end_date=2023-12-31&format=csv\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '                    5. /api/financial_data/bars : an Get bars API to aggregate the records of a symbol into weekly, monthly or N-day bars\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                API Parameters :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Required : symbol\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The symbol condition for query database. The following values are supported: "IBM", "Apple Inc.".\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Required : interval\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The interval of each bar. The following values are supported: "week", "month" or the number of days such as "5d".\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            Optional : start_date, end_date\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '&emsp;' + '                The same conditions as /api/financial_data, the whole bars overlapping the period are returned.\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '                Example :\n'
+    usage_string = usage_string + '<br />' + '&emsp;' + '&emsp;' + '&emsp;' + '            http://localhost:5000/api/financial_data/bars?symbol=IBM&interval=week&start_date=2023-01-01&end_date=2023-12-31\n'
     return usage_string
 
 
@@ -185,18 +1643,22 @@ def home():
 #                  limit: limit of records can be retrieved for single page
 #                  pages: total number of pages
 #              info: includes any error info if applies
-@app.route('/api/financial_data', methods=['GET'])
+@api.route('/api/financial_data', methods=['GET'])
 def financial_data():
-    # Use global error message list
-    global error_list
+    # Use error message list of current request
+    error_list = get_error_list()
     # Assign the initial value to variables
-    error_list = []
     data_List = []
     pagination_dict = {}
     info_dict = {}
     output_dict = {}
     sql_results = []
-    sql_condition = None
+    start = start_stage()
+    # Answer the conditional request before the parameters are checked, the symbol list is not read from database
+    response = check_not_modified(request.args.getlist('symbol'), covered_start_date(request.args.get('start_date'), request.args.get('end_date')))
+    if response is not None:
+        record_stage('validate', start)
+        return response
     # Check the date format of input parameter start_date, give default value None if format is wrong
     if 'start_date' in request.args:
         start_date = check_date(request.args['start_date'], 'start_date')
@@ -222,26 +1684,12 @@ def financial_data():
         page = check_integer(request.args['page'], 'page', 1)
     else:
         page = 1
+    record_stage('validate', start)
     # Build the database query condition
-    if start_date and end_date:
-        # Both start_date and end_date is given, check if the input value is opposite
-        if start_date > end_date:
-            sql_condition = build_sqlite_condition(sql_condition, 'date >= "%s" and date <= "%s" ' % (end_date, start_date))
-        else:
-            sql_condition = build_sqlite_condition(sql_condition, 'date >= "%s" and date <= "%s" ' % (start_date, end_date))
-    else:
-        # Check if one of the start_date or end_date is given
-        if start_date:
-            sql_condition = build_sqlite_condition(sql_condition, 'date >= "%s" ' % (start_date))
-        if end_date:
-            sql_condition = build_sqlite_condition(sql_condition, 'date <= "%s" ' % (end_date))
-    # Check if symbol is given, add into query condition
-    if symbol:
-        sql_condition = build_sqlite_condition(sql_condition, 'symbol = "%s" ' % (symbol))
-    # Query database
-    sql_results = select_table(sql_condition)
-    # Get the result count of data
-    count = len(sql_results)
+    sql_condition = build_financial_data_condition(start_date, end_date, symbol)
+    # Count the data in database, only the count is needed to build the pagination
+    version = get_data_version()
+    count = cache_query(('count', version, sql_condition), count_table, sql_condition, (start_date, end_date, symbol))
     # Error handle when count is 0
     if count < 1:
         pages = 1
@@ -256,43 +1704,136 @@ def financial_data():
         if page > pages:
             page = pages
             error_list.append('Given parameter [page] is over than current data size, force page as the maximum number of pages')
+    # The response format is selected by the Accept header, JSON by default
+    columnar_format = get_columnar_format()
+    mimetype = COLUMNAR_FORMATS[columnar_format] if columnar_format else 'application/json'
+    # The response is decided by the normalized parameters and the error messages, use the cached response if it exists
+    cache_key = ('financial_data', version, sql_condition, limit, page, tuple(error_list), columnar_format)
+    body = cache_get(cache_key)
+    if body is not None:
+        response = cached_response(body, mimetype)
+        response.vary.add('Accept')
+        return response
+    if count >= 1:
         # Get the index of data to display in current page 
         current_index = (page - 1) * limit
-        max_index = current_index + limit
-        # Check if the page is the max page and the data is not enough to display in one page
-        if max_index > count:
-            max_index = count
-        # Build the data list 
-        for i in range(current_index, max_index, 1):
-            data_dict = {'symbol': '%s' % sql_results[i][0], 'date': '%s' % sql_results[i][1], 'open_price': '%s' % sql_results[i][2], 'close_price': '%s' % sql_results[i][3], 'volume': '%s' % sql_results[i][4]}
-            data_List.append(data_dict)
+        # Query database, only the data in current page is read
+        sql_results = select_table(sql_condition, limit, current_index, (start_date, end_date, symbol))
+        # Build the data list, the columnar format and the fast JSON serializer use the query result directly
+        if not columnar_format and not use_fast_json():
+            start = start_stage()
+            for row in sql_results:
+                data_dict = {'symbol': '%s' % row[0], 'date': '%s' % row[1], 'open_price': '%s' % row[2], 'close_price': '%s' % row[3], 'volume': '%s' % row[4]}
+                data_List.append(data_dict)
+            record_stage('build', start)
     # Build the pagination dictionary            
     pagination_dict = {'count': count, 'page': page, 'limit': limit, 'pages': pages}
     # Build the info dictionary
     info_dict = {'error': error_list}
-    # Build the output dictionary
-    output_dict = {'data': data_List, 'pagination': pagination_dict, 'info': info_dict}
-    return jsonify(output_dict)
+    start = start_stage()
+    if columnar_format:
+        # The pagination and info are stored in the metadata of columnar data
+        response = current_app.response_class(b''.join(encode_columns([sql_results], columnar_format, {'pagination': pagination_dict, 'info': info_dict})), mimetype=mimetype)
+    elif not use_fast_json():
+        # Build the output dictionary
+        output_dict = {'data': data_List, 'pagination': pagination_dict, 'info': info_dict}
+        response = jsonify(output_dict)
+    else:
+        # The rows are joined into the same text as jsonify builds, the small dictionaries are still serialized by the JSON provider of app
+        body = '{"data":[%s],"info":%s,"pagination":%s}\n' % (','.join(encode_rows(sql_results, 'json')), current_app.json.dumps(info_dict, separators=(',', ':')), current_app.json.dumps(pagination_dict, separators=(',', ':')))
+        response = current_app.response_class(body, mimetype=mimetype)
+    record_stage('serialize', start)
+    response.vary.add('Accept')
+    cache_put(cache_key, response.get_data())
+    return response
+
+
+# This functoin is used to run for api /api/financial_data/export
+# output : all the records matching the condition as a streaming response, the format is given by parameter format:
+#              ndjson: one JSON object of a record in each line (default)
+#              csv: header line and one record in each line
+#              npz, arrow: columnar format, it is also selected by the Accept header if format is not given
+#          result with two properties if the parameters are wrong:
+#              data: empty array
+#              info: includes any error info
+@api.route('/api/financial_data/export', methods=['GET'])
+def export_financial_data():
+    # Use error message list of current request
+    error_list = get_error_list()
+    start = start_stage()
+    # Answer the conditional request before the parameters are checked, the symbol list is not read from database
+    response = check_not_modified(request.args.getlist('symbol'), covered_start_date(request.args.get('start_date'), request.args.get('end_date')))
+    if response is not None:
+        record_stage('validate', start)
+        return response
+    # Check the date format of input parameter start_date, give default value None if format is wrong
+    if 'start_date' in request.args:
+        start_date = check_date(request.args['start_date'], 'start_date')
+    else:
+        start_date = None
+    # Check the date format of input parameter end_date, give default value None if format is wrong
+    if 'end_date' in request.args:
+        end_date = check_date(request.args['end_date'], 'end_date')
+    else:
+        end_date = None
+    # Check the string format of input parameter symbol, give default value None if format is wrong
+    if 'symbol' in request.args:
+        symbol = check_symbol(request.args['symbol'])
+    else:
+        symbol = None
+    # Check the output format, the columnar format can also be selected by the Accept header
+    export_format = request.args.get('format', get_columnar_format() or 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        error_list.append('Parameter [format] input the wrong format or value [%s], avaiable format is %s' % (export_format, ' or '.join(['\'%s\'' % (item) for item in EXPORT_FORMATS])))
+    record_stage('validate', start)
+    # Do not export the whole table if one of the filter is wrong
+    if error_list:
+        return jsonify({'data': [], 'info': {'error': error_list}})
+    sql_condition = build_financial_data_condition(start_date, end_date, symbol)
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+
+    # Format each batch of rows as one chunk of the response
+    def generate():
+        if export_format in COLUMNAR_FORMATS:
+            yield from encode_columns(iterate_table(sql_condition, batch_size, (start_date, end_date, symbol)), export_format, {'info': {'error': error_list}})
+            return
+        if export_format == 'csv':
+            yield 'symbol,date,open_price,close_price,volume\r\n'
+        for rows in iterate_table(sql_condition, batch_size, (start_date, end_date, symbol)):
+            if export_format == 'csv':
+                chunk = io.StringIO()
+                csv.writer(chunk).writerows(rows)
+                yield chunk.getvalue()
+            elif current_app.config['JSON_SERIALIZER'] == 'flask':
+                yield ''.join([json.dumps({'symbol': '%s' % row[0], 'date': '%s' % row[1], 'open_price': '%s' % row[2], 'close_price': '%s' % row[3], 'volume': '%s' % row[4]}) + '\n' for row in rows])
+            else:
+                yield ''.join(encode_rows(rows, 'ndjson'))
+
+    # Keep the request context and the database connection until the last chunk is sent, the response is sent by chunked transfer encoding
+    response = flask.Response(flask.stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = 'attachment; filename=financial_data.%s' % (export_format)
+    response.vary.add('Accept')
+    return response
 
 
 # This functoin is used to run for api /api/statistics
 # output : result with two properties:
 #              data: calculated statistic results
 #              info: includes any error info if applies
-@app.route('/api/statistics', methods=['GET'])
+@api.route('/api/statistics', methods=['GET'])
 def statistics():
-    # Use global error message list
-    global error_list
+    # Use error message list of current request
+    error_list = get_error_list()
     # Assign the initial value to variables
-    error_list = []
     info_dict = {}
     data_dict = {}
     output_dict = {}
-    sql_results = []
-    average_daily_open_price = 0
-    average_daily_close_price = 0
-    average_daily_volume = 0
-    num_of_days = 0
+    start = start_stage()
+    # Answer the conditional request before the parameters are checked, the symbol list is not read from database
+    response = check_not_modified(request.args.getlist('symbol'), covered_start_date(request.args.get('start_date'), request.args.get('end_date')))
+    if response is not None:
+        record_stage('validate', start)
+        return response
     # Check the date format of input parameter start_date, give default value None if format is wrong   
     if 'start_date' in request.args:
         start_date = check_date(request.args['start_date'], 'start_date')
@@ -311,6 +1852,7 @@ def statistics():
     else:
         symbol = None
         error_list.append('Parameter [symbol] must be provided')
+    record_stage('validate', start)
     # Check if all the three parameters are given as correct value
     if start_date == None or end_date == None or symbol == None:
         error_list.append('All the parameters [start_date, end_date, symbol] must be provided with correct format before running this API')
@@ -327,34 +1869,410 @@ def statistics():
     else:
         big_date = end_date
         small_date = start_date
-    # Query database
-    sql_results = select_table('date >= "%s" AND date <= "%s" AND symbol = "%s"' % (small_date, big_date, symbol))
-    # Add the value from each column of data
-    for row in sql_results:
-        average_daily_open_price += row[2]
-        average_daily_close_price += row[3]
-        average_daily_volume += int(row[4])
-        num_of_days += 1
-    # Check if the query result has data output
-    if num_of_days < 1:
-        # Force to 0 if no data is return from query database
-        average_daily_open_price = ('%.2f' % 0)
-        average_daily_close_price = ('%.2f' % 0)
-        average_daily_volume = 0
-        error_list.append('Data not found between [%s] ~ [%s]' % (small_date, big_date))
+    # Check the optional parameter metrics, the value is a comma separated list of STATISTICS_METRICS
+    start = start_stage()
+    metrics = []
+    if 'metrics' in request.args:
+        for metric in request.args['metrics'].split(','):
+            metric = metric.strip()
+            if metric not in STATISTICS_METRICS:
+                error_list.append('Parameter [metrics] input the wrong format or value [%s], avaiable metric is %s' % (metric, ' or '.join(['\'%s\'' % (item) for item in STATISTICS_METRICS])))
+            elif metric not in metrics:
+                metrics.append(metric)
+    # Check the optional parameter window, the rolling series is not calculated if the value is wrong
+    window = None
+    if 'window' in request.args:
+        window = check_integer(request.args['window'], 'window', None)
+        if window == 1:
+            window = None
+            error_list.append('Parameter [window] should be at least 2')
+    record_stage('validate', start)
+    # The response is decided by the normalized parameters and the error messages, use the cached response if it exists
+    cache_key = ('statistics', get_data_version(), symbol, small_date, big_date, tuple(metrics), window, tuple(error_list))
+    body = cache_get(cache_key)
+    if body is not None:
+        return cached_response(body)
+    if metrics or window:
+        # Scan the daily price series once and calculate all the statistics from it
+        dates, values = select_price_series(symbol, small_date, big_date)
+        start = start_stage()
+        data_dict = build_statistics(symbol, small_date, big_date, sum_price_series(values))
+        if len(dates) > 0:
+            data_dict = build_extended_statistics(data_dict, dates, values, metrics, window)
+        record_stage('build', start)
     else:
-        # Calculate the average value
-        average_daily_open_price = ('%.2f' % (average_daily_open_price / num_of_days))
-        average_daily_close_price = ('%.2f' % (average_daily_close_price / num_of_days))
-        average_daily_volume = int((average_daily_volume / num_of_days))
-    # Build the data dictionary
-    data_dict = {'start_date': small_date, 'end_date': big_date, 'symbol': symbol, 'average_daily_open_price': average_daily_open_price, 'average_daily_close_price': average_daily_close_price, 'average_daily_volume': average_daily_volume}
+        # Calculate the sum of each column in database and build the data dictionary
+        result = select_statistics(symbol, small_date, big_date)
+        start = start_stage()
+        data_dict = build_statistics(symbol, small_date, big_date, result)
+        record_stage('build', start)
     # Build the info dictionary    
     info_dict = {'error': error_list}
     # Build the output dictionary
     output_dict = {'data': data_dict, 'info': info_dict}
-    return jsonify(output_dict)
+    start = start_stage()
+    response = jsonify(output_dict)
+    record_stage('serialize', start)
+    cache_put(cache_key, response.get_data())
+    return response
+
+
+# This functoin is used to run for api /api/statistics/batch
+# output : result with two properties:
+#              data: an array includes calculated statistic results of each symbol and period
+#              info: includes any error info if applies
+@api.route('/api/statistics/batch', methods=['GET'])
+def batch_statistics():
+    # Use error message list of current request
+    error_list = get_error_list()
+    # Assign the initial value to variables
+    data_List = []
+    symbols = []
+    periods = []
+    start = start_stage()
+    # Answer the conditional request before the parameters are checked, only the valid periods are covered by the request
+    dates = [value.split(',') for value in request.args.getlist('period')]
+    dates = [covered_start_date(item[0].strip(), item[1].strip()) for item in dates if len(item) == 2 and validate_date(item[0].strip()) and validate_date(item[1].strip())]
+    response = check_not_modified(request.args.getlist('symbol'), min(dates) if dates else None)
+    if response is not None:
+        record_stage('validate', start)
+        return response
+    # Check each input parameter symbol, the wrong symbol is ignored
+    for value in request.args.getlist('symbol'):
+        symbol = check_symbol(value)
+        if symbol and symbol not in symbols:
+            symbols.append(symbol)
+    # Check each input parameter period, the format is start_date,end_date, the wrong period is ignored
+    for value in request.args.getlist('period'):
+        dates = value.split(',')
+        if len(dates) != 2:
+            error_list.append('Parameter [period] input the wrong format or value [%s], the format should be YYYY-MM-DD,YYYY-MM-DD' % (value))
+            continue
+        start_date = check_date(dates[0].strip(), 'period')
+        end_date = check_date(dates[1].strip(), 'period')
+        if start_date and end_date:
+            # Check if the input value is opposite
+            period = [min(start_date, end_date), max(start_date, end_date)]
+            if period not in periods:
+                periods.append(period)
+    record_stage('validate', start)
+    # Check if both symbol and period are given as correct value
+    if len(symbols) < 1 or len(periods) < 1:
+        error_list.append('Both the parameters [symbol, period] must be provided with correct format before running this API')
+        return jsonify({'data': data_List, 'info': {'error': error_list}})
+    # Limit the number of calculations in one request
+    if len(symbols) * len(periods) > current_app.config['BATCH_MAX_ITEMS']:
+        error_list.append('The number of [symbol] x [period] should not be more than %d' % (current_app.config['BATCH_MAX_ITEMS']))
+        return jsonify({'data': data_List, 'info': {'error': error_list}})
+    # The response is decided by the normalized parameters and the error messages, use the cached response if it exists
+    cache_key = ('statistics_batch', get_data_version(), tuple(symbols), tuple([tuple(period) for period in periods]), tuple(error_list))
+    body = cache_get(cache_key)
+    if body is not None:
+        return cached_response(body)
+    # Calculate all the symbols and periods by one query
+    results = select_batch_statistics(symbols, periods)
+    # Build the data list in the order of input parameters
+    start = start_stage()
+    for symbol in symbols:
+        for i in range(len(periods)):
+            data_List.append(build_statistics(symbol, periods[i][0], periods[i][1], results.get((symbol, i), [0, None, None, None]), True))
+    record_stage('build', start)
+    # Build the output dictionary
+    output_dict = {'data': data_List, 'info': {'error': error_list}}
+    start = start_stage()
+    response = jsonify(output_dict)
+    record_stage('serialize', start)
+    cache_put(cache_key, response.get_data())
+    return response
+
+
+# This functoin is used to run for api /api/financial_data/bars
+# output : result with two properties:
+#              data: an array includes the bars of the symbol in ascending order of date
+#                  date: first date of the bucket, the bucket is a week from Monday, a month or N days counted from 1970-01-01
+#                  first_date, last_date: first and last date with data in the bucket
+#                  open_price, close_price: open price of the first date and close price of the last date
+#                  volume: summed volume of the bucket
+#                  bar_count: number of days with data in the bucket
+#              info: includes any error info if applies
+@api.route('/api/financial_data/bars', methods=['GET'])
+def bars():
+    # Use error message list of current request
+    error_list = get_error_list()
+    # Assign the initial value to variables
+    data_List = []
+    start = start_stage()
+    # Answer the conditional request before the parameters are checked, the symbol list is not read from database
+    response = check_not_modified(request.args.getlist('symbol'), covered_start_date(request.args.get('start_date'), request.args.get('end_date')))
+    if response is not None:
+        record_stage('validate', start)
+        return response
+    # Check the date format of input parameter start_date, give default value None if format is wrong
+    if 'start_date' in request.args:
+        start_date = check_date(request.args['start_date'], 'start_date')
+    else:
+        start_date = None
+    # Check the date format of input parameter end_date, give default value None if format is wrong
+    if 'end_date' in request.args:
+        end_date = check_date(request.args['end_date'], 'end_date')
+    else:
+        end_date = None
+    # Check the string format of input parameter symbol, give default value None if format is wrong
+    if 'symbol' in request.args:
+        symbol = check_symbol(request.args['symbol'])
+    else:
+        symbol = None
+        error_list.append('Parameter [symbol] must be provided')
+    # Check the interval of bars, give default value None if format is wrong
+    if 'interval' in request.args:
+        interval = check_interval(request.args['interval'])
+    else:
+        interval = None
+        error_list.append('Parameter [interval] must be provided')
+    record_stage('validate', start)
+    # Check if the required parameters are given as correct value
+    if symbol == None or interval == None:
+        error_list.append('The parameters [symbol, interval] must be provided with correct format before running this API')
+        return jsonify({'data': data_List, 'info': {'error': error_list}})
+    # Check if the input value is opposite
+    start_date, end_date = sorted_dates(start_date, end_date)
+    # The response is decided by the normalized parameters and the error messages, use the cached response if it exists
+    cache_key = ('bars', get_data_version(), symbol, interval, start_date, end_date, tuple(error_list))
+    body = cache_get(cache_key)
+    if body is not None:
+        return cached_response(body)
+    rows = select_bars(symbol, interval, start_date, end_date)
+    start = start_stage()
+    if len(rows) < 1:
+        error_list.append('Data not found between [%s] ~ [%s]' % (start_date or '', end_date or ''))
+    for row in rows:
+        data_List.append({'symbol': symbol, 'date': row[0], 'first_date': row[1], 'last_date': row[2], 'open_price': '%s' % row[3], 'close_price': '%s' % row[4], 'volume': '%s' % row[5], 'bar_count': row[6]})
+    record_stage('build', start)
+    # Build the output dictionary
+    output_dict = {'data': data_List, 'info': {'error': error_list}}
+    start = start_stage()
+    response = jsonify(output_dict)
+    record_stage('serialize', start)
+    cache_put(cache_key, response.get_data())
+    return response
+
+
+# This functoin is used to run for api /api/cache_stats
+# output : result with the hit, miss and eviction counters of the cache in current worker process
+@api.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    version = get_data_version()
+    with response_cache['lock']:
+        data_dict = {'hits': response_cache['hits'], 'misses': response_cache['misses'], 'evictions': response_cache['evictions'], 'size': len(response_cache['data']), 'max_size': current_app.config['CACHE_SIZE'], 'data_version': '%s' % (version,)}
+    return jsonify({'data': data_dict})
+
+
+# This functoin is used to format a histogram in the Prometheus text format
+# input : lines   - output line list, the formatted lines are appended to it
+#         name    - metric name
+#         labels  - label string of the histogram, such as route="/api/statistics"
+#         item    - [bucket counts, sum, count] of the histogram
+#         buckets - upper bounds of the buckets
+def format_histogram(lines, name, labels, item, buckets):
+    cumulative = 0
+    for i in range(len(buckets) + 1):
+        cumulative += item[0][i]
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, ('%g' % buckets[i]) if i < len(buckets) else '+Inf', cumulative))
+    lines.append('%s_sum{%s} %s' % (name, labels, repr(float(item[1]))))
+    lines.append('%s_count{%s} %d' % (name, labels, item[2]))
+
+
+# This functoin is used to get the request metrics, cache counters and gauges of current worker process
+# output : worker_metrics - metrics in the layout of the metrics file, the histogram and counter keys are lists so that it can be saved as JSON
+def get_worker_metrics():
+    # The histograms are copied under the lock, they are changed by the other requests
+    with request_metrics['lock']:
+        stages, rows = request_metrics['stages'], request_metrics['rows']
+        worker_metrics = {'stages': [[route, stage, [stages[(route, stage)][0][:]] + stages[(route, stage)][1:]] for route, stage in stages],
+                          'rows': [[route, [rows[route][0][:]] + rows[route][1:]] for route in rows],
+                          'requests': [[route, status, request_metrics['requests'][(route, status)]] for route, status in request_metrics['requests']]}
+    with response_cache['lock']:
+        worker_metrics['cache'] = {'hits': response_cache['hits'], 'misses': response_cache['misses'], 'evictions': response_cache['evictions'], 'size': len(response_cache['data'])}
+    worker_metrics['db_pool_idle'] = db_pool.qsize()
+    return worker_metrics
+
+
+# This functoin is used to write the metrics of current worker process to its own file metrics_<pid>.json, the file is replaced at once so that a reader never sees a partial file
+# input : metrics_dir - directory of the metrics files shared by the worker processes
+def write_worker_metrics(metrics_dir):
+    file_name = os.path.join(metrics_dir, 'metrics_%d.json' % (os.getpid()))
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        # The writer thread and /metrics may write the file at the same time, each thread has its own temporary file
+        temp_file = '%s.%d.tmp' % (file_name, threading.get_ident())
+        with open(temp_file, 'w') as f:
+            json.dump(get_worker_metrics(), f)
+        os.replace(temp_file, file_name)
+    except OSError as e:
+        print('Error : Fail to write the metrics file [%s]\n%s' % (file_name, e))
+
+
+# This functoin is used to run as the writer thread, it writes the metrics of current worker process to its file when they are changed
+# input : metrics_dir - directory of the metrics files shared by the worker processes
+#         interval    - seconds between two checks
+def write_metrics_periodically(metrics_dir, interval):
+    while True:
+        time.sleep(interval)
+        with request_metrics['lock']:
+            changed = request_metrics['changed']
+            request_metrics['changed'] = False
+        if changed:
+            write_worker_metrics(metrics_dir)
+
+
+# This functoin is used to check if a worker process is alive, the gauges of an exited worker are not counted
+# input : pid - process id of the worker
+# output : True if the process is alive
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+# This functoin is used to merge the metrics files of all the worker processes, the counters and histograms are summed
+# The files of the exited workers are kept so that the counters never go down when gunicorn restarts a worker
+# input : metrics_dir - directory of the metrics files shared by the worker processes
+# output : merged - metrics of all the worker processes in the layout of get_worker_metrics()
+def merge_worker_metrics(metrics_dir):
+    stages, rows, requests = {}, {}, {}
+    merged = {'cache': {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}, 'db_pool_idle': 0}
+    for file_name in sorted(os.listdir(metrics_dir)):
+        if not (file_name.startswith('metrics_') and file_name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, file_name)) as f:
+                worker_metrics = json.load(f)
+            pid = int(file_name[len('metrics_'):-len('.json')])
+        except (OSError, ValueError) as e:
+            print('Error : Fail to read the metrics file [%s]\n%s' % (file_name, e))
+            continue
+        for histograms, items in [(stages, [((route, stage), item) for route, stage, item in worker_metrics['stages']]), (rows, [(route, item) for route, item in worker_metrics['rows']])]:
+            for key, item in items:
+                total = histograms.setdefault(key, [[0] * len(item[0]), 0, 0])
+                total[0] = [x + y for x, y in zip(total[0], item[0])]
+                total[1] += item[1]
+                total[2] += item[2]
+        for route, status, count in worker_metrics['requests']:
+            requests[(route, status)] = requests.get((route, status), 0) + count
+        for name in ['hits', 'misses', 'evictions']:
+            merged['cache'][name] += worker_metrics['cache'][name]
+        if is_process_alive(pid):
+            merged['cache']['size'] += worker_metrics['cache']['size']
+            merged['db_pool_idle'] += worker_metrics['db_pool_idle']
+    merged['stages'] = [[route, stage, stages[(route, stage)]] for route, stage in stages]
+    merged['rows'] = [[route, rows[route]] for route in rows]
+    merged['requests'] = [[route, status, requests[(route, status)]] for route, status in requests]
+    return merged
+
+
+# This functoin is used to run for api /metrics
+# output : request metrics and cache counters in the Prometheus text format, they are summed over all the worker processes if METRICS_DIR is set, otherwise of current worker process
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    metrics_dir = current_app.config['METRICS_DIR']
+    if metrics_dir:
+        write_worker_metrics(metrics_dir)
+        worker_metrics = merge_worker_metrics(metrics_dir)
+    else:
+        worker_metrics = get_worker_metrics()
+    lines = []
+    lines.append('# HELP financial_request_stage_seconds Time spent in each stage of a request, the stage total is the whole request.')
+    lines.append('# TYPE financial_request_stage_seconds histogram')
+    for route, stage, item in sorted(worker_metrics['stages'], key=lambda x: x[:2]):
+        format_histogram(lines, 'financial_request_stage_seconds', 'route="%s",stage="%s"' % (route, stage), item, METRICS_SECONDS_BUCKETS)
+    lines.append('# HELP financial_request_rows Rows read from database by a request.')
+    lines.append('# TYPE financial_request_rows histogram')
+    for route, item in sorted(worker_metrics['rows'], key=lambda x: x[0]):
+        format_histogram(lines, 'financial_request_rows', 'route="%s"' % (route), item, METRICS_ROWS_BUCKETS)
+    lines.append('# HELP financial_requests_total Requests by route and status.')
+    lines.append('# TYPE financial_requests_total counter')
+    for route, status, count in sorted(worker_metrics['requests']):
+        lines.append('financial_requests_total{route="%s",status="%d"} %d' % (route, status, count))
+    for name in ['hits', 'misses', 'evictions']:
+        lines.append('# TYPE financial_cache_%s_total counter' % (name))
+        lines.append('financial_cache_%s_total %d' % (name, worker_metrics['cache'][name]))
+    lines.append('# TYPE financial_cache_size gauge')
+    lines.append('financial_cache_size %d' % (worker_metrics['cache']['size']))
+    lines.append('# TYPE financial_db_pool_idle gauge')
+    lines.append('financial_db_pool_idle %d' % (worker_metrics['db_pool_idle']))
+    return current_app.response_class('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+# This functoin is used to create the flask app, the server is not started so that the app can be imported by a WSGI server
+# input : config - configuration to override the default configuration, None if no override
+# output : app - flask app
+def create_app(config=None):
+    # Create flask app and set configuration
+    app = flask.Flask(__name__)
+    app.config["DEBUG"] = os.environ.get('FINANCIAL_DEBUG', '0') == '1'
+    # Database file and connection pool configuration, can be overridden by environment variables
+    app.config['DATABASE'] = os.environ.get('FINANCIAL_DATABASE', 'financial_data.db')
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('FINANCIAL_DB_POOL_SIZE', '8'))
+    app.config['DB_MMAP_SIZE'] = int(os.environ.get('FINANCIAL_DB_MMAP_SIZE', '268435456'))
+    app.config['DB_CACHE_SIZE'] = int(os.environ.get('FINANCIAL_DB_CACHE_SIZE', '-16384'))
+    # Response cache configuration, set CACHE_SIZE as 0 to disable the cache
+    app.config['CACHE_SIZE'] = int(os.environ.get('FINANCIAL_CACHE_SIZE', '1024'))
+    app.config['CACHE_TTL'] = float(os.environ.get('FINANCIAL_CACHE_TTL', '3600'))
+    # Max number of [symbol] x [period] calculated by one batch statistics request
+    app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('FINANCIAL_BATCH_MAX_ITEMS', '1000'))
+    # Number of rows read from database for each chunk of the streaming export
+    app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('FINANCIAL_EXPORT_BATCH_SIZE', '1000'))
+    # Request timing histograms exposed by /metrics, and the Server-Timing header of each response
+    app.config['METRICS_ENABLED'] = os.environ.get('FINANCIAL_METRICS', '1') == '1'
+    app.config['SERVER_TIMING'] = os.environ.get('FINANCIAL_SERVER_TIMING', '0') == '1'
+    # Directory shared by the worker processes, each worker writes its changed metrics to it every METRICS_WRITE_INTERVAL seconds and /metrics sums them
+    app.config['METRICS_DIR'] = os.environ.get('FINANCIAL_METRICS_DIR')
+    app.config['METRICS_WRITE_INTERVAL'] = float(os.environ.get('FINANCIAL_METRICS_WRITE_INTERVAL', '1.0'))
+    # Profiling of the requests slower than PROFILE_SLOW_SECONDS and the sampled requests, the profiles are written to PROFILE_DIR
+    # PROFILE_MODE is sample (stack sampling by a thread every PROFILE_INTERVAL seconds) or cprofile (one request at a time)
+    app.config['PROFILE_ENABLED'] = os.environ.get('FINANCIAL_PROFILE', '0') == '1'
+    app.config['PROFILE_MODE'] = os.environ.get('FINANCIAL_PROFILE_MODE', 'sample')
+    app.config['PROFILE_SLOW_SECONDS'] = float(os.environ.get('FINANCIAL_PROFILE_SLOW_SECONDS', '1.0'))
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('FINANCIAL_PROFILE_SAMPLE_RATE', '0'))
+    app.config['PROFILE_INTERVAL'] = float(os.environ.get('FINANCIAL_PROFILE_INTERVAL', '0.005'))
+    app.config['PROFILE_DIR'] = os.environ.get('FINANCIAL_PROFILE_DIR', 'profiles')
+    app.config['PROFILE_MAX_FILES'] = int(os.environ.get('FINANCIAL_PROFILE_MAX_FILES', '100'))
+    app.config['PROFILE_TOP_FUNCTIONS'] = int(os.environ.get('FINANCIAL_PROFILE_TOP_FUNCTIONS', '100'))
+    # Serve the data from the read-only snapshot published by get_raw_data.py, the default file is DATABASE + '.snapshot'
+    app.config['SNAPSHOT_ENABLED'] = os.environ.get('FINANCIAL_SNAPSHOT', '1') == '1'
+    app.config['SNAPSHOT_FILE'] = os.environ.get('FINANCIAL_SNAPSHOT_FILE')
+    # Answer If-None-Match and If-Modified-Since by the versions of each stock published by get_raw_data.py
+    app.config['CONDITIONAL_GET_ENABLED'] = os.environ.get('FINANCIAL_CONDITIONAL_GET', '1') == '1'
+    # Serializer of the JSON rows, fast (the rows are formatted from the query result) or flask (a dict is built for each row and serialized by jsonify)
+    app.config['JSON_SERIALIZER'] = os.environ.get('FINANCIAL_JSON_SERIALIZER', 'fast')
+    # Compress the responses larger than COMPRESS_MIN_SIZE bytes by gzip or zstd as accepted by the client, the levels trade CPU time for bytes
+    app.config['COMPRESS_ENABLED'] = os.environ.get('FINANCIAL_COMPRESS', '1') == '1'
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('FINANCIAL_COMPRESS_MIN_SIZE', '1024'))
+    app.config['GZIP_LEVEL'] = int(os.environ.get('FINANCIAL_GZIP_LEVEL', '1'))
+    app.config['ZSTD_LEVEL'] = int(os.environ.get('FINANCIAL_ZSTD_LEVEL', '3'))
+    if config:
+        app.config.update(config)
+    # Register the API and return the database connection to the pool after each request
+    app.register_blueprint(api)
+    app.teardown_appcontext(release_db)
+    # Record the timing of each request
+    app.before_request(start_timing)
+    app.after_request(finish_timing)
+    # Profile the slow or sampled requests, the profile is finished after the streaming response is sent
+    app.before_request(start_profile)
+    app.after_request(record_profile_status)
+    app.teardown_request(finish_profile)
+    # Add the ETag and Last-Modified of the covered data
+    app.after_request(add_validators)
+    # Compress the response, it is registered last so that it runs before the other after request functions and its time is recorded
+    app.after_request(compress_response)
+    return app
 
 
-# Run the application
-app.run(host='0.0.0.0')
+# Run the application with the development server, use a WSGI server such as gunicorn in production
+if __name__ == '__main__':
+    create_app().run(host='0.0.0.0')
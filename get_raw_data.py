@@ -4,18 +4,21 @@
 #         1. Get API Key from encrypted key files.
 #         2. Open local database, create the database if it doesn't exist.
 #         3. Check table in database, create the table if it doesn't exist.
-#         4. Do house keeping to delete the old data from table. 2 weeks is the limitation.
-#         5. Get the financial data of two given stocks (IBM, Apple Inc.) by AlphaVantage free API.
-#         6. Insert the most recently two weeks financial data to database. 
+#         4. Do house keeping to drop the monthly partitions of the old data. 2 weeks is the default limitation.
+#         5. Get the financial data of the configured stocks (IBM, Apple Inc. by default) by AlphaVantage free API concurrently.
+#         6. Insert the most recently two weeks financial data to database in batches while the data is received. 
+#         7. Publish the data version of each stock and a read-only snapshot of all the data for the API server.
 #
 # Remark : 
 #     Please call "python encryptAPIKEY.py" once to create the encrypted key files before the first time using this program.
 #     This program can be put into the crontab to auto process everyday to update the data in database. 
+#     The stocks, AlphaVantage url, request rate, retry and timeout can be configured by environment variables, see README.md.
 #######################################################################################################################################################
 
 
 # CSV data process
-import pandas as pd
+import csv
+import itertools
 # Get data from url
 import requests as rq
 # Get today date
@@ -27,6 +30,65 @@ from sqlite3 import Error
 import decryptAPIKEY as decrypt
 # File operation
 import os
+import json
+# Fetch the stocks concurrently under the rate limit
+import threading
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Version of the database schema, it is stored in the user_version of database and increased when schema.sql or partition.sql changes
+SCHEMA_VERSION = 7
+# Database file name
+DATABASE = os.environ.get('FINANCIAL_DATABASE', 'financial_data.db')
+# Number of days of the data kept in database, the older data is removed by house keeping
+RETENTION_DAYS = int(os.environ.get('FINANCIAL_RETENTION_DAYS', '14'))
+# Schema of financial_data and financial_data_cumsum before version 6, they are single tables instead of the views of the monthly partitions
+# It is only used to migrate the database created by an old schema
+UNPARTITIONED_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS financial_data(symbol text, date text, open_price real, close_price real, volume integer, UNIQUE(symbol, date));
+CREATE INDEX IF NOT EXISTS financial_data_symbol_date ON financial_data(symbol, date, open_price, close_price, volume);
+CREATE TABLE IF NOT EXISTS financial_data_cumsum(symbol text, date text, row_count integer, cum_open_price integer, cum_close_price integer, cum_volume integer, open_price real, close_price real, volume integer, PRIMARY KEY(symbol, date)) WITHOUT ROWID;
+'''
+# Bucket of the bars in financial_bar table for each interval, it is the first date of the week (Monday) or the month of the date column
+BAR_INTERVALS = {'week': ''' date(date, 'weekday 0', '-6 days') ''', 'month': ''' substr(date, 1, 8) || '01' '''}
+# AlphaVantage query url, it can be changed to a local stub server for testing
+BASE_URL = os.environ.get('ALPHAVANTAGE_BASE_URL', 'https://www.alphavantage.co/query')
+# Stocks to be fetched, separated by comma, or one stock per line in the FINANCIAL_SYMBOLS_FILE
+SYMBOLS = os.environ.get('FINANCIAL_SYMBOLS', 'IBM,AAPL')
+SYMBOLS_FILE = os.environ.get('FINANCIAL_SYMBOLS_FILE')
+# Max requests per minute and max burst requests allowed by the API Key, the free API Key allows 5 requests per minute
+REQUESTS_PER_MINUTE = float(os.environ.get('FETCH_REQUESTS_PER_MINUTE', '5'))
+REQUESTS_BURST = int(os.environ.get('FETCH_REQUESTS_BURST', '5'))
+# Number of concurrent requests
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '4'))
+# Seconds to wait for the response of one request
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', '30'))
+# Retry times and the first backoff seconds, the backoff is doubled for each retry
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', '3'))
+FETCH_BACKOFF = float(os.environ.get('FETCH_BACKOFF', '2'))
+# Number of rows inserted into table at once
+INSERT_BATCH_SIZE = int(os.environ.get('INSERT_BATCH_SIZE', '1000'))
+# Max number of batches waiting to be inserted, the fetching threads wait when the queue is full so that the memory is bounded
+INSERT_QUEUE_SIZE = int(os.environ.get('INSERT_QUEUE_SIZE', '16'))
+# AlphaVantage compact output includes the latest 100 trading days, it covers at least 100 calendar days
+COMPACT_DAYS = 100
+# Summary of each run, including the time spent in each stage of each stock, it is written next to the database by default
+INGEST_SUMMARY_FILE = os.environ.get('INGEST_SUMMARY_FILE', DATABASE + '.summary.json')
+# Read-only snapshot of all the data published for the API server after each ingest, it is written next to the database by default
+SNAPSHOT_FILE = os.environ.get('FINANCIAL_SNAPSHOT_FILE', DATABASE + '.snapshot')
+# Snapshot file layout : magic (8 bytes), header length (8 bytes little endian), JSON header, then each array aligned to SNAPSHOT_ALIGNMENT bytes
+SNAPSHOT_MAGIC = b'FINSNAP1'
+SNAPSHOT_ALIGNMENT = 64
+# Timing and row counts of each stock in current run, each item is stocks name stored in table : {measurement : value}
+#     rate_limit_wait - seconds waiting for the token bucket and the retry backoff
+#     fetch           - seconds waiting for the response from AlphaVantage
+#     parse           - seconds parsing the csv lines
+#     queue_wait      - seconds waiting for the inserting thread when the queue is full
+#     insert          - seconds inserting the data into table
+#     rollup          - seconds updating the cumulative sum, bars, watermark and symbol table
+ingest_metrics = {'lock': threading.Lock(), 'symbols': {}}
 
 
 # This functoin is used to connect to a database
@@ -46,7 +108,7 @@ def db_connection(db_file):
 # output : result = 0 - table doesn't exist
 #          result = 1 - table existes
 def check_table(cur):
-    sql_cmd = ''' SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='financial_data' '''
+    sql_cmd = ''' SELECT COUNT(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name='financial_data' '''
     cur.execute(sql_cmd)
     result = cur.fetchone()[0]
     return result
@@ -59,94 +121,751 @@ def create_table(con, cur):
     # Read table schema from file
     with open('schema.sql', 'r') as fsql:
         sql_cmd = fsql.read()
-        cur.execute(sql_cmd)
+        # The pages of the dropped partitions are returned to the file system by incremental vacuum, it must be set before any table is created
+        cur.executescript(''' PRAGMA auto_vacuum = INCREMENTAL; ''' + sql_cmd + views_schema([]))
+        # Record the schema version of database
+        cur.execute(''' PRAGMA user_version = %d ''' % (SCHEMA_VERSION))
         con.commit()
+
+
+# This functoin is used to get the schema version of database
+# input : cur - db cursor point
+# output : result - schema version, 0 means the database is created before the version is recorded
+def check_schema_version(cur):
+    sql_cmd = ''' PRAGMA user_version '''
+    cur.execute(sql_cmd)
+    result = cur.fetchone()[0]
+    return result
+
+
+# This functoin is used to create the table if it is not existed, or migrate it if it is created by an old schema
+# input : con - db connect point
+#         cur - db cursor point
+def prepare_table(con, cur):
+    if check_table(cur) == 0:
+        create_table(con, cur)
+    else:
+        version = check_schema_version(cur)
+        if version < SCHEMA_VERSION:
+            migrate_table(con, cur, version)
+
+
+# This functoin is used to migrate the table created by an old schema to the current schema, all the changes are done in one transaction
+# input : con     - db connect point
+#         cur     - db cursor point
+#         version - schema version of database
+def migrate_table(con, cur, version):
+    # Read table schema from file
+    with open('schema.sql', 'r') as fsql:
+        schema_cmd = fsql.read()
+    # The months of the data are moved to the monthly partitions by version 6
+    cur.execute(''' SELECT DISTINCT substr(date, 1, 4) || substr(date, 6, 2) FROM financial_data WHERE date IS NOT NULL ORDER BY 1 ''')
+    months = [row[0] for row in cur.fetchall()]
+    sql_cmd = ''' BEGIN; '''
+    # Version 0 store the volume as text and version 1 does not have the unique (symbol, date) constraint, rebuild the table
+    if version < 2:
+        # The index is moved to the renamed table, drop it so that it can be created on the new table
+        sql_cmd = sql_cmd + ''' ALTER TABLE financial_data RENAME TO financial_data_old; DROP INDEX IF EXISTS financial_data_symbol_date; '''
+        # The duplicated (symbol, date) records are ignored, the first inserted one is kept
+        sql_cmd = sql_cmd + UNPARTITIONED_SCHEMA + schema_cmd + '''; INSERT OR IGNORE INTO financial_data(symbol, date, open_price, close_price, volume) SELECT symbol, date, open_price, close_price, CAST(volume AS INTEGER) FROM financial_data_old ORDER BY rowid; DROP TABLE financial_data_old; '''
+    else:
+        # Create the new tables and indexes if they are not existed, the single tables only exist before version 6
+        sql_cmd = sql_cmd + (UNPARTITIONED_SCHEMA if version < 6 else '') + schema_cmd + '''; '''
+    # Version 2 does not have the cumulative sum table, build it from all the data in table
+    if version < 3:
+        sql_cmd = sql_cmd + ''' DELETE FROM financial_data_cumsum; INSERT INTO financial_data_cumsum(symbol, date, row_count, cum_open_price, cum_close_price, cum_volume, open_price, close_price, volume) SELECT symbol, date, ROW_NUMBER() OVER w, SUM(CAST(ROUND(open_price * 10000) AS INTEGER)) OVER w, SUM(CAST(ROUND(close_price * 10000) AS INTEGER)) OVER w, SUM(volume) OVER w, open_price, close_price, volume FROM financial_data WINDOW w AS (PARTITION BY symbol ORDER BY date ROWS UNBOUNDED PRECEDING); '''
+    # Version 3 does not have the watermark table, use the last date of each stock in table
+    if version < 4:
+        sql_cmd = sql_cmd + ''' INSERT OR REPLACE INTO ingest_watermark(symbol, last_date) SELECT symbol, MAX(date) FROM financial_data GROUP BY symbol; '''
+    # Version 4 does not have the symbol table, use the symbols in table
+    if version < 5:
+        sql_cmd = sql_cmd + ''' INSERT OR IGNORE INTO financial_symbol(symbol) SELECT DISTINCT symbol FROM financial_data; '''
+    # Version 5 stores all the data in one table, move the data of each month to its partition and replace the tables by the views of the partitions
+    if version < 6:
+        for month in months:
+            sql_cmd = sql_cmd + partition_schema(month)
+            sql_cmd = sql_cmd + ''' INSERT INTO financial_data_%s(symbol, date, open_price, close_price, volume) SELECT symbol, date, open_price, close_price, volume FROM financial_data WHERE date BETWEEN '%s' AND '%s'; ''' % ((month, ) + month_range(month))
+            sql_cmd = sql_cmd + ''' INSERT INTO financial_data_cumsum_%s SELECT symbol, date, row_count, cum_open_price, cum_close_price, cum_volume, open_price, close_price, volume FROM financial_data_cumsum WHERE date BETWEEN '%s' AND '%s'; ''' % ((month, ) + month_range(month))
+        sql_cmd = sql_cmd + ''' DROP TABLE financial_data; DROP TABLE financial_data_cumsum; ''' + views_schema(months)
+    # Version 6 does not have the bar table, build the bars of each interval from all the data in the partitions
+    if version < 7 and months:
+        sql_cmd = sql_cmd + ''' DELETE FROM financial_bar; ''' + ''.join([bars_query(interval, months, '1') + '; ' for interval in BAR_INTERVALS])
+    sql_cmd = sql_cmd + ''' PRAGMA user_version = %d; COMMIT; ''' % (SCHEMA_VERSION)
+    try:
+        cur.executescript(sql_cmd)
+    except Error as e:
+        # Keep the database as it was if any step of migration fails
+        con.rollback()
+        print('Error : Fail to migrate database schema from version [%s] to version [%s]\n%s' % (version, SCHEMA_VERSION, e))
+        raise
+    # Rebuild the file once to enable the incremental vacuum and return the pages of the old tables to the file system
+    if version < 6:
+        cur.executescript(''' PRAGMA auto_vacuum = INCREMENTAL; VACUUM; ''')
+    print('Migrate database schema from version [%s] to version [%s]' % (version, SCHEMA_VERSION))
      
      
-# This functoin is used to delete the expired data from table by giving the expired date
+# This functoin is used to get the month of the partition which stores the data of a date
+# input : date - date string or date
+# output : month - month of the partition, the format is YYYYMM
+def partition_month(date):
+    return str(date)[:4] + str(date)[5:7]
+
+
+# This functoin is used to get the first and last date string of a month partition
+# input : month - month of the partition, the format is YYYYMM
+# output : first_date, last_date - date strings to be compared with the date column, the last date is always day 31
+def month_range(month):
+    return '%s-%s-01' % (month[:4], month[4:]), '%s-%s-31' % (month[:4], month[4:])
+
+
+# This functoin is used to build the command to create the tables of a month partition and register it in financial_partition table
+# input : month - month of the partition, the format is YYYYMM
+# output : sql_cmd - command of partition.sql for the month
+def partition_schema(month):
+    # Read partition schema from file
+    with open('partition.sql', 'r') as fsql:
+        return fsql.read().replace('{month}', month)
+
+
+# This functoin is used to build the command to create the financial_data and financial_data_cumsum views as the union of all partitions
+# The number of partitions is limited by the max number of terms in a compound select of sqlite, 500 by default (about 41 years)
+# input : months - month list of all partitions
+# output : sql_cmd - command to replace the views
+def views_schema(months):
+    data_cmd = ' UNION ALL '.join([''' SELECT symbol, date, open_price, close_price, volume FROM financial_data_%s ''' % (month) for month in months])
+    cumsum_cmd = ' UNION ALL '.join([''' SELECT symbol, date, row_count, cum_open_price, cum_close_price, cum_volume, open_price, close_price, volume FROM financial_data_cumsum_%s ''' % (month) for month in months])
+    # An empty view keeps the columns when there is no partition
+    if not months:
+        data_cmd = ''' SELECT NULL AS symbol, NULL AS date, NULL AS open_price, NULL AS close_price, NULL AS volume WHERE 0 '''
+        cumsum_cmd = ''' SELECT NULL AS symbol, NULL AS date, NULL AS row_count, NULL AS cum_open_price, NULL AS cum_close_price, NULL AS cum_volume, NULL AS open_price, NULL AS close_price, NULL AS volume WHERE 0 '''
+    return ''' DROP VIEW IF EXISTS financial_data; CREATE VIEW financial_data AS %s; DROP VIEW IF EXISTS financial_data_cumsum; CREATE VIEW financial_data_cumsum AS %s; ''' % (data_cmd, cumsum_cmd)
+
+
+# This functoin is used to get the first and last date of the bar which includes the date
+# input : date     - date string or date
+#         interval - week or month
+# output : first_date, last_date - date strings of the bar, the bucket of the bar is the first date
+def bar_range(date, interval):
+    date = datetime.date.fromisoformat(str(date))
+    if interval == 'week':
+        first_date = date - datetime.timedelta(days=date.weekday())
+        return str(first_date), str(first_date + datetime.timedelta(days=6))
+    return month_range(partition_month(date))
+
+
+# This functoin is used to build the command to aggregate the daily data of the given partitions into the bars of an interval
+# Each bar has the first open price, the last close price, the summed volume and the number of days of its bucket for each stock
+# input : interval  - week or month
+#         months    - month list of the partitions to be read
+#         condition - condition filter of the daily data, it is used for each partition
+# output : sql_cmd - command to insert the bars into financial_bar table
+def bars_query(interval, months, condition):
+    source = ' UNION ALL '.join([''' SELECT symbol, date, open_price, close_price, volume FROM financial_data_%s WHERE %s ''' % (month, condition) for month in months])
+    # The running aggregates of the last day of a bucket are the aggregates of the whole bucket
+    return ''' INSERT INTO financial_bar(interval, symbol, bucket, first_date, last_date, open_price, close_price, volume, bar_count)
+        SELECT '%s', symbol, bucket, first_date, date, open_price, close_price, volume, bar_count FROM (
+            SELECT symbol, bucket, date, FIRST_VALUE(date) OVER w AS first_date, FIRST_VALUE(open_price) OVER w AS open_price, close_price, SUM(volume) OVER w AS volume, COUNT(*) OVER w AS bar_count, ROW_NUMBER() OVER (PARTITION BY symbol, bucket ORDER BY date DESC) AS rn
+            FROM (SELECT symbol, %s AS bucket, date, open_price, close_price, volume FROM (%s))
+            WINDOW w AS (PARTITION BY symbol, bucket ORDER BY date ROWS UNBOUNDED PRECEDING))
+        WHERE rn = 1 ''' % (interval, BAR_INTERVALS[interval], source)
+
+
+# This functoin is used to get the month list of all partitions
+# input : cur - db cursor point
+# output : months - month list in ascending order
+def get_partitions(cur):
+    sql_cmd = ''' SELECT month FROM financial_partition ORDER BY month '''
+    cur.execute(sql_cmd)
+    months = [row[0] for row in cur.fetchall()]
+    return months
+
+
+# This functoin is used to create the partitions of the given months if they are not existed, the views are replaced in the same transaction
+# input : con    - db connect point
+#         cur    - db cursor point
+#         months - month list of the data to be inserted
+def create_partitions(con, cur, months):
+    partitions = get_partitions(cur)
+    new_months = sorted(set(months) - set(partitions))
+    if new_months:
+        cur.executescript(''' BEGIN; ''' + ''.join([partition_schema(month) for month in new_months]) + views_schema(sorted(partitions + new_months)) + ''' COMMIT; ''')
+
+
+# This functoin is used to delete the expired data by giving the expired date, the partitions before the month of expired date are dropped as a whole
 # input : con  - db connect point
 #         cur  - db cursor point
 #         date - expired date
+# output : True  - some data is removed
+#          False - no data is expired
 def house_keeping(con, cur, date):
-    sql_cmd = ''' DELETE FROM financial_data WHERE date < "%s" ''' % (date)
-    cur.execute(sql_cmd)
-    con.commit()
+    month = partition_month(date)
+    partitions = get_partitions(cur)
+    # Only the daily data decides whether data is removed, the rebuilt bar of the expired date is not counted
+    removed = any([item < month for item in partitions])
+    if not removed and month in partitions:
+        cur.execute(''' SELECT EXISTS(SELECT 1 FROM financial_data_%s WHERE date < ?) ''' % (month), [str(date)])
+        removed = cur.fetchone()[0] == 1
+    if not removed:
+        return False
+    sql_cmd = ''' BEGIN; '''
+    for expired_month in [item for item in partitions if item < month]:
+        sql_cmd = sql_cmd + ''' DROP TABLE financial_data_%s; DROP TABLE financial_data_cumsum_%s; DELETE FROM financial_partition WHERE month = '%s'; ''' % (expired_month, expired_month, expired_month)
+    # Only the partition of the expired date deletes the expired rows, it has at most one month of data
+    # The cumulative sum of the remaining data is still right, the statistics is calculated from the difference of two cumulative sums
+    if month in partitions:
+        sql_cmd = sql_cmd + ''' DELETE FROM financial_data_%s WHERE date < '%s'; DELETE FROM financial_data_cumsum_%s WHERE date < '%s'; ''' % (month, date, month, date)
+    # The expired bars are deleted and the bar of the expired date is built again from the remaining data of its bucket
+    for interval in BAR_INTERVALS:
+        first_date, last_date = bar_range(date, interval)
+        sql_cmd = sql_cmd + ''' DELETE FROM financial_bar WHERE interval = '%s' AND bucket <= '%s'; ''' % (interval, first_date)
+        months = [item for item in partitions if item >= month and item <= partition_month(last_date)]
+        if months:
+            sql_cmd = sql_cmd + bars_query(interval, months, ''' date >= '%s' AND date <= '%s' ''' % (date, last_date)) + '; '
+    sql_cmd = sql_cmd + views_schema([item for item in partitions if item >= month]) + ''' COMMIT; '''
+    cur.executescript(sql_cmd)
+    # Return the free pages to the file system, it does nothing if the database is not in incremental vacuum mode
+    cur.execute(''' PRAGMA incremental_vacuum ''').fetchall()
+    return True
 
 
-# This functoin is used to insert the data to table
+# This functoin is used to insert the data to table in one transaction, the data already existed in table is ignored
 # input : con  - db connect point
 #         cur  - db cursor point
-#         data - data to be insert into table, the format is [data1, data2, data3, data4, data5], where data1, data2, data5 is str and data3, data4 is float
-# output : result - the row id for this insert    
+#         data - data list to be insert into table, the format of each item is [data1, data2, data3, data4, data5], where data1, data2 is str, data3, data4 is float and data5 is int
+# output : result - the number of inserted rows
 def insert_table(con, cur, data):
-    sql_cmd = ''' INSERT INTO financial_data(symbol, date, open_price, close_price, volume) VALUES(?,?,?,?,?) '''
-    cur.execute(sql_cmd, data)
-    result = cur.lastrowid
-    con.commit()
-    return result
-
-
-# This functoin is used to check if the data is already exist in table
-# input : cur  - db cursor point
-#         data - condition data to be select from table, the format is [data1, data2], where data1, data2 is str
-# output : result = 0 - data doesn't exist
-#          result = 1 - data existes
-def check_data_exist(cur, data):
-    sql_cmd = ''' SELECT COUNT(*) FROM financial_data WHERE symbol=? AND date=? '''
-    cur.execute(sql_cmd, data)
-    result = cur.fetchone()[0]
+    # Each row is inserted into the partition of its month
+    partitions = {}
+    for row in data:
+        partitions.setdefault(partition_month(row[1]), []).append(row)
+    create_partitions(con, cur, list(partitions))
+    result = 0
+    with con:
+        for month in partitions:
+            sql_cmd = ''' INSERT INTO financial_data_%s(symbol, date, open_price, close_price, volume) VALUES(?,?,?,?,?) ON CONFLICT(symbol, date) DO NOTHING ''' % (month)
+            cur.executemany(sql_cmd, partitions[month])
+            result += cur.rowcount
     return result
     
     
-# This functoin is used to get data by AlphaVantage free API and write the getting data to a csv file
-# input : symbol - stocks name, available value are IBM and AAPL 
-#         apikey - api key from AlphaVantage https://www.alphavantage.co/support/#api-key 
-def get_financial_data(symbol, apikey):
-    url = 'https://www.alphavantage.co/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol=%s&datatype=csv&apikey=%s' % (symbol, apikey)
-    rqdata = rq.get(url)
-    # Open csv file
-    with open('financial_data_%s.csv' % (symbol), 'w') as fcsv:
-        fcsv.write(rqdata.text)
-
-
-# This functoin is used to get the data from csv file and then insert the unexpired data into table, duplicated data will be ignored
+# This functoin is used to update the cumulative sum table of a stock from the given date, the cumulative sum before the date is not changed
+# The prices are summed as integer in unit of 0.0001, so that the difference of two cumulative sums is exact
 # input : con    - db connect point
 #         cur    - db cursor point
-#         symbol - stocks name, available value are IBM and AAPL
-#         date   - expired date
-def fill_financial_data(con, cur, symbol, date):
-    if os.path.exists('financial_data_%s.csv' % (symbol)):
-        # Read data from csv file
-        financial_data = pd.read_csv('financial_data_%s.csv' % (symbol))
-        os.remove('financial_data_%s.csv' % (symbol))
-    else:
-        print('Error : File financial_data_%s.csv doesn\'t exist\nNo data to be inserted into db' % (symbol))
-        return
-    # Get the line count
-    nrows = financial_data.shape[0]
-    # Do nothing if line less than 1
-    if nrows < 1:
-        print('Error : File financial_data_%s.csv doesn\'t have dada in it' % (symbol))
+#         symbol - stocks name stored in table
+#         date   - first date of the changed data
+def update_cumsum(con, cur, symbol, date):
+    month = partition_month(date)
+    partitions = get_partitions(cur)
+    # Get the cumulative sum before the changed data, it is in the newest partition which has the data of the stock before the date
+    base = None
+    for item in reversed([item for item in partitions if item <= month]):
+        sql_cmd = ''' SELECT row_count, cum_open_price, cum_close_price, cum_volume FROM financial_data_cumsum_%s WHERE symbol=? AND date<? ORDER BY date DESC LIMIT 1 ''' % (item)
+        cur.execute(sql_cmd, [symbol, date])
+        base = cur.fetchone()
+        if base is not None:
+            break
+    if base is None:
+        base = [0, 0, 0, 0]
+    with con:
+        # Rebuild the partitions from the month of the changed data, the running sums of each partition continue from the previous partition
+        for item in [item for item in partitions if item >= month]:
+            sql_cmd = ''' DELETE FROM financial_data_cumsum_%s WHERE symbol=? AND date>=? ''' % (item)
+            cur.execute(sql_cmd, [symbol, date])
+            # Continue the running sums from the base by window function
+            sql_cmd = ''' INSERT INTO financial_data_cumsum_%s(symbol, date, row_count, cum_open_price, cum_close_price, cum_volume, open_price, close_price, volume) SELECT symbol, date, ? + ROW_NUMBER() OVER w, ? + SUM(CAST(ROUND(open_price * 10000) AS INTEGER)) OVER w, ? + SUM(CAST(ROUND(close_price * 10000) AS INTEGER)) OVER w, ? + SUM(volume) OVER w, open_price, close_price, volume FROM financial_data_%s WHERE symbol=? AND date>=? WINDOW w AS (ORDER BY date ROWS UNBOUNDED PRECEDING) ''' % (item, item)
+            cur.execute(sql_cmd, list(base) + [symbol, date])
+            sql_cmd = ''' SELECT row_count, cum_open_price, cum_close_price, cum_volume FROM financial_data_cumsum_%s WHERE symbol=? ORDER BY date DESC LIMIT 1 ''' % (item)
+            cur.execute(sql_cmd, [symbol])
+            base = cur.fetchone() or base
+
+
+# This functoin is used to update the bars of a stock from the bucket of the given date, the bars before the bucket are not changed
+# input : con    - db connect point
+#         cur    - db cursor point
+#         symbol - stocks name stored in table
+#         date   - first date of the changed data
+def update_bars(con, cur, symbol, date):
+    partitions = get_partitions(cur)
+    with con:
+        for interval in BAR_INTERVALS:
+            # Only the partitions from the month of the bucket are read
+            first_date = bar_range(date, interval)[0]
+            sql_cmd = ''' DELETE FROM financial_bar WHERE interval = ? AND symbol = ? AND bucket >= ? '''
+            cur.execute(sql_cmd, [interval, symbol, first_date])
+            months = [item for item in partitions if item >= partition_month(first_date)]
+            if months:
+                cur.execute(bars_query(interval, months, 'symbol = ? AND date >= ?'), [symbol, first_date] * len(months))
+
+
+# This functoin is used to get the watermark (last ingested date) of all stocks
+# input : cur - db cursor point
+# output : watermarks - dict of stocks name stored in table : last ingested date
+def get_watermarks(cur):
+    sql_cmd = ''' SELECT symbol, last_date FROM ingest_watermark '''
+    cur.execute(sql_cmd)
+    watermarks = dict(cur.fetchall())
+    return watermarks
+
+
+# This functoin is used to update the watermark of a stock to the last date in table
+# input : con    - db connect point
+#         cur    - db cursor point
+#         symbol - stocks name stored in table
+def update_watermark(con, cur, symbol):
+    # The last date is in the newest partition which has the data of the stock
+    last_date = None
+    for month in reversed(get_partitions(cur)):
+        sql_cmd = ''' SELECT MAX(date) FROM financial_data_%s WHERE symbol=? ''' % (month)
+        cur.execute(sql_cmd, [symbol])
+        last_date = cur.fetchone()[0]
+        if last_date is not None:
+            break
+    if last_date is None:
         return
+    sql_cmd = ''' INSERT INTO ingest_watermark(symbol, last_date) VALUES(?, ?) ON CONFLICT(symbol) DO UPDATE SET last_date=excluded.last_date '''
+    with con:
+        cur.execute(sql_cmd, [symbol, last_date])
+
+
+# This functoin is used to add the stock into the symbol table, the API server checks the symbol parameter by this table
+# input : con    - db connect point
+#         cur    - db cursor point
+#         symbol - stocks name stored in table
+def register_symbol(con, cur, symbol):
+    sql_cmd = ''' INSERT INTO financial_symbol(symbol) VALUES(?) ON CONFLICT(symbol) DO NOTHING '''
+    with con:
+        cur.execute(sql_cmd, [symbol])
+
+
+# This functoin is used to add the timing and row counts of a stock to the metrics of current run
+# input : name   - stocks name stored in table
+#         values - dictionary of measurement : value to be added
+def record_ingest(name, values):
+    with ingest_metrics['lock']:
+        metrics = ingest_metrics['symbols'].setdefault(name, {})
+        for key in values:
+            metrics[key] = metrics.get(key, 0) + values[key]
+
+
+# This functoin is used to measure the time spent in getting each item from an iterator
+# input : iterator - iterator to be measured, such as the lines of a response
+#         timing   - dictionary to add the time to
+#         key      - key of the time in the dictionary
+# output : the items of the iterator
+def timed_iterator(iterator, timing, key):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timing[key] += time.perf_counter() - start
+        yield item
+
+
+# This functoin is used to get the stock list to be fetched
+# output : symbols - stock list, duplicated stock is removed
+def get_symbols():
+    if SYMBOLS_FILE:
+        with open(SYMBOLS_FILE, 'r') as fsym:
+            symbols = [line.strip() for line in fsym]
+    else:
+        symbols = [symbol.strip() for symbol in SYMBOLS.split(',')]
+    # Remove the empty and duplicated stock, keep the order
+    return list(dict.fromkeys([symbol for symbol in symbols if symbol]))
+
+
+# This functoin is used to create a token bucket to limit the request rate shared by all fetching threads
+# input : rate  - max requests per minute
+#         burst - max requests can be sent at once
+# output : limiter - token bucket
+def create_rate_limiter(rate, burst):
+    limiter = {'rate': rate / 60.0, 'burst': max(1, burst), 'tokens': max(1, burst), 'updated': time.monotonic(), 'lock': threading.Lock()}
+    return limiter
+
+
+# This functoin is used to take one token from the token bucket, it waits until a token is available
+# input : limiter - token bucket
+def acquire_token(limiter):
+    while True:
+        with limiter['lock']:
+            # Refill the tokens by the elapsed time
+            now = time.monotonic()
+            limiter['tokens'] = min(limiter['burst'], limiter['tokens'] + (now - limiter['updated']) * limiter['rate'])
+            limiter['updated'] = now
+            if limiter['tokens'] >= 1:
+                limiter['tokens'] -= 1
+                return
+            wait = (1 - limiter['tokens']) / limiter['rate']
+        time.sleep(wait)
+
+
+# This functoin is used to create a http session shared by all fetching threads, the connection to AlphaVantage is kept alive and reused
+# output : session - http session
+def create_session():
+    session = rq.Session()
+    adapter = rq.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# This functoin is used to get the stock name stored in table
+# input : symbol - stocks name used by AlphaVantage
+# output : name - stocks name stored in table
+def get_symbol_name(symbol):
+    # The symbol APPL is known as Apple Inc.
+    if symbol == "AAPL":
+        return "Apple Inc."
+    return symbol
+
+
+# This functoin is used to parse the csv lines and yield the data after the given date in batches
+# input : symbol - stocks name stored in table
+#         lines  - csv lines, the first line is the index
+#         date   - expired date or watermark, the data at or before it is skipped
+# output : data - data list of one batch, the format of each item is [symbol, date, open_price, close_price, volume]
+def parse_financial_data(symbol, lines, date):
+    reader = csv.reader(lines)
     # Check the index should include ["timestamp","open","close","volume"]
-    index = financial_data.loc[0,:].index
+    index = next(reader, None)
+    if index is None:
+        print('Error : The data of stock [%s] doesn\'t have dada in it' % (symbol))
+        return
     if "timestamp" not in index or "open" not in index or "close" not in index or "volume" not in index:
-        print('Error : File financial_data_%s.csv doesn\'t have available index in it\nNo data to be inserted into db' % (symbol))
+        print('Error : The data of stock [%s] doesn\'t have available index in it\nNo data to be inserted into db' % (symbol))
         return
-    # The symbol APPL is known as Apple Inc.
-    if symbol == "AAPL":
-        symbol = "Apple Inc."
-    # Record how many data to be inserted into table
-    ins_data = 0
-    # Parse for each line in csv file
-    for i in range(nrows):
-        # Only the ["timestamp","open","close","volume"] value is needed
-        ser = financial_data.loc[i, ["timestamp","open","close","volume"]]
-        # Insert the data only when the date of data does not expired and the data does not existed in table
-        if ser.values[0] > str(date) and check_data_exist(cur, [symbol, ser.values[0]]) == 0:
-            insert_table(con, cur, [symbol, ser.values[0], ser.values[1], ser.values[2], str(ser.values[3])])
-            ins_data += 1
-    print('Insert [%s] line into table for stock [%s]' % (ins_data, symbol))
+    # Only the ["timestamp","open","close","volume"] value is needed
+    columns = [index.index("timestamp"), index.index("open"), index.index("close"), index.index("volume")]
+    data = []
+    last_date = None
+    for row in reader:
+        if not row:
+            continue
+        try:
+            # Insert the data only when the date of data is after the expired date or watermark
+            if row[columns[0]] <= str(date):
+                # AlphaVantage gives the newest date first, the rest lines are all older when the dates are descending
+                if last_date is not None and row[columns[0]] < last_date:
+                    break
+                last_date = row[columns[0]]
+                continue
+            last_date = row[columns[0]]
+            data.append([symbol, row[columns[0]], float(row[columns[1]]), float(row[columns[2]]), int(row[columns[3]])])
+        except (ValueError, IndexError):
+            print('Error : The data of stock [%s] has a wrong line %s' % (symbol, row))
+            continue
+        if len(data) >= INSERT_BATCH_SIZE:
+            yield data
+            data = []
+    if data:
+        yield data
+
+
+# This functoin is used to check if the JSON message of AlphaVantage is about the request rate, such a request can be retried later
+# input : message - JSON message returned instead of csv
+# output : True if the message has "Note" or "Information" but no "Error Message"
+def is_throttle_message(message):
+    try:
+        message = json.loads(message)
+    except ValueError:
+        return False
+    return isinstance(message, dict) and 'Error Message' not in message and ('Note' in message or 'Information' in message)
+
+
+# This functoin is used to get data by AlphaVantage free API and put the unexpired data into the queue in batches while the response is received
+# input : symbol     - stocks name, for example IBM and AAPL 
+#         apikey     - api key from AlphaVantage https://www.alphavantage.co/support/#api-key 
+#         date       - expired date or watermark, only the data after it is needed
+#         data_queue - queue of [symbol, data] to be inserted into table
+#         session    - http session, a new session is used if it is None
+#         limiter    - token bucket to limit the request rate, no limit if it is None
+# output : True  - the data is put into the queue
+#          False - fail to get the data after retry, or an error which is not retried such as an invalid symbol
+def get_financial_data(symbol, apikey, date, data_queue, session=None, limiter=None):
+    # The compact output is enough when the needed data is within the latest 100 days, otherwise the full history is needed
+    if str(date) >= str(datetime.date.today() - datetime.timedelta(days=COMPACT_DAYS)):
+        outputsize = 'compact'
+    else:
+        outputsize = 'full'
+    params = {'function': 'TIME_SERIES_DAILY_ADJUSTED', 'symbol': symbol, 'outputsize': outputsize, 'datatype': 'csv', 'apikey': apikey}
+    name = get_symbol_name(symbol)
+    if session is None:
+        session = rq.Session()
+    timing = {'requests': 0, 'rate_limit_wait': 0.0, 'fetch': 0.0, 'parse': 0.0, 'queue_wait': 0.0, 'rows_parsed': 0}
+    try:
+        for retry in range(FETCH_RETRIES + 1):
+            start = time.perf_counter()
+            # Wait for the backoff time before retry
+            if retry > 0:
+                time.sleep(FETCH_BACKOFF * (2 ** (retry - 1)))
+            if limiter:
+                acquire_token(limiter)
+            timing['rate_limit_wait'] += time.perf_counter() - start
+            timing['requests'] += 1
+            try:
+                start = time.perf_counter()
+                with session.get(BASE_URL, params=params, timeout=FETCH_TIMEOUT, stream=True) as rqdata:
+                    timing['fetch'] += time.perf_counter() - start
+                    # Retry when the server is busy or the request rate is over the limit, the other client errors are not changed by a retry
+                    if rqdata.status_code == 429 or rqdata.status_code >= 500:
+                        print('Error : Fail to get the data of stock [%s], retry [%s]\nHTTP status [%s]' % (symbol, retry, rqdata.status_code))
+                        continue
+                    if rqdata.status_code >= 400:
+                        print('Error : Fail to get the data of stock [%s], no retry\nHTTP status [%s]' % (symbol, rqdata.status_code))
+                        return False
+                    # AlphaVantage does not give the charset of csv
+                    rqdata.encoding = 'utf-8'
+                    # The time waiting for the lines is the fetch time, the rest is the parse time
+                    lines = timed_iterator(rqdata.iter_lines(decode_unicode=True), timing, 'fetch')
+                    first_line = next(lines, '')
+                    # AlphaVantage returns a JSON message instead of csv, "Note" or "Information" when the request rate is over the limit and "Error Message" when the request is invalid
+                    if first_line.lstrip().startswith('{'):
+                        message = first_line + ''.join(lines)
+                        if is_throttle_message(message):
+                            print('Error : Fail to get the data of stock [%s], retry [%s]\n%s' % (symbol, retry, message))
+                            continue
+                        # An invalid symbol gets the same error again, it is not retried so that the tokens are left for the other stocks
+                        print('Error : Fail to get the data of stock [%s], no retry\n%s' % (symbol, message))
+                        return False
+                    start = time.perf_counter()
+                    fetch_time = timing['fetch']
+                    queue_wait = timing['queue_wait']
+                    # Parse the lines while they are received, the duplicated data of a retry is ignored when it is inserted
+                    for data in parse_financial_data(name, itertools.chain([first_line], lines), date):
+                        put_start = time.perf_counter()
+                        data_queue.put([name, data])
+                        timing['queue_wait'] += time.perf_counter() - put_start
+                        timing['rows_parsed'] += len(data)
+                    timing['parse'] += time.perf_counter() - start - (timing['fetch'] - fetch_time) - (timing['queue_wait'] - queue_wait)
+                return True
+            except rq.RequestException as e:
+                print('Error : Fail to get the data of stock [%s], retry [%s]\n%s' % (symbol, retry, e))
+        return False
+    finally:
+        record_ingest(name, timing)
+
+
+# This functoin is used to insert the data from the queue into table until all the stocks are finished, only this thread writes the database
+# input : con        - db connect point
+#         cur        - db cursor point
+#         data_queue - queue of [symbol, data] to be inserted into table, [symbol, None, fetched] when the stock is finished
+#                      fetched is False if the response is cut off or failed, the watermark is kept so that the next run fetches the same range again
+#         count      - number of stocks
+# output : ins_date - dict of symbol : first date of inserted data, the stock without inserted data is not included
+def fill_financial_data(con, cur, data_queue, count):
+    # Record how many data to be inserted into table for each stock
+    ins_data = {}
+    # Record the first date of inserted data for each stock
+    ins_date = {}
+    # Record the stocks with a failed insert, the watermark of them is kept to fetch the missing rows again
+    ins_failed = set()
+    while count > 0:
+        item = data_queue.get()
+        symbol, data = item[0], item[1]
+        if data is None:
+            print('Insert [%s] line into table for stock [%s]' % (ins_data.get(symbol, 0), symbol))
+            # AlphaVantage sends the newest data first, the older data of a cut off response is missing
+            if not item[2]:
+                print('Error : The data of stock [%s] is not fully fetched, keep the watermark to fetch the same range in the next run' % (symbol))
+            elif symbol in ins_failed:
+                print('Error : The data of stock [%s] is not fully inserted, keep the watermark to fetch the same range in the next run' % (symbol))
+            # Update the cumulative sum and the bars from the first inserted date, the watermark and the symbol table
+            if symbol in ins_date:
+                start = time.perf_counter()
+                try:
+                    update_cumsum(con, cur, symbol, ins_date[symbol])
+                    update_bars(con, cur, symbol, ins_date[symbol])
+                    if item[2] and symbol not in ins_failed:
+                        update_watermark(con, cur, symbol)
+                    register_symbol(con, cur, symbol)
+                except Error as e:
+                    print('Error : Fail to update the cumulative sum, bars, watermark and symbol table of stock [%s]\n%s' % (symbol, e))
+                record_ingest(symbol, {'rollup': time.perf_counter() - start})
+            record_ingest(symbol, {'rows_inserted': ins_data.get(symbol, 0)})
+            count -= 1
+            continue
+        start = time.perf_counter()
+        try:
+            result = insert_table(con, cur, data)
+        except Error as e:
+            print('Error : Fail to insert the data of stock [%s]\n%s' % (symbol, e))
+            ins_failed.add(symbol)
+            continue
+        finally:
+            record_ingest(symbol, {'insert': time.perf_counter() - start})
+        ins_data[symbol] = ins_data.get(symbol, 0) + result
+        if result > 0:
+            ins_date[symbol] = min([ins_date.get(symbol, data[0][1])] + [row[1] for row in data])
+    return ins_date
+
+
+# This functoin is used to get the data of all stocks concurrently under the rate limit and insert the data into table
+# input : con     - db connect point
+#         cur     - db cursor point
+#         symbols - stock list
+#         apikey  - api key from AlphaVantage
+#         date    - expired date
+# output : ins_date - dict of symbol : first date of inserted data, the stock without inserted data is not included
+def ingest_financial_data(con, cur, symbols, apikey, date):
+    # Only the data after the watermark is fetched and inserted
+    watermarks = get_watermarks(cur)
+    session = create_session()
+    limiter = create_rate_limiter(REQUESTS_PER_MINUTE, REQUESTS_BURST)
+    data_queue = queue.Queue(maxsize=INSERT_QUEUE_SIZE)
+
+    # Get the data of one stock and notify the inserting thread when it is finished, the watermark is only moved if all the data is fetched
+    def fetch(symbol):
+        fetched = False
+        try:
+            fetched = get_financial_data(symbol, apikey, max(str(date), watermarks.get(get_symbol_name(symbol), '')), data_queue, session, limiter)
+        finally:
+            data_queue.put([get_symbol_name(symbol), None, fetched])
+
+    with session, ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for symbol in symbols:
+            executor.submit(fetch, symbol)
+        return fill_financial_data(con, cur, data_queue, len(symbols))
+
+
+# This functoin is used to publish a new data version in the version file of database, the API server drops its cache when the version is changed
+# The file also keeps the version and time of the last change of each stock and of the last house keeping, the API server builds the ETag and Last-Modified of a request from them
+#     version       - data version, it is increased by each publish
+#     last_modified - time of this publish
+#     symbols       - symbol : [version, last_modified] of the last publish which inserted the data of the stock
+#     expired       - {date, version, last_modified} of the last house keeping which removed data, the data before the date is changed by it
+# input : db_file  - database file name
+#         symbols  - stocks changed by this ingest, the stocks in database but not in the version file are also regarded as changed
+#         expired  - expired date if house keeping removed data in this ingest, None if no data is removed
+# output : version - new data version
+def publish_data_version(db_file, symbols=(), expired=None):
+    version_file = db_file + '.version'
+    info = {'version': 0, 'symbols': {}}
+    # Read the current version
+    try:
+        with open(version_file, 'r') as fver:
+            info = json.load(fver)
+        info['version'] = int(info['version'])
+    except (OSError, ValueError, KeyError, TypeError):
+        info = {'version': 0, 'symbols': {}}
+    version = info['version'] + 1
+    last_modified = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    changed = set(symbols)
+    # The stocks inserted before the version of each stock is published are regarded as changed
+    con = db_connection(db_file)
+    if con:
+        try:
+            changed.update([row[0] for row in con.execute(''' SELECT symbol FROM financial_symbol ''') if row[0] not in info.get('symbols', {})])
+        except Error as e:
+            print('Error : Fail to read the symbol table\n%s' % (e))
+        con.close()
+    symbol_versions = dict(info.get('symbols', {}))
+    for symbol in changed:
+        symbol_versions[symbol] = [version, last_modified]
+    output = {'version': version, 'last_modified': last_modified, 'symbols': symbol_versions}
+    if expired is not None:
+        output['expired'] = {'date': str(expired), 'version': version, 'last_modified': last_modified}
+    elif 'expired' in info:
+        output['expired'] = info['expired']
+    # Write to a temp file and rename it, so the reader never sees a partial file
+    with open(version_file + '.tmp', 'w') as fver:
+        json.dump(output, fver)
+    os.replace(version_file + '.tmp', version_file)
+    return version
+
+
+# This functoin is used to publish the read-only snapshot of all the data for the API server, the rows are ordered by symbol and date so that each symbol is a contiguous range
+# The arrays of the snapshot :
+#     key         - symbol index * 2^32 + date + 2^31, sorted, it is used to find the rows of a symbol and period by binary search
+#     symbol      - symbol index of each row, the symbol names are in the header
+#     date        - days since 1970-01-01 of each row
+#     open_price, close_price, volume - data of each row
+#     cum_open_price, cum_close_price, cum_volume - cumulative sums before each row and after the last row, the prices are summed in unit of 0.0001
+# input : db_file       - database file name
+#         version       - data version of the snapshot, the API server only uses the snapshot of the current data version
+#         snapshot_file - snapshot file name, the file is replaced by rename so that a reader never sees a partial file
+# output : rows - number of rows in the snapshot
+def publish_snapshot(db_file, version, snapshot_file):
+    # numpy is only needed here, it is imported after the ingest so that it does not delay the start of the ingest
+    import numpy as np
+    con = db_connection(db_file)
+    cur = con.cursor()
+    names = []
+    parts = {'symbol': [np.zeros(0, dtype='<i4')], 'date': [np.zeros(0, dtype='<i4')], 'open_price': [np.zeros(0, dtype='<f8')], 'close_price': [np.zeros(0, dtype='<f8')], 'volume': [np.zeros(0, dtype='<i8')]}
+    cur.execute(''' SELECT symbol, date, open_price, close_price, volume FROM financial_data ORDER BY symbol ASC, date ASC ''')
+    while True:
+        rows = cur.fetchmany(INSERT_BATCH_SIZE * 10)
+        if not rows:
+            break
+        # A new symbol index starts where the symbol is changed
+        symbol = []
+        for row in rows:
+            if not names or names[-1] != row[0]:
+                names.append(row[0])
+            symbol.append(len(names) - 1)
+        parts['symbol'].append(np.array(symbol, dtype='<i4'))
+        parts['date'].append(np.array([row[1] for row in rows], dtype='datetime64[D]').astype('<i4'))
+        parts['open_price'].append(np.array([row[2] for row in rows], dtype='<f8'))
+        parts['close_price'].append(np.array([row[3] for row in rows], dtype='<f8'))
+        parts['volume'].append(np.array([row[4] for row in rows], dtype='<i8'))
+    # The symbol list of the API is the symbol table, or the symbols in data if the table does not exist
+    try:
+        cur.execute(''' SELECT symbol FROM financial_symbol ORDER BY symbol ASC ''')
+        symbol_list = [row[0] for row in cur.fetchall()]
+    except sql.OperationalError:
+        symbol_list = list(names)
+    cur.close()
+    con.close()
+    arrays = dict([(name, np.concatenate(parts[name])) for name in parts])
+    arrays['key'] = arrays['symbol'].astype('<i8') * 2 ** 32 + arrays['date'] + 2 ** 31
+    # The statistics of rows [first, last) is cum[last] - cum[first]
+    arrays['cum_open_price'] = np.concatenate(([0], np.cumsum(np.rint(arrays['open_price'] * 10000).astype('<i8')))).astype('<i8')
+    arrays['cum_close_price'] = np.concatenate(([0], np.cumsum(np.rint(arrays['close_price'] * 10000).astype('<i8')))).astype('<i8')
+    arrays['cum_volume'] = np.concatenate(([0], np.cumsum(arrays['volume']))).astype('<i8')
+    # The offset of each array is counted from the end of header
+    header = {'version': version, 'rows': len(arrays['key']), 'names': names, 'symbol_list': symbol_list, 'arrays': {}}
+    offset = 0
+    for name in arrays:
+        header['arrays'][name] = [arrays[name].dtype.str, offset, len(arrays[name])]
+        offset = offset + -(-arrays[name].nbytes // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    header_bytes = header_bytes.ljust(-(-(16 + len(header_bytes)) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT - 16)
+    # Write to a temp file and rename it, the API server keeps using the old snapshot until it sees the new file
+    with open(snapshot_file + '.tmp', 'wb') as fsnap:
+        fsnap.write(SNAPSHOT_MAGIC + len(header_bytes).to_bytes(8, 'little') + header_bytes)
+        for name in arrays:
+            data = arrays[name].tobytes()
+            fsnap.write(data.ljust(-(-len(data) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT, b'\0'))
+        fsnap.flush()
+        os.fsync(fsnap.fileno())
+    os.replace(snapshot_file + '.tmp', snapshot_file)
+    return header['rows']
+
+
+# This functoin is used to print the summary of current run and write it to INGEST_SUMMARY_FILE
+# input : stages - dictionary of stage : seconds spent in the stage of the whole run
+# output : summary - dictionary of the stages, the totals of all stocks and the measurements of each stock
+def write_ingest_summary(stages):
+    with ingest_metrics['lock']:
+        symbols = dict([(name, dict(ingest_metrics['symbols'][name])) for name in ingest_metrics['symbols']])
+    columns = ['requests', 'rate_limit_wait', 'fetch', 'parse', 'queue_wait', 'insert', 'rollup', 'rows_parsed', 'rows_inserted']
+    totals = dict([(column, sum([symbols[name].get(column, 0) for name in symbols])) for column in columns])
+    print('%-20s %8s %10s %9s %9s %10s %9s %9s %11s %13s' % ('Stock', 'requests', 'ratelimit', 'fetch', 'parse', 'queuewait', 'insert', 'rollup', 'rows_parsed', 'rows_inserted'))
+    for name in sorted(symbols) + ['Total']:
+        values = totals if name == 'Total' else symbols[name]
+        print('%-20s %8d %10.3f %9.3f %9.3f %10.3f %9.3f %9.3f %11d %13d' % tuple([name] + [values.get(column, 0) for column in columns]))
+    print('Stages : %s' % (', '.join(['%s %.3fs' % (stage, stages[stage]) for stage in stages])))
+    summary = {'finished': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'stages': stages, 'totals': totals, 'symbols': symbols}
+    # Write to a temp file and rename it, so the reader never sees a partial file
+    try:
+        with open(INGEST_SUMMARY_FILE + '.tmp', 'w') as fjson:
+            json.dump(summary, fjson, indent=2)
+        os.replace(INGEST_SUMMARY_FILE + '.tmp', INGEST_SUMMARY_FILE)
+    except OSError as e:
+        print('Error : Fail to write the summary file [%s]\n%s' % (INGEST_SUMMARY_FILE, e))
+    return summary
 
 
 # This function is the main function
@@ -156,30 +875,42 @@ def main():
     if my_apikey is None:
         print('Error : The API Key file does not exist.\nPlease execute "\033[91mpython encryptAPIKEY.py\033[0m" to create the API Key file before running this program.')
         return
-    # Get today date and expired date, the expired date is two week
+    # Get today date and expired date, the expired date is two week by default
     today = datetime.date.today()
-    two_weeks_ago = today - datetime.timedelta(days=14)
-    database = "financial_data.db"
+    two_weeks_ago = today - datetime.timedelta(days=RETENTION_DAYS)
+    # Seconds spent in each stage of this run
+    stages = {}
+    start = time.perf_counter()
     # Create a database connection
-    connection = db_connection(database)
+    connection = db_connection(DATABASE)
     with connection:
         # Create a database cursor
         cursor = connection.cursor()
-        # Create the table if it is not existed
-        if check_table(cursor) == 0:
-            create_table(connection, cursor)
+        # Create the table if it is not existed, or migrate the table if it is created by an old schema
+        prepare_table(connection, cursor)
+        stages['prepare'] = time.perf_counter() - start
         # Delete the expired data if existed
-        house_keeping(connection, cursor, two_weeks_ago)
-        # Get the data from url to local csv
-        get_financial_data("IBM", my_apikey)
-        get_financial_data("AAPL", my_apikey)
-        # Insert the data from csv to table
-        fill_financial_data(connection, cursor, "IBM", two_weeks_ago)
-        fill_financial_data(connection, cursor, "AAPL", two_weeks_ago)
+        start = time.perf_counter()
+        removed = house_keeping(connection, cursor, two_weeks_ago)
+        stages['house_keeping'] = time.perf_counter() - start
+        # Get the data from url and insert the data into table
+        start = time.perf_counter()
+        ins_date = ingest_financial_data(connection, cursor, get_symbols(), my_apikey, two_weeks_ago)
+        stages['ingest'] = time.perf_counter() - start
         # Close database cursor
         cursor.close()
     # Close database connection
     connection.close()        
+    # Notify the API server that the data is changed, the database is read until the snapshot of the new version is published
+    version = publish_data_version(DATABASE, list(ins_date), two_weeks_ago if removed else None)
+    start = time.perf_counter()
+    try:
+        publish_snapshot(DATABASE, version, SNAPSHOT_FILE)
+    except (OSError, Error) as e:
+        print('Error : Fail to publish the snapshot file [%s]\n%s' % (SNAPSHOT_FILE, e))
+    stages['snapshot'] = time.perf_counter() - start
+    # Print and save the time spent in each stage of each stock
+    write_ingest_summary(stages)
        
 
 if __name__ == '__main__':
@@ -0,0 +1,22 @@
+CREATE TABLE IF NOT EXISTS financial_data_{month}(
+  symbol text,
+  date text,
+  open_price real,
+  close_price real,
+  volume integer,
+  UNIQUE(symbol, date)
+);
+CREATE INDEX IF NOT EXISTS financial_data_{month}_symbol_date ON financial_data_{month}(symbol, date, open_price, close_price, volume);
+CREATE TABLE IF NOT EXISTS financial_data_cumsum_{month}(
+  symbol text,
+  date text,
+  row_count integer,
+  cum_open_price integer,
+  cum_close_price integer,
+  cum_volume integer,
+  open_price real,
+  close_price real,
+  volume integer,
+  PRIMARY KEY(symbol, date)
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO financial_partition(month) VALUES('{month}');
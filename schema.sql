@@ -1,7 +1,22 @@
-CREATE TABLE financial_data(
+CREATE TABLE IF NOT EXISTS financial_partition(
+  month text PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingest_watermark(
+  symbol text PRIMARY KEY,
+  last_date text
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS financial_symbol(
+  symbol text PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS financial_bar(
+  interval text,
   symbol text,
-  date text,
+  bucket text,
+  first_date text,
+  last_date text,
   open_price real,
   close_price real,
-  volume text
-);
\ No newline at end of file
+  volume integer,
+  bar_count integer,
+  PRIMARY KEY(interval, symbol, bucket)
+) WITHOUT ROWID;
@@ -0,0 +1,81 @@
+#######################################################################################################################################################
+# Description :
+#     This program has the shared fixtures of the tests :
+#         1. Add the project path and the financial path to the import path, so that get_raw_data.py and financial/run.py can be imported.
+#         2. Create a small database with the ingest functions of get_raw_data.py.
+#
+# Remark :
+#     Run the tests under project path, for example : python3 -m pytest -q tests
+#######################################################################################################################################################
+
+
+# Database of the tests
+import datetime
+import os
+import sys
+
+import pytest
+
+# Import get_raw_data.py and financial/run.py from the project path
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'financial'))
+import get_raw_data
+
+# Stocks of the test database
+SYMBOLS = ['IBM', 'AAPL']
+# Number of weekdays of each stock
+DAYS = 60
+# First date of the test data
+FIRST_DATE = datetime.date(2023, 1, 2)
+
+
+# This functoin is used to get the weekdays of the test data
+# input : days - number of weekdays
+# output : dates - date strings from FIRST_DATE
+def get_dates(days=DAYS):
+    dates = [FIRST_DATE + datetime.timedelta(days=i) for i in range(days * 7 // 5 + 7)]
+    return [str(date) for date in dates if date.weekday() < 5][:days]
+
+
+# This functoin is used to get the rows of the test data, the prices have 4 decimal places so that the sums in unit of 0.0001 are checked
+# input : symbol - stock name
+#         index  - index of the stock, each stock has different prices
+#         dates  - date strings of the rows
+# output : data - rows in the format of insert_table()
+def get_rows(symbol, index, dates):
+    return [[symbol, date, 100.0 + index + i + (i * 37 % 100) / 10000, 101.0 + index + i - (i * 53 % 100) / 10000, 1000 * (i + 1)] for i, date in enumerate(dates)]
+
+
+# This functoin is used to create the test database, schema.sql is read from the project path
+# input : database - database file name
+#         symbols  - stocks of the database
+#         days     - number of weekdays of each stock
+def build_database(database, symbols=SYMBOLS, days=DAYS):
+    current_dir = os.getcwd()
+    os.chdir(PROJECT_DIR)
+    try:
+        connection = get_raw_data.db_connection(database)
+        cursor = connection.cursor()
+        get_raw_data.create_table(connection, cursor)
+        dates = get_dates(days)
+        for index, symbol in enumerate(symbols):
+            get_raw_data.insert_table(connection, cursor, get_rows(symbol, index, dates))
+            get_raw_data.update_cumsum(connection, cursor, symbol, dates[0])
+            get_raw_data.update_bars(connection, cursor, symbol, dates[0])
+            get_raw_data.update_watermark(connection, cursor, symbol)
+            get_raw_data.register_symbol(connection, cursor, symbol)
+        cursor.close()
+        connection.close()
+        get_raw_data.publish_data_version(database, symbols)
+    finally:
+        os.chdir(current_dir)
+
+
+# The database shared by the tests of a module, the tests must not change it
+# output : database - database file name
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    database = str(tmp_path_factory.mktemp('database') / 'financial_data.db')
+    build_database(database)
+    return database
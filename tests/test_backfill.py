@@ -0,0 +1,71 @@
+#######################################################################################################################################################
+# Description :
+#     This program will test the resume of backfill.py by the progress file :
+#         1. Backfill a directory of csv files, the finished files are recorded in the progress file.
+#         2. Add a new file and change a finished file, the next run only processes these two files.
+#         3. Check that the database is the same as a backfill of all the files from the beginning.
+#
+# Remark :
+#     Run this program under project path, for example : python3 -m pytest -q tests
+#######################################################################################################################################################
+
+
+# Database of the test
+import sqlite3 as sql
+
+# The test data and import path are in conftest.py
+from conftest import PROJECT_DIR, get_dates, get_rows
+import backfill
+
+# Header of the AlphaVantage TIME_SERIES_DAILY_ADJUSTED csv
+CSV_HEADER = 'timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient\n'
+# Tables compared between the resumed database and the database of one run
+TABLES = {'financial_data': 'symbol, date', 'financial_data_cumsum': 'symbol, date', 'financial_bar': 'interval, symbol, bucket', 'ingest_watermark': 'symbol', 'financial_symbol': 'symbol'}
+
+
+# This functoin is used to write the csv file of a stock, the newest date is the first as AlphaVantage gives
+# input : path  - csv file name
+#         rows  - rows in the format of insert_table()
+def write_csv(path, rows):
+    with open(path, 'w') as fcsv:
+        fcsv.write(CSV_HEADER)
+        for row in sorted(rows, key=lambda x: x[1], reverse=True):
+            fcsv.write('%s,%s,0,0,%s,%s,%d,0,1\n' % (row[1], row[2], row[3], row[3], row[4]))
+
+
+# This functoin is used to read all the rows of the compared tables
+# input : database - database file name
+# output : tables - dict of table name : rows
+def read_tables(database):
+    con = sql.connect(database)
+    tables = dict([(table, con.execute(''' SELECT * FROM %s ORDER BY %s ''' % (table, TABLES[table])).fetchall()) for table in TABLES])
+    con.close()
+    return tables
+
+
+# The resumed run skips the finished files and gives the same database as one run of all the files
+def test_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(PROJECT_DIR)
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    dates = get_dates()
+    write_csv(str(archive / 'IBM.csv'), get_rows('IBM', 0, dates[:40]))
+    write_csv(str(archive / 'AAPL.csv'), get_rows('AAPL', 1, dates))
+    database = str(tmp_path / 'financial_data.db')
+    summary = backfill.run_backfill(database, [str(archive)], 1, '2000-01-01', database + '.backfill', report_interval=None)
+    assert (summary['files_finished'], summary['files_skipped'], summary['rows_inserted']) == (2, 0, 100)
+
+    # Nothing is done when all the files are finished
+    summary = backfill.run_backfill(database, [str(archive)], 1, '2000-01-01', database + '.backfill', report_interval=None)
+    assert (summary['files_finished'], summary['files_skipped'], summary['rows_inserted']) == (0, 2, 0)
+
+    # The new file and the changed file are processed, the rows already in database are ignored
+    write_csv(str(archive / 'IBM.csv'), get_rows('IBM', 0, dates))
+    write_csv(str(archive / 'MSFT.csv'), get_rows('MSFT', 2, dates[10:]))
+    summary = backfill.run_backfill(database, [str(archive)], 1, '2000-01-01', database + '.backfill', report_interval=None)
+    assert (summary['files_finished'], summary['files_skipped'], summary['rows_parsed'], summary['rows_inserted']) == (2, 1, 110, 70)
+
+    expected = str(tmp_path / 'expected.db')
+    summary = backfill.run_backfill(expected, [str(archive)], 1, '2000-01-01', expected + '.backfill', restart=True, report_interval=None)
+    assert summary['files_finished'] == 3
+    assert read_tables(database) == read_tables(expected)
@@ -0,0 +1,75 @@
+#######################################################################################################################################################
+# Description :
+#     This program will test the request-scoped error list of financial/run.py under concurrent requests :
+#         1. Create a small database with the ingest functions of get_raw_data.py by the database fixture of conftest.py.
+#         2. Send overlapping valid and invalid requests of /api/financial_data and /api/statistics from a thread pool.
+#         3. Check that the info.error of each response only has the messages of its own request.
+#
+# Remark :
+#     Run this program under project path, for example : python3 -m pytest -q tests
+#######################################################################################################################################################
+
+
+# Concurrent requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# The database fixture, stocks and import path are in conftest.py
+from conftest import SYMBOLS
+import run
+
+
+# This functoin is used to build the requests, each invalid request has its own wrong values so that a leaked message can be found
+# output : requests - list of (url, own values), own values are the wrong values which may appear in the error messages of the request
+def build_requests():
+    requests = []
+    for i in range(200):
+        symbol = SYMBOLS[i % len(SYMBOLS)]
+        if i % 4 == 0:
+            requests.append(('/api/financial_data?symbol=%s&start_date=2023-01-05&end_date=2023-02-10&limit=7&page=2' % (symbol), []))
+        elif i % 4 == 1:
+            requests.append(('/api/statistics?symbol=%s&start_date=2023-01-05&end_date=2023-02-10' % (symbol), []))
+        elif i % 4 == 2:
+            values = ['BAD%d' % (i), '2023-13-%02d' % (i % 28 + 1), 'x%d' % (i)]
+            requests.append(('/api/financial_data?symbol=%s&start_date=%s&limit=%s' % tuple(values), values))
+        else:
+            values = ['BAD%d' % (i), '2023-02-%02d' % (30 + i % 70)]
+            requests.append(('/api/statistics?symbol=%s&start_date=2023-01-05&end_date=%s' % tuple(values), values))
+    return requests
+
+
+# Concurrent requests must not mix the error messages, and must give the same response as the request sent alone
+@pytest.mark.parametrize('snapshot', [False, True])
+def test_concurrent_error_list(database, snapshot):
+    app = run.create_app({'DATABASE': database, 'CACHE_SIZE': 0, 'SNAPSHOT_ENABLED': snapshot, 'CONDITIONAL_GET_ENABLED': False})
+    requests = build_requests()
+    all_values = set([value for url, values in requests for value in values])
+    clients = threading.local()
+
+    # Each thread has its own test client
+    def send(request):
+        if not hasattr(clients, 'client'):
+            clients.client = app.test_client()
+        response = clients.client.get(request[0])
+        assert response.status_code == 200
+        return response.get_json()
+
+    # The expected response of each request is the response of the same request sent alone
+    expected = [send(request) for request in requests]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for rounds in range(3):
+            results = list(executor.map(send, requests))
+            for request, result, expected_result in zip(requests, results, expected):
+                url, values = request
+                errors = result['info']['error']
+                assert errors == expected_result['info']['error'], url
+                assert result == expected_result, url
+                if values:
+                    # Every wrong value of the request is reported, and no wrong value of another request appears
+                    assert all([any(['[%s]' % (value) in error for error in errors]) for value in values]), url
+                    leaked = [value for value in all_values - set(values) if any(['[%s]' % (value) in error for error in errors])]
+                    assert leaked == [], url
+                else:
+                    assert errors == [], url
@@ -0,0 +1,91 @@
+#######################################################################################################################################################
+# Description :
+#     This program will test the conditional requests and the response cache of financial/run.py :
+#         1. A response has the ETag and Last-Modified of the covered data, the same request with If-None-Match or If-Modified-Since gets 304.
+#         2. Publishing a new data version drops the cached responses, only the ETag of the changed stocks is changed.
+#
+# Remark :
+#     Run this program under project path, for example : python3 -m pytest -q tests
+#######################################################################################################################################################
+
+
+# Test cases
+import pytest
+
+# The database fixture, test data and import path are in conftest.py
+from conftest import PROJECT_DIR, build_database, get_dates, get_rows
+import get_raw_data
+import run
+
+# Requests of each endpoint which answers the conditional requests
+URLS = ['/api/financial_data?symbol=IBM&start_date=2023-01-05&end_date=2023-02-10&limit=7&page=2',
+        '/api/statistics?symbol=IBM&start_date=2023-01-05&end_date=2023-02-10',
+        '/api/statistics/batch?symbol=IBM&symbol=AAPL&period=2023-01-05,2023-02-10',
+        '/api/financial_data/bars?symbol=IBM&interval=week&start_date=2023-01-05&end_date=2023-02-10']
+
+
+# The same request gets 304 with the ETag or Last-Modified of the last response, and 200 with another ETag
+@pytest.mark.parametrize('url', URLS)
+def test_not_modified(database, url):
+    app = run.create_app({'DATABASE': database, 'CACHE_SIZE': 0, 'CONDITIONAL_GET_ENABLED': True})
+    client = app.test_client()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.get_json()['info']['error'] == []
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert response.cache_control.no_cache
+    not_modified = client.get(url, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b''
+    assert not_modified.headers['ETag'] == etag
+    assert client.get(url, headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+    # If-Modified-Since is ignored when If-None-Match is given
+    assert client.get(url, headers={'If-None-Match': '"other"', 'If-Modified-Since': response.headers['Last-Modified']}).status_code == 200
+    # The ETag is different for another request
+    assert client.get(url.replace('2023-02-10', '2023-02-09'), headers={'If-None-Match': etag}).status_code == 200
+
+
+# Publishing a new version drops the cache, the responses of the changed stock are built again and the unchanged stock still gets 304
+def test_version_bump(tmp_path, monkeypatch):
+    database = str(tmp_path / 'financial_data.db')
+    build_database(database)
+    app = run.create_app({'DATABASE': database, 'CACHE_SIZE': 16, 'CONDITIONAL_GET_ENABLED': True})
+    client = app.test_client()
+    # The cache is shared by the apps of the same process, start from an empty cache
+    with run.response_cache['lock']:
+        run.response_cache['data'].clear()
+    ibm_url = '/api/statistics?symbol=IBM&start_date=2023-01-05&end_date=2023-12-31'
+    aapl_url = '/api/statistics?symbol=AAPL&start_date=2023-01-05&end_date=2023-12-31'
+    ibm = client.get(ibm_url)
+    aapl = client.get(aapl_url)
+    # The same request is answered from the cache, there is no miss
+    stats = client.get('/api/cache_stats').get_json()['data']
+    assert client.get(ibm_url).get_json() == ibm.get_json()
+    new_stats = client.get('/api/cache_stats').get_json()['data']
+    assert new_stats['hits'] > stats['hits']
+    assert new_stats['misses'] == stats['misses']
+
+    # Ingest one more day of IBM and publish the new version
+    monkeypatch.chdir(PROJECT_DIR)
+    date = get_dates(len(get_dates()) + 1)[-1]
+    connection = get_raw_data.db_connection(database)
+    cursor = connection.cursor()
+    get_raw_data.insert_table(connection, cursor, [get_rows('IBM', 0, [date])[0][:4] + [123456]])
+    get_raw_data.update_cumsum(connection, cursor, 'IBM', date)
+    get_raw_data.update_bars(connection, cursor, 'IBM', date)
+    get_raw_data.update_watermark(connection, cursor, 'IBM')
+    cursor.close()
+    connection.close()
+    get_raw_data.publish_data_version(database, ['IBM'])
+
+    changed = client.get(ibm_url, headers={'If-None-Match': ibm.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != ibm.headers['ETag']
+    assert changed.get_json()['data']['average_daily_volume'] != ibm.get_json()['data']['average_daily_volume']
+    assert client.get(aapl_url, headers={'If-None-Match': aapl.headers['ETag']}).status_code == 304
+    # The cached response of the unchanged stock is also dropped, it is built again with the same content
+    stats = client.get('/api/cache_stats').get_json()['data']
+    assert stats['data_version'] != new_stats['data_version']
+    assert client.get(aapl_url).get_json() == aapl.get_json()
+    assert client.get('/api/cache_stats').get_json()['data']['misses'] > stats['misses']
@@ -0,0 +1,99 @@
+#######################################################################################################################################################
+# Description :
+#     This program will test the database schema of get_raw_data.py :
+#         1. A database of schema version 0 (volume as text, no unique constraint) is migrated to the current schema with the same tables as a new database.
+#         2. House keeping drops the expired monthly partitions and deletes the expired rows, the statistics of the remaining data is not changed.
+#
+# Remark :
+#     Run this program under project path, for example : python3 -m pytest -q tests
+#######################################################################################################################################################
+
+
+# Database of the test
+import sqlite3 as sql
+
+# The test data and import path are in conftest.py
+from conftest import PROJECT_DIR, SYMBOLS, build_database, get_dates, get_rows
+import get_raw_data
+import run
+
+# Schema version 0, the first schema.sql of the project
+SCHEMA_V0 = '''
+CREATE TABLE financial_data(
+  symbol text,
+  date text,
+  open_price real,
+  close_price real,
+  volume text
+);
+'''
+# Tables compared between the migrated database and the new database
+TABLES = {'financial_data': 'symbol, date', 'financial_data_cumsum': 'symbol, date', 'financial_bar': 'interval, symbol, bucket', 'ingest_watermark': 'symbol', 'financial_symbol': 'symbol', 'financial_partition': 'month'}
+
+
+# This functoin is used to read all the rows of the compared tables
+# input : database - database file name
+# output : tables - dict of table name : rows
+def read_tables(database):
+    con = sql.connect(database)
+    tables = dict([(table, con.execute(''' SELECT * FROM %s ORDER BY %s ''' % (table, TABLES[table])).fetchall()) for table in TABLES])
+    tables['user_version'] = con.execute(''' PRAGMA user_version ''').fetchone()[0]
+    tables['volume_type'] = con.execute(''' SELECT DISTINCT typeof(volume) FROM financial_data ''').fetchall()
+    con.close()
+    return tables
+
+
+# The database of version 0 is migrated to the same tables as a database created by the current schema
+def test_migrate_from_version_0(tmp_path, monkeypatch):
+    expected = str(tmp_path / 'new.db')
+    build_database(expected)
+    database = str(tmp_path / 'old.db')
+    con = sql.connect(database)
+    con.executescript(SCHEMA_V0)
+    dates = get_dates()
+    for index, symbol in enumerate(SYMBOLS):
+        rows = [[row[0], row[1], row[2], row[3], '%d' % (row[4])] for row in get_rows(symbol, index, dates)]
+        con.executemany(''' INSERT INTO financial_data VALUES (?, ?, ?, ?, ?) ''', rows)
+        # The duplicated rows are inserted by the old row by row ingest, the first inserted one is kept
+        con.executemany(''' INSERT INTO financial_data VALUES (?, ?, ?, ?, ?) ''', [row[:4] + ['0'] for row in rows[:5]])
+    con.commit()
+    con.close()
+
+    monkeypatch.chdir(PROJECT_DIR)
+    con = get_raw_data.db_connection(database)
+    cur = con.cursor()
+    get_raw_data.prepare_table(con, cur)
+    assert get_raw_data.check_schema_version(cur) == get_raw_data.SCHEMA_VERSION
+    assert get_raw_data.get_partitions(cur) == ['202301', '202302', '202303']
+    # Preparing the migrated database again does nothing
+    get_raw_data.prepare_table(con, cur)
+    cur.close()
+    con.close()
+    assert read_tables(database) == read_tables(expected)
+
+
+# House keeping drops the partitions before the expired date and deletes the expired rows of its partition, it reports the removal only once
+def test_house_keeping(tmp_path, monkeypatch):
+    database = str(tmp_path / 'financial_data.db')
+    build_database(database)
+    url = '/api/statistics?symbol=IBM&start_date=2023-02-20&end_date=2023-03-10&metrics=vwap,volatility'
+    bars_url = '/api/financial_data/bars?symbol=AAPL&interval=week&start_date=2023-02-20&end_date=2023-03-31'
+    app = run.create_app({'DATABASE': database, 'CACHE_SIZE': 0, 'SNAPSHOT_ENABLED': False, 'CONDITIONAL_GET_ENABLED': False})
+    client = app.test_client()
+    expected = [client.get(url).get_json(), client.get(bars_url).get_json()]
+
+    monkeypatch.chdir(PROJECT_DIR)
+    con = get_raw_data.db_connection(database)
+    cur = con.cursor()
+    assert get_raw_data.house_keeping(con, cur, '2023-02-15')
+    assert get_raw_data.get_partitions(cur) == ['202302', '202303']
+    assert cur.execute(''' SELECT COUNT(*) FROM financial_data WHERE date < '2023-02-15' ''').fetchone()[0] == 0
+    assert cur.execute(''' SELECT MIN(date) FROM financial_data ''').fetchone()[0] == '2023-02-15'
+    # The month bars are built again from the remaining data
+    assert cur.execute(''' SELECT symbol, SUM(bar_count) FROM financial_bar WHERE interval = 'month' GROUP BY symbol ORDER BY symbol ''').fetchall() == cur.execute(''' SELECT symbol, COUNT(*) FROM financial_data GROUP BY symbol ORDER BY symbol ''').fetchall()
+    # Nothing is removed by the next run of the same date
+    assert not get_raw_data.house_keeping(con, cur, '2023-02-15')
+    cur.close()
+    con.close()
+    get_raw_data.publish_data_version(database, expired='2023-02-15')
+    assert [client.get(url).get_json(), client.get(bars_url).get_json()] == expected
@@ -0,0 +1,59 @@
+#######################################################################################################################################################
+# Description :
+#     This program will test the snapshot path of financial/run.py :
+#         1. Publish the snapshot of the test database by get_raw_data.py.
+#         2. Send the same requests to an app reading the snapshot and an app reading the database.
+#         3. Check that the responses are the same and the snapshot is really read.
+#
+# Remark :
+#     Run this program under project path, for example : python3 -m pytest -q tests
+#######################################################################################################################################################
+
+
+# Test cases
+import pytest
+
+# The database fixture and import path are in conftest.py
+import get_raw_data
+import run
+
+# Requests of each endpoint, with the periods inside one month, across the months, out of the data, and the wrong parameters
+URLS = ['/api/financial_data?start_date=2023-01-05&end_date=2023-03-10&limit=9&page=3',
+        '/api/financial_data?symbol=AAPL&start_date=2023-02-01&end_date=2023-02-28&limit=50',
+        '/api/financial_data?symbol=IBM&limit=5&page=100',
+        '/api/financial_data/export?symbol=IBM&start_date=2023-01-10&end_date=2023-02-20&format=ndjson',
+        '/api/financial_data/export?start_date=2023-01-10&end_date=2023-02-20&format=csv',
+        '/api/statistics?symbol=IBM&start_date=2023-01-05&end_date=2023-02-10',
+        '/api/statistics?symbol=AAPL&start_date=2023-01-01&end_date=2023-12-31',
+        '/api/statistics?symbol=AAPL&start_date=2023-02-10&end_date=2023-02-01',
+        '/api/statistics?symbol=IBM&start_date=2023-01-05&end_date=2023-03-20&metrics=vwap,average_daily_return,volatility&window=5',
+        '/api/statistics?symbol=IBM&start_date=2024-01-01&end_date=2024-02-01',
+        '/api/statistics?symbol=MSFT&start_date=2023-01-05&end_date=2023-02-10',
+        '/api/statistics/batch?symbol=IBM&symbol=AAPL&period=2023-01-05,2023-02-10&period=2023-01-20,2023-03-25&period=2023-03-01,2023-03-01',
+        '/api/financial_data/bars?symbol=IBM&interval=week&start_date=2023-01-05&end_date=2023-03-10',
+        '/api/financial_data/bars?symbol=AAPL&interval=month&start_date=2023-01-15&end_date=2023-03-20',
+        '/api/financial_data/bars?symbol=IBM&interval=10d&start_date=2023-01-01&end_date=2023-12-31']
+
+
+# The snapshot of the test database, it is published after the data version as get_raw_data.py does
+# output : database - database file name
+@pytest.fixture(scope='module')
+def snapshot_database(database):
+    version = get_raw_data.publish_data_version(database)
+    get_raw_data.publish_snapshot(database, version, database + '.snapshot')
+    return database
+
+
+# The snapshot and the database give the same response, and the snapshot path is used
+@pytest.mark.parametrize('url', URLS)
+def test_snapshot_parity(snapshot_database, url):
+    responses = []
+    for snapshot in [True, False]:
+        app = run.create_app({'DATABASE': snapshot_database, 'CACHE_SIZE': 0, 'SNAPSHOT_ENABLED': snapshot, 'CONDITIONAL_GET_ENABLED': False, 'COMPRESS_ENABLED': False, 'SERVER_TIMING': True})
+        response = app.test_client().get(url)
+        assert response.status_code == 200
+        # The time reading the snapshot is recorded as the snapshot stage, the week and month bars are read from the bar table and an unknown symbol reads no data
+        if 'export' not in url and 'interval=week' not in url and 'interval=month' not in url and 'MSFT' not in url:
+            assert ('snapshot;dur=' in response.headers['Server-Timing']) == snapshot, url
+        responses.append(response.data)
+    assert responses[0] == responses[1], url